@@ -1,34 +1,236 @@
 from django.contrib import admin
-from daraja.models import STKTransaction, B2CTransaction, B2BTransaction, B2CTopup
+from django.contrib.admin.views.main import ChangeList
+from daraja.models import STKTransaction, B2CTransaction, B2BTransaction, B2CTopup, WebhookSubscription, WebhookDelivery, \
+    ArchivedTransaction, Campaign, CampaignRecipient, B2BExpressTransaction, LedgerAccount, JournalEntry, Posting
+from daraja.campaigns import CampaignRunner
+from daraja.msisdn import InvalidMSISDN, normalize
+from daraja.pagination import EstimatedCountPaginator
+from daraja.routers import use_replica
+from daraja.sharding import sharding, use_shard
+
+
+class ReplicaReadAdminMixin:
+    """
+    Serves change lists from a read replica so that heavy filtering does not compete with callback writes.
+    Change forms and actions still read and write the primary.
+    """
+    def changelist_view(self, request, extra_context=None):
+        if request.method != "GET":
+            return super().changelist_view(request, extra_context)
+        with use_replica():
+            response = super().changelist_view(request, extra_context)
+            # The change list querysets are lazy; render while the replica is still selected.
+            if hasattr(response, "render"):
+                response.render()
+        return response
+
+
+class LargeTableChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super().get_queryset(request, exclude_parameters)
+        if self.model_admin.list_only:
+            queryset = queryset.only(*self.model_admin.list_only)
+        return queryset
+
+
+class LargeTableAdminMixin:
+    """
+    Change list settings for tables with millions of rows.
+
+    Counts come from planner estimates and pages are fetched keyset style (see EstimatedCountPaginator), the
+    unfiltered total is never counted, only the list_only columns are loaded and searches are exact matches
+    on indexed columns. A search that is a phone number is normalized and matched against
+    phone_search_field, so "0712 345 678" finds "+254712345678".
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_only = ()
+    phone_search_field = None
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.phone_search_field and search_term:
+            try:
+                msisdn = normalize(search_term)
+            except InvalidMSISDN:
+                pass
+            else:
+                return queryset.filter(**{self.phone_search_field: "+" + msisdn}), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    title = "shard"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.aliases()]
+
+    def queryset(self, request, queryset):
+        if self.value() in sharding.aliases():
+            return queryset.using(self.value())
+        return queryset
+
+
+class ShardedAdminMixin:
+    """
+    Admin for the sharded transaction tables. The change list shows one shard at a time, the default one
+    unless another is picked in the shard filter; searches without a picked shard are run on each shard in
+    turn and show the first shard with matches. Change forms find their row on whichever shard holds it.
+    """
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if sharding.is_sharded(self.model):
+            list_filter = (ShardListFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not sharding.is_sharded(self.model) or ShardListFilter.parameter_name in request.GET:
+            return super().get_search_results(request, queryset, search_term)
+        results = None
+        for alias in sharding.aliases():
+            results = super().get_search_results(request, queryset.using(alias), search_term)
+            if results[0].exists():
+                break
+        return results
+
+    def get_object(self, request, object_id, from_field=None):
+        if not sharding.is_sharded(self.model):
+            return super().get_object(request, object_id, from_field)
+        for alias in sharding.aliases():
+            with use_shard(alias):
+                instance = super().get_object(request, object_id, from_field)
+            if instance is not None:
+                return instance
+        return None
+
+
+CREATED_AT_FILTER = ("created_at", admin.DateFieldListFilter)
+
 
 @admin.register(STKTransaction)
-class STKTransactionModelAdmin(admin.ModelAdmin):
-    list_display = ("phone_number", "checkout_request_id", "amount", "receipt_no",)
-    list_filter = ("status",)
-    search_fields = ("phone_number", "transaction_no",)
+class STKTransactionModelAdmin(ShardedAdminMixin, LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = ("phone_number", "checkout_request_id", "amount", "receipt_no", "status", "created_at")
+    list_filter = ("status", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("checkout_request_id__exact", "receipt_no__exact")
+    phone_search_field = "phone_number"
+
 
 @admin.register(B2CTransaction)
-class B2CTransactionModelAdmin(admin.ModelAdmin):
+class B2CTransactionModelAdmin(ShardedAdminMixin, LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = (
-        "conversation_id",  "transaction_id", "recipient_phonenumber", "recipient_public_name", "transaction_amount"
+        "conversation_id",  "transaction_id", "recipient_phonenumber", "recipient_public_name", "transaction_amount",
+        "status", "created_at"
     )
-    list_filter = ("status",)
-    search_fields = ("recipient_phone_number", "transaction_id",)
+    list_filter = ("status", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("conversation_id__exact", "transaction_id__exact", "originator_conversation_id__exact")
+    phone_search_field = "recipient_phonenumber"
 
 
 @admin.register(B2BTransaction)
-class B2BTransactionModelAdmin(admin.ModelAdmin):
+class B2BTransactionModelAdmin(ShardedAdminMixin, LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = (
-        "conversation_id",  "transaction_id", "recipient_number", "account_reference", "amount", "recipient_type"
+        "conversation_id",  "transaction_id", "recipient_number", "account_reference", "amount", "recipient_type",
+        "status", "created_at"
     )
-    list_filter = ("status", "recipient_type")
-    search_fields = ("recipient_number", "transaction_id",)
+    list_filter = ("status", "recipient_type", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("conversation_id__exact", "transaction_id__exact", "originator_conversation_id__exact")
+
 
 @admin.register(B2CTopup)
-class B2CTopupModelAdmin(admin.ModelAdmin):
+class B2CTopupModelAdmin(ShardedAdminMixin, LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
     list_display = (
-        "conversation_id",  "transaction_id", "paybill_number", "account_reference", "amount"
+        "conversation_id",  "transaction_id", "paybill_number", "account_reference", "amount", "status", "created_at"
+    )
+    list_filter = ("status", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("conversation_id__exact", "transaction_id__exact")
+
+
+@admin.register(B2BExpressTransaction)
+class B2BExpressTransactionModelAdmin(ShardedAdminMixin, LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = (
+        "request_ref_id", "conversation_id", "transaction_id", "receiver_short_code", "amount", "reference", "status",
+        "created_at"
+    )
+    list_filter = ("status", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("request_ref_id__exact", "transaction_id__exact")
+
+
+@admin.register(WebhookSubscription)
+class WebhookSubscriptionModelAdmin(admin.ModelAdmin):
+    list_display = ("url", "event_types", "max_concurrency", "is_active")
+    list_filter = ("is_active",)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryModelAdmin(ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = ("event_id", "subscription", "event_type", "status", "attempts", "response_code", "created_at")
+    list_filter = ("status", "event_type")
+    list_select_related = ("subscription",)
+    search_fields = ("=event_id",)
+    raw_id_fields = ("subscription",)
+
+
+@admin.register(ArchivedTransaction)
+class ArchivedTransactionModelAdmin(LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = ("transaction_type", "object_id", "lookup_value", "status", "created_at", "archived_at")
+    list_filter = ("transaction_type", "status", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("lookup_value__exact",)
+    exclude = ("payload",)
+
+
+@admin.register(LedgerAccount)
+class LedgerAccountModelAdmin(admin.ModelAdmin):
+    list_display = ("code", "name", "kind", "balance", "updated_at")
+    list_filter = ("kind",)
+    readonly_fields = ("balance",)
+
+
+class PostingInline(admin.TabularInline):
+    model = Posting
+    fields = ("account", "amount", "running_balance")
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+
+@admin.register(JournalEntry)
+class JournalEntryModelAdmin(LargeTableAdminMixin, ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = ("description", "transaction_type", "object_id", "created_at")
+    list_filter = ("transaction_type", CREATED_AT_FILTER)
+    list_only = list_display
+    search_fields = ("object_id__exact",)
+    readonly_fields = ("transaction_type", "object_id", "description", "created_at")
+    inlines = (PostingInline,)
+
+
+@admin.register(Campaign)
+class CampaignModelAdmin(admin.ModelAdmin):
+    list_display = (
+        "name", "status", "total_count", "sent_count", "failed_count", "unknown_count", "rate_per_second", "created_at"
     )
     list_filter = ("status",)
-    search_fields = ("paybill_number", "transaction_id",)
+    readonly_fields = ("total_count", "sent_count", "failed_count", "unknown_count")
+    actions = ("pause",)
+
+    @admin.action(description="Pause the selected campaigns")
+    def pause(self, request, queryset):
+        for campaign in queryset:
+            CampaignRunner(campaign).pause()
 
+
+@admin.register(CampaignRecipient)
+class CampaignRecipientModelAdmin(ReplicaReadAdminMixin, admin.ModelAdmin):
+    list_display = ("campaign", "phone_number", "amount", "status", "checkout_request_id", "attempted_at")
+    list_filter = ("status",)
+    list_select_related = ("campaign",)
+    search_fields = ("=checkout_request_id",)
+    raw_id_fields = ("campaign",)
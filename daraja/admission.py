@@ -0,0 +1,149 @@
+import functools
+import logging
+import threading
+import time
+from typing import Dict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+logging = logging.getLogger("default")
+
+DEFAULT_ADMISSION = {
+    "ENABLED": False,
+    # Outbound calls in flight per endpoint and process.
+    "LIMITS": {},
+    "DEFAULT_LIMIT": 20,
+    # Threads per worker process and how many of them are kept for callbacks. Required when ENABLED: the
+    # reservation for callbacks is what admission control is for.
+    "WORKER_THREADS": 0,
+    "RESERVED_FOR_CALLBACKS": 2,
+    # Shed an endpoint while its average call takes longer than this many seconds.
+    "MAX_LATENCY": 15,
+    "LATENCY_ALPHA": 0.2,
+    "RETRY_AFTER": 5,
+}
+
+
+class UpstreamOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "M-Pesa is responding slowly, retry later."
+    default_code = "upstream_overloaded"
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+        self.wait = wait
+
+
+class EndpointStats:
+    __slots__ = ("in_flight", "latency", "admitted", "shed")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.latency = 0.0
+        self.admitted = 0
+        self.shed = 0
+
+
+class AdmissionController:
+    """
+    Limits the outbound checkout calls a worker process has in flight, so a slow Safaricom cannot tie up
+    every worker thread and starve the callback endpoints.
+
+    A checkout is refused with 429 when its endpoint is at its LIMITS concurrency, or when admitting it would
+    leave fewer than RESERVED_FOR_CALLBACKS of the WORKER_THREADS free. It is refused with 503 while the
+    moving average of the endpoint's call latency is above MAX_LATENCY; one call at a time still goes through
+    then, so the average recovers when Safaricom does. Both carry a Retry-After header. Callback views are
+    never limited. Off by default, as WORKER_THREADS has to match the server's threads per process.
+    """
+    def __init__(self):
+        self._stats: Dict[str, EndpointStats] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        config = {**DEFAULT_ADMISSION, **getattr(settings, "DARAJA_ADMISSION", {})}
+        if config["ENABLED"] and not config["WORKER_THREADS"]:
+            raise ImproperlyConfigured("DARAJA_ADMISSION needs WORKER_THREADS when it is enabled")
+        return config
+
+    def stats(self, endpoint: str) -> EndpointStats:
+        stats = self._stats.get(endpoint)
+        if stats is None:
+            stats = self._stats.setdefault(endpoint, EndpointStats())
+        return stats
+
+    def acquire(self, endpoint: str, config: dict):
+        wait = config["RETRY_AFTER"]
+        with self._lock:
+            stats = self.stats(endpoint)
+            limit = config["LIMITS"].get(endpoint, config["DEFAULT_LIMIT"])
+            capacity = config["WORKER_THREADS"] - config["RESERVED_FOR_CALLBACKS"]
+            if stats.in_flight >= limit or self._in_flight >= capacity:
+                stats.shed += 1
+                raise Throttled(wait=wait, detail="Too many {} requests in progress, retry later.".format(endpoint))
+            if stats.latency > config["MAX_LATENCY"] and stats.in_flight:
+                stats.shed += 1
+                raise UpstreamOverloaded(wait=wait)
+            stats.in_flight += 1
+            stats.admitted += 1
+            self._in_flight += 1
+
+    def release(self, endpoint: str, elapsed: float, config: dict):
+        """
+        Frees the endpoint's slot. elapsed is None for requests rejected before calling Safaricom, which
+        say nothing about its latency.
+        """
+        with self._lock:
+            stats = self.stats(endpoint)
+            stats.in_flight -= 1
+            self._in_flight -= 1
+            if elapsed is not None:
+                alpha = config["LATENCY_ALPHA"]
+                stats.latency = elapsed if not stats.latency else alpha * elapsed + (1 - alpha) * stats.latency
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    "in_flight": stats.in_flight, "latency": round(stats.latency, 3),
+                    "admitted": stats.admitted, "shed": stats.shed,
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+    def admit(self, endpoint: str):
+        """
+        Decorates a checkout view's post with admission control for endpoint.
+        """
+        def decorator(view_method):
+            @functools.wraps(view_method)
+            def wrapper(view, request, *args, **kwargs):
+                config = self.config
+                if not config["ENABLED"]:
+                    return view_method(view, request, *args, **kwargs)
+                try:
+                    self.acquire(endpoint, config)
+                except APIException:
+                    logging.warning("Shed {} request, {}".format(endpoint, self.snapshot().get(endpoint)))
+                    raise
+                started, elapsed = time.monotonic(), None
+                try:
+                    response = view_method(view, request, *args, **kwargs)
+                    elapsed = time.monotonic() - started
+                    return response
+                except APIException:
+                    raise
+                except Exception:
+                    elapsed = time.monotonic() - started
+                    raise
+                finally:
+                    self.release(endpoint, elapsed, config)
+            return wrapper
+        return decorator
+
+
+admission = AdmissionController()
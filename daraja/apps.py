@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class MpesaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'daraja'
+
+    def ready(self):
+        from daraja import balances, caching, events, ledger, notifier, webhooks  # noqa: F401
+        from daraja.warmup import warm_up_on_boot
+
+        warm_up_on_boot()
@@ -0,0 +1,207 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.serializers import ValidationError
+
+from daraja.events import transaction_type_id
+from daraja.models import AccountBalance, B2BTransaction, B2CTopup, B2CTransaction
+from daraja.signals import is_replaying, transaction_updated
+
+logging = logging.getLogger("default")
+
+DEFAULT_BALANCES = {
+    "LOCAL_TTL": 1,
+    "PREFLIGHT": True,
+    # Seconds the payouts debited from a reported balance are kept, should no newer balance be reported.
+    "DEBITS_TTL": 24 * 3600,
+}
+
+# Balance fields parsed from the result callbacks, by the AccountBalance they report.
+BALANCE_FIELDS = {
+    B2CTransaction: {
+        "working_account_balance": "working", "utility_account_balance": "utility",
+        "charges_paid_available_balance": "charges_paid",
+    },
+    B2BTransaction: {"debit_account_balance": "b2b_debit", "initiator_account_current_balance": "b2b_initiator"},
+    B2CTopup: {"debit_account_balance": "topup_debit", "initiator_account_current_balance": "topup_initiator"},
+}
+
+# The result callbacks report transaction times in East Africa Time, without an offset.
+DARAJA_TIME_ZONE = ZoneInfo("Africa/Nairobi")
+
+# B2C payments are paid out of the utility account.
+B2C_PAYOUT_ACCOUNT = "utility"
+
+
+class KnownBalance(NamedTuple):
+    account: str
+    balance: Decimal
+    observed_at: datetime
+
+
+class Reservation(NamedTuple):
+    key: str
+    cents: int
+
+
+class BalanceTracker:
+    """
+    Latest known balance per account, fed by the balances Daraja reports in every result callback.
+
+    Reads are served from process memory for LOCAL_TTL seconds, then from the shared cache, and only fall
+    back to the AccountBalance table when the cache is cold, so checking a balance before a payout costs no
+    call to Safaricom and usually no query. Payouts are reserved against the reported balance until the next
+    callback reports the real one: the reserved amounts are kept in cents in a shared cache counter that is
+    only changed with incr and decr, so concurrent payouts in any worker cannot overdraw the known balance
+    or overwrite each other's debits.
+    """
+    def __init__(self):
+        self._config = None
+        self._local: Dict[str, Tuple[float, Optional[KnownBalance]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            self._config = {**DEFAULT_BALANCES, **getattr(settings, "DARAJA_BALANCES", {})}
+        return self._config
+
+    def cache_key(self, account: str) -> str:
+        return "daraja:balance:{}".format(account)
+
+    def debits_key(self, known: KnownBalance) -> str:
+        # Per reported balance, so a newer report starts from no debits.
+        return "daraja:balance:{}:debits:{}".format(known.account, int(known.observed_at.timestamp() * 1000000))
+
+    def get(self, account: str) -> Optional[KnownBalance]:
+        """
+        Returns the latest known balance of an account, the payouts reserved since it was reported deducted,
+        or None if Daraja has not reported one yet.
+        """
+        known = self.reported(account)
+        if known is None:
+            return None
+        debited = cache.get(self.debits_key(known))
+        if debited:
+            known = known._replace(balance=known.balance - Decimal(debited) / 100)
+        return known
+
+    def reported(self, account: str) -> Optional[KnownBalance]:
+        """
+        Returns the balance Daraja last reported for an account, or None if it has not reported one yet.
+        """
+        now = time.monotonic()
+        with self._lock:
+            local = self._local.get(account)
+        if local and now - local[0] < self.config["LOCAL_TTL"]:
+            return local[1]
+
+        known = cache.get(self.cache_key(account))
+        if known is None:
+            row = AccountBalance.objects.filter(account=account).first()
+            if row is not None:
+                known = KnownBalance(account, row.balance, row.observed_at)
+                cache.set(self.cache_key(account), known, None)
+        with self._lock:
+            self._local[account] = (now, known)
+        return known
+
+    def all(self) -> List[KnownBalance]:
+        balances = [self.get(account) for account, _ in AccountBalance.ACCOUNT]
+        return [known for known in balances if known is not None]
+
+    def _store(self, known: KnownBalance):
+        cache.set(self.cache_key(known.account), known, None)
+        with self._lock:
+            self._local[known.account] = (time.monotonic(), known)
+
+    def observe(self, account: str, balance, observed_at: datetime, transaction_type: int, object_id: int) -> bool:
+        """
+        Records a balance reported in a callback. Callbacks can arrive out of order, so an older report never
+        replaces a newer one.
+        Returns:
+            bool: Whether the balance was newer than the known one.
+        """
+        known = KnownBalance(account, Decimal(str(balance)), observed_at)
+        current = self.reported(account)
+        if current is not None and current.observed_at > observed_at:
+            return False
+        self._store(known)
+
+        values = {
+            "balance": known.balance, "observed_at": observed_at,
+            "transaction_type": transaction_type, "object_id": object_id,
+        }
+        if not AccountBalance.objects.filter(account=account, observed_at__lte=observed_at).update(**values):
+            try:
+                with transaction.atomic():
+                    AccountBalance.objects.create(account=account, **values)
+            except IntegrityError:
+                pass
+        return True
+
+    def reserve(self, account: str, amount) -> Optional[Reservation]:
+        """
+        Debits a payout from the known balance before it is sent, rejecting it if it exceeds what is left.
+        Accounts without a known balance are not checked.
+        Returns:
+            Optional[Reservation]: The debit, to release() if the payout is not accepted.
+        Raises:
+            ValidationError: When the amount is more than the known balance left and PREFLIGHT is on.
+        """
+        known = self.reported(account)
+        if known is None:
+            return None
+        key, cents = self.debits_key(known), int(Decimal(str(amount)) * 100)
+        cache.add(key, 0, self.config["DEBITS_TTL"])
+        debited = cache.incr(key, cents)
+        if self.config["PREFLIGHT"] and debited > known.balance * 100:
+            cache.decr(key, cents)
+            logging.warning("Rejected payout of {} from the {} account, known balance is {}".format(
+                amount, account, known.balance - Decimal(debited - cents) / 100
+            ))
+            raise ValidationError({"amount": "Insufficient balance in the {} account".format(account)})
+        return Reservation(key, cents)
+
+    def release(self, reservation: Optional[Reservation]):
+        """
+        Takes back a reserved payout that Daraja did not accept.
+        """
+        if reservation is None:
+            return
+        try:
+            cache.decr(reservation.key, reservation.cents)
+        except ValueError:
+            # The debits expired in between.
+            pass
+
+
+balance_tracker = BalanceTracker()
+
+
+@receiver(transaction_updated)
+def record_account_balances(sender, instance, **kwargs):
+    """
+    Feeds the balances parsed from the B2C, B2B and top up result callbacks to the tracker.
+    """
+    fields = BALANCE_FIELDS.get(sender)
+    if fields is None or is_replaying():
+        return
+    observed_at = instance.transaction_time or instance.updated_at
+    if timezone.is_naive(observed_at):
+        observed_at = timezone.make_aware(observed_at, DARAJA_TIME_ZONE)
+    for field, account in fields.items():
+        balance = getattr(instance, field)
+        if balance in (None, ""):
+            continue
+        balance_tracker.observe(account, balance, observed_at, transaction_type_id(sender), instance.pk)
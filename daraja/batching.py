@@ -0,0 +1,135 @@
+import atexit
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+from django.conf import settings
+
+logging = logging.getLogger("default")
+
+
+class WriteBehindBuffer:
+    """
+    Queues items in memory and writes them in batches from a background thread.
+
+    Subclasses implement write() and name the settings dict they are configured from. The buffer is
+    flushed every FLUSH_INTERVAL seconds, as soon as BATCH_SIZE items are queued and at interpreter
+    exit. With ASYNC off every item is written immediately on the calling thread.
+
+    A batch whose write fails is put back at the head of the queue and retried, backing off up to
+    MAX_BACKOFF seconds between flushes. Its last attempt writes the items one at a time, so only the
+    items that still fail after MAX_ATTEMPTS writes are dropped, and logged.
+    """
+    settings_name = None
+    defaults = {
+        "ASYNC": True,
+        "BATCH_SIZE": 100,
+        "FLUSH_INTERVAL": 0.05,
+        "MAX_ATTEMPTS": 5,
+        "MAX_BACKOFF": 30,
+    }
+    thread_name = "daraja-write-behind"
+
+    def __init__(self):
+        self._pending: List[Any] = []
+        self._attempts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._config = None
+        atexit.register(self.flush)
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            self._config = {
+                **WriteBehindBuffer.defaults, **self.defaults, **getattr(settings, self.settings_name, {})
+            }
+        return self._config
+
+    def add(self, item: Any):
+        if not self.config["ASYNC"]:
+            self.write([item])
+            return
+
+        with self._lock:
+            self._pending.append(item)
+            size = len(self._pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+        if size >= self.config["BATCH_SIZE"]:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes every queued item now.
+        Raises:
+            Exception: The error of a failed write. The items not written are queued again.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        if self._attempts and max(self._attempts.get(id(item), 0) for item in pending) >= \
+                self.config["MAX_ATTEMPTS"] - 1:
+            self._write_each(pending)
+            return
+        try:
+            self.write(pending)
+        except Exception:
+            self._requeue(pending)
+            raise
+        self._forget(pending)
+
+    def write(self, items: List[Any]):
+        raise NotImplementedError
+
+    def _write_each(self, items: List[Any]):
+        failed, error = [], None
+        for item in items:
+            try:
+                self.write([item])
+            except Exception as e:
+                failed.append(item)
+                error = e
+        failed_ids = {id(item) for item in failed}
+        self._forget([item for item in items if id(item) not in failed_ids])
+        if failed:
+            self._requeue(failed)
+            raise error
+
+    def _requeue(self, items: List[Any]):
+        retry = []
+        for item in items:
+            attempts = self._attempts.get(id(item), 0) + 1
+            if attempts >= self.config["MAX_ATTEMPTS"]:
+                self._attempts.pop(id(item), None)
+                logging.error("{} dropped {!r} after {} failed writes".format(type(self).__name__, item, attempts))
+                continue
+            self._attempts[id(item)] = attempts
+            retry.append(item)
+        with self._lock:
+            self._pending[:0] = retry
+
+    def _forget(self, items: List[Any]):
+        if self._attempts:
+            for item in items:
+                self._attempts.pop(id(item), None)
+
+    def _run(self):
+        failures = 0
+        while True:
+            if failures:
+                # A full queue does not cut the backoff short.
+                time.sleep(min(self.config["FLUSH_INTERVAL"] * 2 ** failures, self.config["MAX_BACKOFF"]))
+            else:
+                self._wakeup.wait(self.config["FLUSH_INTERVAL"])
+            self._wakeup.clear()
+            try:
+                self.flush()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logging.error("{} flush failed {}".format(type(self).__name__, e))
@@ -0,0 +1,118 @@
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from daraja.events import transaction_type_id
+from daraja.models import (
+    ArchivedTransaction, STKTransaction, B2CTransaction, B2BTransaction, B2CTopup, B2BExpressTransaction
+)
+
+# The id clients poll each transaction type by.
+LOOKUP_FIELDS = {
+    STKTransaction: "checkout_request_id",
+    B2CTransaction: "conversation_id",
+    B2BTransaction: "conversation_id",
+    B2CTopup: "conversation_id",
+    B2BExpressTransaction: "request_ref_id",
+}
+
+
+def transaction_cache_key(model, lookup_value) -> str:
+    return "daraja:read:{}:{}".format(model._meta.model_name, lookup_value)
+
+
+def transaction_etag(instance) -> str:
+    return '"{}-{}"'.format(instance.pk, int(instance.updated_at.timestamp() * 1000000))
+
+
+def get_cached_transaction(model, lookup_value):
+    """
+    Returns the cached (etag, data) pair for a transaction, or None.
+    """
+    return cache.get(transaction_cache_key(model, lookup_value))
+
+
+def set_cached_transaction(model, lookup_value, etag: str, data: dict):
+    cache.set(transaction_cache_key(model, lookup_value), (etag, data), settings.DARAJA_READ_CACHE_TIMEOUT)
+
+
+def invalidate_cached_transactions(model, instances):
+    """
+    Drops the cached read responses of transactions written without post_save, e.g. with bulk_update.
+    """
+    lookup_field = LOOKUP_FIELDS.get(model)
+    if lookup_field is None:
+        return
+    keys = [
+        transaction_cache_key(model, getattr(instance, lookup_field))
+        for instance in instances if getattr(instance, lookup_field)
+    ]
+    if keys:
+        cache.delete_many(keys)
+
+
+@receiver(post_save)
+def invalidate_cached_transaction(sender, instance, **kwargs):
+    """
+    Drops the cached read response when a callback or the admin saves a transaction.
+    """
+    invalidate_cached_transactions(sender, [instance])
+
+
+def archived_transaction(model, lookup_value):
+    """
+    Rebuilds a transaction moved to ArchivedTransaction by archive_transactions, looked up by the id clients
+    poll it with, as an unsaved instance of its model.
+    Returns:
+        Optional[Model]: The transaction, or None if it was not archived.
+    """
+    archived = ArchivedTransaction.objects.filter(
+        transaction_type=transaction_type_id(model), lookup_value=lookup_value
+    ).order_by("-created_at").first()
+    if archived is None:
+        return None
+    data = archived.data
+    instance = model(**{
+        field.attname: field.to_python(data[field.name]) if data[field.name] is not None else None
+        for field in model._meta.concrete_fields if field.name in data
+    })
+    instance.pk, instance.created_at = archived.object_id, archived.created_at
+    return instance
+
+
+def restore_archived_transaction(model, lookup_value) -> Optional[object]:
+    """
+    Moves an archived transaction back into its hot table, e.g. when a late or duplicate callback arrives
+    for it, so the callback updates it instead of creating an empty row. The row keeps its id and is written
+    to the database the model is routed to.
+    Returns:
+        Optional[Model]: The restored transaction, or None if it was not archived.
+    """
+    instance = archived_transaction(model, lookup_value)
+    if instance is None:
+        return None
+    using = router.db_for_write(model, instance=instance)
+    # The archive row is on the default database, which may not be this transaction's shard.
+    with transaction.atomic(using=using), transaction.atomic():
+        instance.save(using=using, force_insert=True)
+        ArchivedTransaction.objects.filter(transaction_type=transaction_type_id(model), object_id=instance.pk).delete()
+    return instance
+
+
+def get_or_restore_transaction(model, lookup_value):
+    """
+    The get_or_create of the callback handlers: returns the transaction with the id clients poll it by,
+    restoring it from the archive if it was archived, and creates it only when it is in neither.
+    """
+    lookup = {LOOKUP_FIELDS[model]: lookup_value}
+    instance = model.objects.filter(**lookup).order_by("-created_at", "-id").first()
+    if instance is None:
+        instance = restore_archived_transaction(model, lookup_value)
+    if instance is None:
+        instance, _ = model.objects.get_or_create(**lookup)
+    return instance
+
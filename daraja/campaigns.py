@@ -0,0 +1,213 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
+import requests
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.serializers import ValidationError
+
+from daraja.gateway.c2b import C2B
+from daraja.models import Campaign, CampaignRecipient
+from daraja.serializers import STKCheckoutSerializer
+from daraja.velocity import VelocityLimitExceeded
+
+logging = logging.getLogger("default")
+
+
+class TokenBucket:
+    """
+    Blocks callers so that on average no more than rate acquisitions happen per second, with bursts of
+    up to capacity.
+    """
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def load_recipients(campaign: Campaign, rows: Iterable[dict], batch_size: int = 1000) -> Tuple[int, int]:
+    """
+    Validates recipient rows (phone_number, amount and an optional reference) and inserts them in bulk.
+    A phone number already in the campaign is skipped.
+    Returns:
+        tuple: The number of rows loaded and the number rejected as invalid.
+    """
+    loaded, rejected, batch = 0, 0, []
+
+    def flush():
+        CampaignRecipient.objects.bulk_create(batch, ignore_conflicts=True)
+        batch.clear()
+
+    for row in rows:
+        serializer = STKCheckoutSerializer(data={
+            "phone_number": row.get("phone_number"), "amount": row.get("amount"),
+            "reference": row.get("reference") or campaign.reference, "description": campaign.description,
+        })
+        if not serializer.is_valid():
+            rejected += 1
+            logging.warning("Rejected campaign {} recipient {} {}".format(campaign.pk, row, serializer.errors))
+            continue
+        data = serializer.validated_data
+        batch.append(CampaignRecipient(
+            campaign=campaign, phone_number="+" + data["phone_number"], amount=data["amount"],
+            reference=data["reference"],
+        ))
+        loaded += 1
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    Campaign.objects.filter(pk=campaign.pk).update(total_count=campaign.recipients.count(), updated_at=timezone.now())
+    return loaded, rejected
+
+
+class CampaignRunner:
+    """
+    Sends the STK pushes of a campaign under its rate_per_second and max_concurrency limits.
+
+    Recipients are claimed in batches with a conditional QUEUED to SENDING update before they are pushed,
+    and the results of a batch are written back with one bulk_update. The runner checks the campaign
+    status between pushes and stops when it is paused; running it again resumes where it stopped.
+    Recipients left SENDING by a crashed runner are marked UNKNOWN instead of being pushed twice.
+    """
+    pause_check_interval = 1
+
+    def __init__(self, campaign: Campaign):
+        self.campaign = campaign
+        self.bucket = TokenBucket(campaign.rate_per_second)
+        self.batch_size = max(campaign.max_concurrency * 4, 50)
+        self._paused_checked = 0
+        self._paused = False
+
+    def start(self) -> bool:
+        """
+        Marks the campaign as running, unless it is already completed.
+        """
+        started = Campaign.objects.filter(
+            pk=self.campaign.pk, status__in=(Campaign.DRAFT, Campaign.PAUSED, Campaign.RUNNING)
+        ).update(status=Campaign.RUNNING, updated_at=timezone.now())
+        return bool(started)
+
+    def recover(self) -> int:
+        """
+        Marks recipients a previous runner claimed but never finished as UNKNOWN.
+        """
+        recovered = CampaignRecipient.objects.filter(
+            campaign=self.campaign, status=CampaignRecipient.SENDING
+        ).update(status=CampaignRecipient.UNKNOWN, error="Runner stopped before the push completed")
+        if recovered:
+            Campaign.objects.filter(pk=self.campaign.pk).update(unknown_count=F("unknown_count") + recovered)
+            logging.warning("Campaign {} has {} recipients in an unknown state".format(self.campaign.pk, recovered))
+        return recovered
+
+    def is_paused(self) -> bool:
+        now = time.monotonic()
+        if now - self._paused_checked >= self.pause_check_interval:
+            self._paused_checked = now
+            self._paused = Campaign.objects.filter(pk=self.campaign.pk, status=Campaign.PAUSED).exists()
+        return self._paused
+
+    def claim(self) -> List[CampaignRecipient]:
+        queued = CampaignRecipient.objects.filter(campaign=self.campaign, status=CampaignRecipient.QUEUED)
+        ids = list(queued.order_by("id").values_list("id", flat=True)[:self.batch_size])
+        with transaction.atomic():
+            CampaignRecipient.objects.filter(id__in=ids, status=CampaignRecipient.QUEUED).update(
+                status=CampaignRecipient.SENDING, attempted_at=timezone.now()
+            )
+            return list(CampaignRecipient.objects.filter(
+                id__in=ids, status=CampaignRecipient.SENDING
+            ).order_by("id"))
+
+    def push(self, recipient: CampaignRecipient) -> CampaignRecipient:
+        close_old_connections()
+        try:
+            response_data = C2B().stk_push(
+                request=None, amount=recipient.amount, phone_number=str(recipient.phone_number)[1:],
+                description=self.campaign.description, reference=recipient.reference,
+            )
+            if response_data.get("CheckoutRequestID"):
+                recipient.status = CampaignRecipient.SENT
+                recipient.checkout_request_id = response_data["CheckoutRequestID"]
+            else:
+                recipient.status = CampaignRecipient.FAILED
+                recipient.error = response_data.get("errorMessage") or str(response_data)
+        except (requests.ConnectTimeout, ValidationError, VelocityLimitExceeded) as e:
+            # Nothing reached Safaricom, the push was not made.
+            recipient.status = CampaignRecipient.FAILED
+            recipient.error = str(e)
+        except Exception as e:
+            recipient.status = CampaignRecipient.UNKNOWN
+            recipient.error = str(e)
+            logging.error("Campaign {} push to recipient {} failed {}".format(self.campaign.pk, recipient.pk, e))
+        finally:
+            close_old_connections()
+        return recipient
+
+    def record(self, recipients: List[CampaignRecipient]):
+        CampaignRecipient.objects.bulk_update(recipients, ["status", "checkout_request_id", "error"])
+        counts = {status: 0 for status, _ in CampaignRecipient.STATUS}
+        for recipient in recipients:
+            counts[recipient.status] += 1
+        Campaign.objects.filter(pk=self.campaign.pk).update(
+            sent_count=F("sent_count") + counts[CampaignRecipient.SENT],
+            failed_count=F("failed_count") + counts[CampaignRecipient.FAILED],
+            unknown_count=F("unknown_count") + counts[CampaignRecipient.UNKNOWN],
+            updated_at=timezone.now(),
+        )
+
+    def run(self) -> bool:
+        """
+        Sends pushes until every recipient has been attempted or the campaign is paused.
+        Returns:
+            bool: Whether the campaign completed.
+        """
+        if not self.start():
+            return False
+        self.recover()
+        with ThreadPoolExecutor(max_workers=self.campaign.max_concurrency, thread_name_prefix="daraja-campaign") \
+                as executor:
+            while not self.is_paused():
+                recipients = self.claim()
+                if not recipients:
+                    break
+                futures, unsent = [], []
+                for recipient in recipients:
+                    if self.is_paused():
+                        unsent.append(recipient.pk)
+                        continue
+                    self.bucket.acquire()
+                    futures.append(executor.submit(self.push, recipient))
+                if unsent:
+                    CampaignRecipient.objects.filter(id__in=unsent).update(
+                        status=CampaignRecipient.QUEUED, attempted_at=None
+                    )
+                self.record([future.result() for future in futures])
+
+        if self.is_paused():
+            return False
+        completed = Campaign.objects.filter(pk=self.campaign.pk, status=Campaign.RUNNING).exclude(
+            recipients__status__in=(CampaignRecipient.QUEUED, CampaignRecipient.SENDING)
+        ).update(status=Campaign.COMPLETED, updated_at=timezone.now())
+        return bool(completed)
+
+    def pause(self):
+        Campaign.objects.filter(pk=self.campaign.pk, status=Campaign.RUNNING).update(
+            status=Campaign.PAUSED, updated_at=timezone.now()
+        )
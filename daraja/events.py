@@ -0,0 +1,111 @@
+from typing import Any, List
+
+from django.dispatch import receiver
+from django.utils import timezone
+
+from daraja.batching import WriteBehindBuffer
+from daraja.models import TransactionEvent
+from daraja.serializers import transaction_kind
+from daraja.signals import is_replaying, transaction_updated
+
+TRANSACTION_TYPE_IDS = {name: value for value, name in TransactionEvent.TRANSACTION_TYPE}
+SENSITIVE_KEYS = ("SecurityCredential", "Password")
+
+
+def transaction_type_id(model) -> int:
+    return TRANSACTION_TYPE_IDS[transaction_kind(model)]
+
+
+def project_request(kind: str, payload: dict) -> dict:
+    """
+    Maps a recorded Daraja request body back onto the transaction fields it was built from.
+    """
+    if kind == "stk":
+        return {
+            "phone_number": payload["PhoneNumber"], "amount": payload["Amount"],
+            "reference": payload["AccountReference"], "description": payload["TransactionDesc"],
+        }
+    if kind == "b2c":
+        return {
+            "originator_conversation_id": payload["OriginatorConversationID"], "transaction_amount": payload["Amount"],
+            "recipient_phonenumber": payload["PartyB"], "remarks": payload["Remarks"], "occasion": payload["Occassion"],
+        }
+    if kind == "b2b":
+        return {
+            "originator_conversation_id": payload["OriginatorConversationID"], "amount": payload["Amount"],
+            "recipient_number": payload["PartyB"], "account_reference": payload["AccountReference"],
+            "remarks": payload["Remarks"], "requester": payload["Requester"],
+            "recipient_type": "buygoods" if payload["CommandID"] == "BusinessBuyGoods" else "paybill",
+        }
+    if kind == "topup":
+        return {
+            "amount": payload["Amount"], "paybill_number": payload["PartyB"], "remarks": payload["Remarks"],
+            "account_reference": payload["AccountReference"], "requester": payload["Requester"],
+        }
+    return {
+        "request_ref_id": payload["RequestRefID"], "amount": payload["amount"],
+        "receiver_short_code": payload["receiverShortCode"], "reference": payload["paymentRef"],
+    }
+
+
+def project_acknowledgement(kind: str, payload: dict) -> dict:
+    """
+    Maps a recorded Daraja response onto the ids it assigned, or a failed status if it was rejected.
+    """
+    id_field, response_key = ("checkout_request_id", "CheckoutRequestID") if kind == "stk" else \
+        ("conversation_id", "ConversationID")
+    if payload.get(response_key):
+        return {id_field: payload[response_key]}
+    return {"status": 2}
+
+
+def redact(payload: Any) -> Any:
+    if isinstance(payload, dict):
+        return {key: "***" if key in SENSITIVE_KEYS else value for key, value in payload.items()}
+    return payload
+
+
+class EventLog(WriteBehindBuffer):
+    """
+    Appends TransactionEvents in batches. Events are stamped when they are recorded and compressed and
+    bulk inserted by the background flush, so recording costs the request path no queries.
+    Nothing is recorded while replaying, so rebuilding from the log does not append to it.
+    """
+    settings_name = "DARAJA_EVENT_LOG"
+    thread_name = "daraja-events"
+
+    def record(self, kind: int, instance, payload: Any = None, status=None):
+        """
+        Records an event for a saved transaction row.
+        Args:
+            kind (int): One of the TransactionEvent kinds.
+            instance (Model): The transaction the event belongs to.
+            payload (Any): The raw request, response or callback body.
+            status (int, optional): The transaction status after the event.
+        """
+        if is_replaying():
+            return
+        self.add((
+            timezone.now(), kind, transaction_type_id(type(instance)), instance.pk,
+            None if status is None else int(status), redact(payload)
+        ))
+
+    def write(self, events: List[tuple]):
+        TransactionEvent.objects.bulk_create([
+            TransactionEvent(
+                created_at=created_at, kind=kind, transaction_type=transaction_type, object_id=object_id,
+                status=status, payload=TransactionEvent.compress(payload)
+            )
+            for created_at, kind, transaction_type, object_id, status, payload in events
+        ], batch_size=self.config["BATCH_SIZE"])
+
+
+event_log = EventLog()
+
+
+@receiver(transaction_updated)
+def record_status_change(sender, instance, previous_status=None, **kwargs):
+    event_log.record(
+        TransactionEvent.STATUS_CHANGED, instance, {"from": previous_status, "to": instance.status},
+        status=instance.status
+    )
@@ -0,0 +1,186 @@
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import models
+
+from daraja.events import TRANSACTION_TYPE_IDS
+from daraja.models import ArchivedTransaction
+from daraja.routers import read_replica_alias
+from daraja.serializers import READ_SERIALIZERS
+from daraja.sharding import sharding
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_EXPORT = {
+    # Rows fetched per round trip from the server-side cursor.
+    "CHUNK_SIZE": 2000,
+    # Rows per Parquet row group, the most a Parquet export holds in memory.
+    "ROW_GROUP_SIZE": 50000,
+    "PARQUET_COMPRESSION": "snappy",
+}
+
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def export_config() -> dict:
+    return {**DEFAULT_EXPORT, **getattr(settings, "DARAJA_EXPORT", {})}
+
+
+def export_columns(kind: str) -> Tuple[str, ...]:
+    """
+    The columns exported for a transaction type, the ones its read serializer exposes.
+    """
+    return READ_SERIALIZERS[kind].Meta.fields
+
+
+def export_filters(status: Optional[str] = None, created_after: Optional[datetime] = None,
+                   created_before: Optional[datetime] = None) -> Dict[str, object]:
+    filters = {}
+    if status is not None:
+        filters["status"] = status
+    if created_after is not None:
+        filters["created_at__gte"] = created_after
+    if created_before is not None:
+        filters["created_at__lt"] = created_before
+    return filters
+
+
+def iter_rows(kind: str, filters: Dict[str, object], include_archived: bool = True,
+              chunk_size: Optional[int] = None) -> Iterator[tuple]:
+    """
+    Yields the transactions of a type as tuples of export_columns(kind), oldest first.
+
+    Each shard is read through a server-side cursor over the (created_at, id) index, projected to the
+    exported columns with values_list, and the shards (and, with include_archived, the rows moved to the
+    ArchivedTransaction table) are merged as they are read. Memory stays at one chunk per source whatever
+    the number of rows.
+    """
+    model = READ_SERIALIZERS[kind].Meta.model
+    columns = export_columns(kind)
+    chunk_size = chunk_size or export_config()["CHUNK_SIZE"]
+    aliases = sharding.aliases() if sharding.is_sharded(model) else [read_replica_alias()]
+    sources = [
+        model.objects.using(alias).filter(**filters).order_by("created_at", "id").values_list(*columns).iterator(
+            chunk_size=chunk_size
+        )
+        for alias in aliases
+    ]
+    if include_archived:
+        sources.append(iter_archived_rows(kind, filters, chunk_size))
+    if len(sources) == 1:
+        return sources[0]
+    created_at, pk = columns.index("created_at"), columns.index("id")
+    return heapq.merge(*sources, key=lambda row: (row[created_at], row[pk]))
+
+
+def iter_archived_rows(kind: str, filters: Dict[str, object], chunk_size: int) -> Iterator[tuple]:
+    """
+    Archived transactions of a type as tuples of export_columns(kind), oldest first. Archived payloads keep
+    values as JSON strings; they are converted back with each model field's to_python.
+    """
+    model = READ_SERIALIZERS[kind].Meta.model
+    fields = [model._meta.get_field(column) for column in export_columns(kind)]
+    rows = ArchivedTransaction.objects.filter(transaction_type=TRANSACTION_TYPE_IDS[kind], **filters).order_by(
+        "created_at", "object_id"
+    ).values_list("object_id", "created_at", "payload")
+    for object_id, created_at, payload in rows.iterator(chunk_size=chunk_size):
+        data = json.loads(zlib.decompress(payload))
+        yield tuple(
+            object_id if field.primary_key else created_at if field.name == "created_at" else
+            field.to_python(data.get(field.name)) if data.get(field.name) is not None else None
+            for field in fields
+        )
+
+
+def iter_csv(kind: str, rows: Iterator[tuple], chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Encodes rows as CSV, header first, in blocks of chunk_size rows so a stream is not one write per row.
+    """
+    chunk_size = chunk_size or export_config()["CHUNK_SIZE"]
+    columns = export_columns(kind)
+    model = READ_SERIALIZERS[kind].Meta.model
+    datetimes = [
+        index for index, column in enumerate(columns)
+        if isinstance(model._meta.get_field(column), models.DateTimeField)
+    ]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        if datetimes:
+            row = list(row)
+            for index in datetimes:
+                if row[index] is not None:
+                    row[index] = row[index].isoformat()
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def parquet_schema(kind: str):
+    """
+    The Parquet schema of a transaction type's export, typed from its model fields.
+    """
+    model = READ_SERIALIZERS[kind].Meta.model
+    schema = []
+    for column in export_columns(kind):
+        field = model._meta.get_field(column)
+        if isinstance(field, models.DateTimeField):
+            column_type = pyarrow.timestamp("us", tz="UTC")
+        elif isinstance(field, models.DecimalField):
+            column_type = pyarrow.decimal128(field.max_digits, field.decimal_places)
+        elif isinstance(field, models.BooleanField):
+            column_type = pyarrow.bool_()
+        elif isinstance(field, (models.IntegerField, models.AutoField)):
+            column_type = pyarrow.int64()
+        else:
+            column_type = pyarrow.string()
+        schema.append(pyarrow.field(column, column_type))
+    return pyarrow.schema(schema)
+
+
+def write_parquet(kind: str, rows: Iterator[tuple], path: str, row_group_size: Optional[int] = None) -> int:
+    """
+    Writes rows to a Parquet file one row group at a time, so memory stays at one row group whatever the
+    number of rows. Needs the pyarrow package.
+    Returns:
+        int: The number of rows written.
+    """
+    if pyarrow is None:
+        raise RuntimeError("The pyarrow package is needed to export Parquet files")
+    config = export_config()
+    row_group_size = row_group_size or config["ROW_GROUP_SIZE"]
+    schema = parquet_schema(kind)
+    strings = {index for index, field in enumerate(schema) if pyarrow.types.is_string(field.type)}
+
+    def flush(columns: List[list]):
+        writer.write_table(pyarrow.Table.from_arrays([
+            pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)
+        ], schema=schema))
+
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression=config["PARQUET_COMPRESSION"]) as writer:
+        columns = [[] for _ in schema]
+        for row in rows:
+            for index, value in enumerate(row):
+                columns[index].append(str(value) if index in strings and value is not None else value)
+            written += 1
+            if written % row_group_size == 0:
+                flush(columns)
+                columns = [[] for _ in schema]
+        if written % row_group_size or not written:
+            flush(columns)
+    return written
@@ -1,13 +1,18 @@
 import datetime
-import json
 import uuid
 
 from typing import Any
 from django.conf import settings
 from rest_framework.request import Request
-import requests
 from daraja.gateway.base import MpesaBase
-from daraja.models import B2BTransaction, B2BExpressTransaction
+from daraja.caching import get_or_restore_transaction
+from daraja.models import B2BTransaction, B2BExpressTransaction, TransactionEvent, PayloadIndex
+from daraja.events import event_log
+from daraja.outbox import outbox
+from daraja.payloads import payload_archive
+from daraja.sharding import route_callback, sharding
+from daraja.signals import transaction_updated
+from daraja.tracing import tracer
 
 
 class B2B(MpesaBase):
@@ -46,8 +51,6 @@ class B2B(MpesaBase):
         """
 
         originator_conversation_id = str(uuid.uuid4())
-        print(recipient_type)
-        print("*"*80)
         payload = {
             "OriginatorConversationID": originator_conversation_id,
             "Initiator": self.username[0],
@@ -65,38 +68,49 @@ class B2B(MpesaBase):
             "ResultURL": self.b2b_callback_url,
         }
 
-        response = requests.request(
-            "POST",
-            self.b2b_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
+        transaction = outbox.record_intent(
+            B2BTransaction,
+            using=self.shard,
+            ip_address=request.META.get("REMOTE_ADDR"),
+            remarks=remarks,
+            amount=amount,
+            recipient_number=party_b,
+            account_reference=account_reference,
+            recipient_type=recipient_type,
+            originator_conversation_id=originator_conversation_id,
+            requester=phone_number
         )
-        response_data = response.json()
+        event_log.record(TransactionEvent.REQUEST_SENT, transaction, payload)
+        try:
+            response = self.send_request(self.b2b_url, payload)
+            response_data = response.json()
+        except Exception as e:
+            # The payment was not accepted, so its intent row is marked failed instead of staying pending.
+            outbox.complete(transaction, status=2, failure_description=str(e))
+            raise
+        event_log.record(TransactionEvent.ACKNOWLEDGED, transaction, response_data)
 
         if response.status_code == 200:
             conversation_id = response_data.get('ConversationID')
-            ip = request.META.get("REMOTE_ADDR")
-            B2BTransaction.objects.create(
-                conversation_id=conversation_id,
-                ip_address=ip,
-                remarks=remarks,
-                amount=amount,
-                recipient_number=party_b,
-                account_reference=account_reference,
-                recipient_type=recipient_type,
-                originator_conversation_id=originator_conversation_id,
-                requester=phone_number
+            tracer.correlate(
+                conversation_id=conversation_id, originator_conversation_id=originator_conversation_id
+            )
+            outbox.complete(transaction, conversation_id=conversation_id)
+        else:
+            outbox.complete(
+                transaction, status=2, failure_description=response_data.get("errorMessage")
             )
         return response_data
 
     def b2b_get_transaction_object(self, data: dict) -> B2BTransaction:
         conversation_id = data["Result"]["ConversationID"]
-        transaction, _ = B2BTransaction.objects.get_or_create(
-            conversation_id=conversation_id
-        )
+        originator_conversation_id = data["Result"].get("OriginatorConversationID")
+        transaction = None
+        if originator_conversation_id:
+            transaction = B2BTransaction.objects.filter(originator_conversation_id=originator_conversation_id).first()
+        if transaction is None:
+            transaction = get_or_restore_transaction(B2BTransaction, conversation_id)
+        transaction.conversation_id = conversation_id
         return transaction
 
     def b2b_handle_successful_pay(self, data: dict, transaction: B2BTransaction) -> B2BTransaction:
@@ -135,6 +149,7 @@ class B2B(MpesaBase):
 
         return transaction
 
+    @route_callback(B2BTransaction)
     def b2b_callback_handler(self, data: dict) -> B2BTransaction:
         """
         Handles the callback for a B2B payment transaction.
@@ -146,15 +161,24 @@ class B2B(MpesaBase):
         Returns:
         B2BTransaction: The updated B2CTransaction object.
         """
+        payload_archive.record(PayloadIndex.CALLBACK, data)
         status = self.check_status(data)
         transaction = self.b2b_get_transaction_object(data)
+        previous_status = transaction.status
+        event_log.record(TransactionEvent.CALLBACK_RECEIVED, transaction, data)
+        tracer.correlate(
+            conversation_id=transaction.conversation_id,
+            originator_conversation_id=data["Result"].get("OriginatorConversationID")
+        )
         if status == 2:
             transaction.failure_description = data["Result"]["ResultDesc"]
         if status == 0:
             self.b2b_handle_successful_pay(data, transaction)
 
         transaction.status = status
-        transaction.save()
+        with tracer.span("db.write", model="B2BTransaction"):
+            transaction.save()
+        transaction_updated.send(sender=B2BTransaction, instance=transaction, previous_status=previous_status)
         return transaction
 
     def b2b_express_send(self, request: Request,  receiver_short_code: int, amount: int, reference: str):
@@ -170,37 +194,29 @@ class B2B(MpesaBase):
             "RequestRefID": request_ref_id
         }
 
-        response = requests.request(
-            "POST",
-            self.b2b_express_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.b2b_express_url, payload)
         response_data = response.json()
-        from pprint import  pprint
-        pprint(response_data)
         if response.status_code == 200:
             conversation_id = response_data.get('ConversationID')
             ip = request.META.get("REMOTE_ADDR")
-            B2BExpressTransaction.objects.create(
-                request_ref_id=request_ref_id,
-                ip_address=ip,
-                reference=reference,
-                amount=amount,
-                conversation_id=conversation_id,
-                receiver_short_code=receiver_short_code
-            )
+            tracer.correlate(conversation_id=conversation_id, request_ref_id=request_ref_id)
+            with tracer.span("db.write", model="B2BExpressTransaction"):
+                transaction = B2BExpressTransaction.objects.db_manager(self.shard).create(
+                    request_ref_id=request_ref_id,
+                    ip_address=ip,
+                    reference=reference,
+                    amount=amount,
+                    conversation_id=conversation_id,
+                    receiver_short_code=receiver_short_code
+                )
+            sharding.remember(transaction)
+            event_log.record(TransactionEvent.REQUEST_SENT, transaction, payload)
+            event_log.record(TransactionEvent.ACKNOWLEDGED, transaction, response_data)
         return response_data
 
     def b2b_express_get_transaction_object(self, data: dict) -> B2BExpressTransaction:
         request_id = data["Result"]["requestId"]
-        transaction, _ = B2BExpressTransaction.objects.get_or_create(
-            request_ref_id=request_id
-        )
-        return transaction
+        return get_or_restore_transaction(B2BExpressTransaction, request_id)
 
     def b2b_express_handle_successful_pay(
             self, data: dict, transaction: B2BExpressTransaction
@@ -211,15 +227,22 @@ class B2B(MpesaBase):
 
         return transaction
 
-    def b2b_expres_callback_handler(self, data: dict) -> B2BExpressTransaction:
+    @route_callback(B2BExpressTransaction)
+    def b2b_express_callback_handler(self, data: dict) -> B2BExpressTransaction:
 
+        payload_archive.record(PayloadIndex.CALLBACK, data)
         status = self.check_status(data)
         transaction = self.b2b_express_get_transaction_object(data)
+        previous_status = transaction.status
+        event_log.record(TransactionEvent.CALLBACK_RECEIVED, transaction, data)
+        tracer.correlate(request_ref_id=transaction.request_ref_id)
         if status == 2:
             transaction.failure_description = data["Result"]["ResultDesc"]
         if status == 0:
             self.b2b_express_handle_successful_pay(data, transaction)
 
         transaction.status = status
-        transaction.save()
+        with tracer.span("db.write", model="B2BExpressTransaction"):
+            transaction.save()
+        transaction_updated.send(sender=B2BExpressTransaction, instance=transaction, previous_status=previous_status)
         return transaction
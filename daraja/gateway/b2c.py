@@ -1,4 +1,3 @@
-import json
 import logging
 import datetime
 import re
@@ -7,9 +6,17 @@ import uuid
 from typing import Any
 from django.conf import settings
 from rest_framework.request import Request
-import requests
+from daraja.balances import B2C_PAYOUT_ACCOUNT, balance_tracker
 from daraja.gateway.base import MpesaBase
-from daraja.models import B2CTransaction, B2CTopup
+from daraja.caching import get_or_restore_transaction
+from daraja.models import B2CTransaction, B2CTopup, TransactionEvent, PayloadIndex
+from daraja.events import event_log
+from daraja.outbox import outbox
+from daraja.payloads import payload_archive
+from daraja.sharding import route_callback, sharding
+from daraja.signals import transaction_updated
+from daraja.tracing import tracer
+from daraja.velocity import VelocityLimitExceeded, velocity
 
 logging = logging.getLogger("default")
 
@@ -46,62 +53,89 @@ class B2C(MpesaBase):
 
         Returns:
         dict: A dictionary containing the response data from the B2C payment request.
-        """
-        originator_conversation_id = str(uuid.uuid4())
-        payload = {
-            "OriginatorConversationID": originator_conversation_id,
-            "InitiatorName": self.username[0],
-            "SecurityCredential": self.security_credentials,
-            "CommandID": "BusinessPayment",
-            "Amount": amount,
-            "PartyA": self.short_code,
-            "PartyB": phone_number,
-            "Remarks": remarks,
-            "QueueTimeOutURL": self.b2c_callback_url,
-            "ResultURL": self.b2c_callback_url,
-            "Occassion": occasion,
-        }
-
-        response = requests.request(
-            "POST",
-            self.b2c_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
-        response_data = response.json()
 
-        if response.status_code == 200:
-            conversation_id = response_data.get('ConversationID')
-            ip = request.META.get("REMOTE_ADDR")
-            B2CTransaction.objects.create(
-                conversation_id=conversation_id,
-                ip_address=ip,
+        Raises:
+        ValidationError: If the amount exceeds the latest known utility account balance. Safaricom is not called.
+        VelocityLimitExceeded: If the payout exceeds a velocity rule. Safaricom is not called.
+        """
+        reservation = balance_tracker.reserve(B2C_PAYOUT_ACCOUNT, amount)
+        try:
+            hits = velocity.check("b2c", amount, msisdn=phone_number, short_code=self.short_code)
+        except VelocityLimitExceeded:
+            balance_tracker.release(reservation)
+            raise
+        transaction = None
+        try:
+            originator_conversation_id = str(uuid.uuid4())
+            payload = {
+                "OriginatorConversationID": originator_conversation_id,
+                "InitiatorName": self.username[0],
+                "SecurityCredential": self.security_credentials,
+                "CommandID": "BusinessPayment",
+                "Amount": amount,
+                "PartyA": self.short_code,
+                "PartyB": phone_number,
+                "Remarks": remarks,
+                "QueueTimeOutURL": self.b2c_callback_url,
+                "ResultURL": self.b2c_callback_url,
+                "Occassion": occasion,
+            }
+
+            transaction = outbox.record_intent(
+                B2CTransaction,
+                using=self.shard,
+                ip_address=request.META.get("REMOTE_ADDR"),
                 occasion=occasion,
                 remarks=remarks,
                 originator_conversation_id=originator_conversation_id,
                 recipient_phonenumber=phone_number,
                 transaction_amount=amount
             )
+            event_log.record(TransactionEvent.REQUEST_SENT, transaction, payload)
+            response = self.send_request(self.b2c_url, payload)
+            response_data = response.json()
+        except Exception:
+            # The payout was not accepted, so it neither counts against the recipient's limits nor the balance,
+            # and its intent row, if written, is marked failed instead of staying pending.
+            velocity.release(hits)
+            balance_tracker.release(reservation)
+            if transaction is not None:
+                outbox.complete(transaction, status=2)
+            raise
+        event_log.record(TransactionEvent.ACKNOWLEDGED, transaction, response_data)
+
+        if response.status_code == 200:
+            conversation_id = response_data.get('ConversationID')
+            tracer.correlate(
+                conversation_id=conversation_id, originator_conversation_id=originator_conversation_id
+            )
+            outbox.complete(transaction, conversation_id=conversation_id)
+        else:
+            velocity.release(hits)
+            balance_tracker.release(reservation)
+            outbox.complete(transaction, status=2)
         return response_data
 
     def b2c_get_transaction_object(self, data: dict) -> B2CTransaction:
         """
-        Retrieves or creates a B2CTransaction object based on the conversation ID from the provided data.
+        Retrieves or creates a B2CTransaction object based on the ids from the provided data.
 
-        Extracts the conversation ID from the 'Result' field in the data and uses it to get or create
-        a B2CTransaction object.
+        Looks the transaction up by the OriginatorConversationID we generated when sending, which exists on
+        the intent row even before the Daraja ConversationID has been written to it, and falls back to
+        getting or creating a B2CTransaction object by the conversation ID.
         Parameters:
         data (dict): The dictionary containing the response data from the B2C transaction.
         Returns:
         B2CTransaction: The retrieved or newly created B2CTransaction object.
         """
         conversation_id = data["Result"]["ConversationID"]
-        transaction, _ = B2CTransaction.objects.get_or_create(
-            conversation_id=conversation_id
-        )
+        originator_conversation_id = data["Result"].get("OriginatorConversationID")
+        transaction = None
+        if originator_conversation_id:
+            transaction = B2CTransaction.objects.filter(originator_conversation_id=originator_conversation_id).first()
+        if transaction is None:
+            transaction = get_or_restore_transaction(B2CTransaction, conversation_id)
+        transaction.conversation_id = conversation_id
         return transaction
 
     def b2c_handle_successful_pay(self, data: dict, transaction: B2CTransaction) -> B2CTransaction:
@@ -140,6 +174,7 @@ class B2C(MpesaBase):
         transaction.save()
         return transaction
 
+    @route_callback(B2CTransaction)
     def b2c_callback_handler(self, data: dict) -> B2CTransaction:
         """
         Handles the callback for a B2C payment transaction.
@@ -154,13 +189,22 @@ class B2C(MpesaBase):
         Returns:
         B2CTransaction: The updated B2CTransaction object.
         """
+        payload_archive.record(PayloadIndex.CALLBACK, data)
         status = self.check_status(data)
         transaction = self.b2c_get_transaction_object(data)
+        previous_status = transaction.status
+        event_log.record(TransactionEvent.CALLBACK_RECEIVED, transaction, data)
+        tracer.correlate(
+            conversation_id=transaction.conversation_id,
+            originator_conversation_id=data["Result"].get("OriginatorConversationID")
+        )
         if status == 0:
             self.b2c_handle_successful_pay(data, transaction)
 
         transaction.status = status
-        transaction.save()
+        with tracer.span("db.write", model="B2CTransaction"):
+            transaction.save()
+        transaction_updated.send(sender=B2CTransaction, instance=transaction, previous_status=previous_status)
 
         return transaction
 
@@ -201,30 +245,27 @@ class B2C(MpesaBase):
            "ResultURL": self.b2c_topup_callback_url
         }
 
-        response = requests.request(
-            "POST",
-            self.b2c_topup_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.b2c_topup_url, payload)
         response_data = response.json()
 
         if response.status_code == 200:
             conversation_id = response_data.get('ConversationID')
             ip_address = request.META.get("REMOTE_ADDR") if request else ""
-            B2CTopup.objects.create(
-                conversation_id=conversation_id,
-                account_reference=account_reference,
-                remarks=remarks,
-                ip_address=ip_address,
-                requester=requester_phone_number,
-                amount=amount,
-                paybill_number=paybill_number,
-
-            )
+            tracer.correlate(conversation_id=conversation_id)
+            with tracer.span("db.write", model="B2CTopup"):
+                transaction = B2CTopup.objects.db_manager(self.shard).create(
+                    conversation_id=conversation_id,
+                    account_reference=account_reference,
+                    remarks=remarks,
+                    ip_address=ip_address,
+                    requester=requester_phone_number,
+                    amount=amount,
+                    paybill_number=paybill_number,
+
+                )
+            sharding.remember(transaction)
+            event_log.record(TransactionEvent.REQUEST_SENT, transaction, payload)
+            event_log.record(TransactionEvent.ACKNOWLEDGED, transaction, response_data)
         return response_data
 
     def b2c_get_transaction_topup_object(self, data: dict) -> B2CTopup:
@@ -238,10 +279,7 @@ class B2C(MpesaBase):
             B2CTopup: The B2CTopup transaction object.
         """
         conversation_id = data["Result"]["ConversationID"]
-        transaction, _ = B2CTopup.objects.get_or_create(
-            conversation_id=conversation_id
-        )
-        return transaction
+        return get_or_restore_transaction(B2CTopup, conversation_id)
 
     def b2c_handle_successful_topup(self, data: dict, transaction: B2CTopup) -> B2CTopup:
         """
@@ -278,6 +316,7 @@ class B2C(MpesaBase):
 
         return transaction
 
+    @route_callback(B2CTopup)
     def b2c_topup_callback_handler(self, data):
         """
         Handles the B2C top-up callback.
@@ -288,11 +327,17 @@ class B2C(MpesaBase):
         Returns:
             B2CTopup: The updated B2CTopup transaction object.
         """
+        payload_archive.record(PayloadIndex.CALLBACK, data)
         status = self.check_status(data)
         transaction = self.b2c_get_transaction_topup_object(data)
+        previous_status = transaction.status
+        event_log.record(TransactionEvent.CALLBACK_RECEIVED, transaction, data)
+        tracer.correlate(conversation_id=transaction.conversation_id)
         if status == 0:
             self.b2c_handle_successful_topup(data, transaction)
         transaction.status = status
-        transaction.save()
+        with tracer.span("db.write", model="B2CTopup"):
+            transaction.save()
+        transaction_updated.send(sender=B2CTopup, instance=transaction, previous_status=previous_status)
 
         return transaction
@@ -1,6 +1,8 @@
 import json
 import logging
+import os
 import re
+import threading
 from typing import Any
 
 from django.conf import settings
@@ -8,10 +10,60 @@ from django.core.cache import cache
 
 from rest_framework.serializers import ValidationError
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+from daraja.models import PayloadIndex
+from daraja.payloads import payload_archive
+from daraja.sharding import sharding
+from daraja.singleflight import request_key, single_flight
+from daraja.tracing import tracer
+
 logging = logging.getLogger("default")
 
+DEFAULT_HTTP = {
+    "POOL_SIZE": 10,
+    # Seconds a Daraja call may take to connect and to send each chunk of its response. Idempotency locks are
+    # held longer than the calls of a checkout can take, see daraja/idempotency.py.
+    "TIMEOUT": 20,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_config() -> dict:
+    return {**DEFAULT_HTTP, **getattr(settings, "DARAJA_HTTP", {})}
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process wide session used for Daraja calls, so calls reuse pooled keep-alive connections
+    instead of opening a new TLS connection each.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                config = http_config()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=config["POOL_SIZE"], pool_maxsize=config["POOL_SIZE"])
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def reset_session():
+    # Connections opened before a fork (e.g. by a warm-up in a preloading master) must not be shared with
+    # the children.
+    global _session, _session_lock
+    _session, _session_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_session)
+
+
 class MpesaBase:
     """
     A class for interacting with the M-Pesa API to perform STK Push transactions.
@@ -21,6 +73,7 @@ class MpesaBase:
         Initializes the MpesaGateWay with necessary configurations.
         """
         self.short_code = settings.MPESA_SHORT_CODE
+        self.shard = sharding.shard_for(self.short_code)
         self.consumer_key = settings.MPESA_CONSUMER_KEY
         self.consumer_secret = settings.MPESA_CONSUMER_SECRET
         self.access_token_url = settings.MPESA_ACCESS_TOKEN_URL
@@ -35,17 +88,66 @@ class MpesaBase:
         """
         token = cache.get("mpesa_access_token")
         if not token:
-            try:
-                basic_auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
-                response = requests.get(self.access_token_url, auth=basic_auth)
-                response_data = json.loads(response.text)
-                token, expiry = response_data.get('access_token'),  response_data.get('expires_in')
-                cache.set(key="mpesa_access_token", value=token, timeout=float(expiry))
-            except Exception as e:
-                logging.error("Error {}".format(e))
-                raise ValidationError("Invalid credentials")
+            # Callers that find the token expired at the same time share one fetch.
+            key = request_key("GET", self.access_token_url, self.consumer_key)
+            token = single_flight.do(key, self.fetch_access_token)
         return token
 
+    def fetch_access_token(self) -> str:
+        """
+        Fetches a new access token from Daraja and caches it until it expires.
+        Returns:
+            str: The access token.
+        """
+        token = cache.get("mpesa_access_token")
+        if not token:
+            with tracer.span("token.fetch", url=self.access_token_url):
+                try:
+                    basic_auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+                    response = get_session().get(
+                        self.access_token_url, auth=basic_auth, timeout=http_config()["TIMEOUT"]
+                    )
+                    response_data = json.loads(response.text)
+                    token, expiry = response_data.get('access_token'),  response_data.get('expires_in')
+                    cache.set(key="mpesa_access_token", value=token, timeout=float(expiry))
+                except Exception as e:
+                    logging.error("Error {}".format(e))
+                    raise ValidationError("Invalid credentials")
+        return token
+
+    def send_request(self, url: str, payload: Any, method: str = "POST", coalesce: bool = False) -> requests.Response:
+        """
+        Sends an authenticated JSON request to a Daraja endpoint.
+        Args:
+            url (str): The Daraja endpoint to call.
+            payload (Any): The JSON serializable request body.
+            method (str): The HTTP method. Defaults to POST.
+            coalesce (bool): Share one upstream call and response between concurrent identical requests,
+                across worker processes too. Only for requests that do not move money.
+        Returns:
+            requests.Response: The raw response from the M-Pesa API.
+        """
+        def call():
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": "Bearer {}".format(self.get_access_token()),
+            }
+            with tracer.span("http.outbound", url=url, method=method) as span:
+                response = get_session().request(
+                    method, url, headers=headers, data=json.dumps(payload), timeout=http_config()["TIMEOUT"]
+                )
+                span.set_attribute("status_code", response.status_code)
+            try:
+                response_data = response.json()
+            except ValueError:
+                response_data = response.text
+            payload_archive.record(PayloadIndex.OUTBOUND, payload, response=response_data, url=url)
+            return response
+
+        if coalesce:
+            return single_flight.do(request_key(method, url, payload), call, shared=True)
+        return call()
+
     def check_status(self, data: dict) -> Any:
         """
         Checks the status of a payment transaction from the provided data.
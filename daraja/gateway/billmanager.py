@@ -1,11 +1,9 @@
-import json
 import uuid
 from typing import List, Dict
 
 from daraja.gateway.base import MpesaBase
 from django.conf import settings
 from rest_framework.request import Request
-import requests
 class BillManager(MpesaBase):
     """
     A class for interacting with the M-Pesa API to perform bill manager operations
@@ -30,15 +28,7 @@ class BillManager(MpesaBase):
             "callbackurl": self.bill_manager_onboard_callback_url
         }
 
-        response = requests.request(
-            "POST",
-            self.bill_manager_onboard_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.bill_manager_onboard_url, payload)
         response_data = response.json()
 
         return response_data["resmsg"]
@@ -60,29 +50,13 @@ class BillManager(MpesaBase):
             "amount": amount,
             "invoiceItems": invoice_items
         }
-        response = requests.request(
-            "POST",
-            self.bill_manager_single_invoicing_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.bill_manager_single_invoicing_url, payload)
         response_data = response.json()
 
         return response_data["resmsg"]
 
     def bulk_invoicing_url(self, invoicing_data: List[Dict]):
-        response = requests.request(
-            "POST",
-            self.bill_manager_bulk_invoicing_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(invoicing_data)
-        )
+        response = self.send_request(self.bill_manager_bulk_invoicing_url, invoicing_data)
         response_data = response.json()
 
         return response_data["resmsg"]
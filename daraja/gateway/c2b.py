@@ -1,16 +1,24 @@
 import base64
-import json
 import datetime
 from typing import Tuple
+from zoneinfo import ZoneInfo
 
 from django.conf import settings
-from phonenumber_field.phonenumber import PhoneNumber
-import pytz
-import requests
 from rest_framework.request import Request
 
 from daraja.gateway.base import MpesaBase
-from daraja.models import STKTransaction
+from daraja.msisdn import to_phone_number
+from daraja.caching import get_or_restore_transaction
+from daraja.models import STKTransaction, TransactionEvent, PayloadIndex
+from daraja.events import event_log
+from daraja.outbox import outbox
+from daraja.payloads import payload_archive
+from daraja.sharding import route_callback
+from daraja.signals import transaction_updated
+from daraja.tracing import tracer
+from daraja.velocity import velocity
+
+NAIROBI = ZoneInfo("Africa/Nairobi")
 
 
 class C2B(MpesaBase):
@@ -38,15 +46,7 @@ class C2B(MpesaBase):
             "ValidationURL": self.validation_url
         }
 
-        response = requests.request(
-            "POST",
-            self.c2b_register_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.c2b_register_url, payload, coalesce=True)
         response_data = response.json()
         return response_data
 
@@ -54,7 +54,7 @@ class C2B(MpesaBase):
         pass
 
     def confirmation_handler(self, data):
-        pass
+        payload_archive.record(PayloadIndex.CALLBACK, data)
 
     def generate_password(self) -> Tuple[str, str]:
         """
@@ -62,7 +62,7 @@ class C2B(MpesaBase):
         Returns:
            Tuple[str, str]: The generated password and timestamp.
         """
-        timestamp = datetime.datetime.now(pytz.timezone("Africa/Nairobi")).strftime("%Y%m%d%H%M%S")
+        timestamp = datetime.datetime.now(NAIROBI).strftime("%Y%m%d%H%M%S")
         password_str = self.short_code + self.api_key + timestamp
         password_bytes = password_str.encode("ascii")
         return base64.b64encode(password_bytes).decode("utf-8"), timestamp
@@ -73,50 +73,62 @@ class C2B(MpesaBase):
         """
         Initiates an STK Push transaction.
         Args:
-            request: The Django request object.
+            request: The Django request object, or None when the push is not made on behalf of a request.
             amount (int): The transaction amount.
             phone_number (str): The customer's phone number.
             description (str): Description of the transaction.
             reference (str): Reference for the transaction.
         Returns:
             dict: Response data from the M-Pesa API.
+        Raises:
+            VelocityLimitExceeded: If the push exceeds a velocity rule. Safaricom is not called.
         """
-        password, timestamp = self.generate_password()
-        payload = {
-            "BusinessShortCode": self.short_code,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": int(amount),
-            "PartyA": phone_number,
-            "PartyB": self.short_code,
-            "PhoneNumber": phone_number,
-            "CallBackURL": self.stk_callback_url,
-            "AccountReference": reference,
-            "TransactionDesc": description,
-        }
-
-        response = requests.post(
-            self.stk_push_url,
-            json=payload,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
+        hits = velocity.check("stk", amount, msisdn=phone_number, short_code=self.short_code)
+        transaction = None
+        try:
+            password, timestamp = self.generate_password()
+            payload = {
+                "BusinessShortCode": self.short_code,
+                "Password": password,
+                "Timestamp": timestamp,
+                "TransactionType": "CustomerPayBillOnline",
+                "Amount": int(amount),
+                "PartyA": phone_number,
+                "PartyB": self.short_code,
+                "PhoneNumber": phone_number,
+                "CallBackURL": self.stk_callback_url,
+                "AccountReference": reference,
+                "TransactionDesc": description,
             }
-        )
-        response_data = response.json()
 
-        if response.ok:
-            ip = request.META.get("REMOTE_ADDR")
-            checkout_request_id = response_data.get("CheckoutRequestID", None)
-            STKTransaction.objects.create(
+            transaction = outbox.record_intent(
+                STKTransaction,
+                using=self.shard,
                 phone_number=phone_number,
-                checkout_request_id=checkout_request_id,
                 reference=reference,
                 description=description,
                 amount=amount,
-                ip=ip
+                ip_address=request.META.get("REMOTE_ADDR") if request is not None else None
             )
+            event_log.record(TransactionEvent.REQUEST_SENT, transaction, payload)
+            response = self.send_request(self.stk_push_url, payload)
+            response_data = response.json()
+        except Exception:
+            # The push was not accepted, so it does not count against the customer's limits, and its intent row,
+            # if written, is marked failed instead of staying pending.
+            velocity.release(hits)
+            if transaction is not None:
+                outbox.complete(transaction, status=2)
+            raise
+        event_log.record(TransactionEvent.ACKNOWLEDGED, transaction, response_data)
+
+        if response.ok:
+            checkout_request_id = response_data.get("CheckoutRequestID", None)
+            tracer.correlate(checkout_request_id=checkout_request_id)
+            outbox.complete(transaction, checkout_request_id=checkout_request_id)
+        else:
+            velocity.release(hits)
+            outbox.complete(transaction, status=2)
         return response_data
 
     def stk_check_status(self, data: dict) -> int:
@@ -137,16 +149,15 @@ class C2B(MpesaBase):
     def stk_get_transaction_object(self, data: dict) -> STKTransaction:
         """
         Retrieves or creates a Transaction object based on the checkout request ID.
+        A callback that arrives before the outbox has written the checkout request ID to the intent row creates
+        a placeholder row, and the intent row is merged into it when its completion is written.
         Args:
             data (dict): The callback data received from the M-Pesa API.
         Returns:
             Transaction: The Transaction object corresponding to the checkout request ID.
         """
-        checkout_request_id = data["Body"]["stkCallBack"]["CheckoutRequestID"]
-        transaction, _ = STKTransaction.objects.get_or_create(
-            checkout_request_id=checkout_request_id
-        )
-        return transaction
+        checkout_request_id = data["Body"]["stkCallback"]["CheckoutRequestID"]
+        return get_or_restore_transaction(STKTransaction, checkout_request_id)
 
     def stk_handle_successful_pay(self, data: dict, transaction: STKTransaction) -> STKTransaction:
         """
@@ -163,19 +174,20 @@ class C2B(MpesaBase):
             if item["Name"] == "Amount":
                 amount = item["Value"]
             elif item["Name"] == "MpesaReceiptNumber":
-                receipt_no = items["Value"]
+                receipt_no = item["Value"]
             elif item["Name"] == "PhoneNumber":
                 phone_number = item["Value"]
             elif item["Name"] == "TransactionDate":
                 transaction_date = item["Value"]
 
-            transaction.amount = amount
-            transaction.phone_number = PhoneNumber(raw_input=phone_number)
-            transaction.receipt_no = receipt_no
-            transaction.transaction_date = transaction_date
+        transaction.amount = amount
+        transaction.phone_number = to_phone_number(phone_number)
+        transaction.receipt_no = receipt_no
+        transaction.transaction_date = transaction_date
 
         return transaction
 
+    @route_callback(STKTransaction)
     def stk_callback_handler(self, data):
         """
         Handles the callback data received from the M-Pesa API.
@@ -184,12 +196,18 @@ class C2B(MpesaBase):
         Returns:
           Transaction: The Transaction object updated based on the callback data.
         """
+        payload_archive.record(PayloadIndex.CALLBACK, data)
         status = self.stk_check_status(data)
         transaction = self.stk_get_transaction_object(data)
+        previous_status = transaction.status
+        event_log.record(TransactionEvent.CALLBACK_RECEIVED, transaction, data)
+        tracer.correlate(checkout_request_id=transaction.checkout_request_id)
         if status == 0:
             self.stk_handle_successful_pay(data, transaction)
 
         transaction.status = status
-        transaction.save()
+        with tracer.span("db.write", model="STKTransaction"):
+            transaction.save()
+        transaction_updated.send(sender=STKTransaction, instance=transaction, previous_status=previous_status)
 
         return transaction
@@ -1,6 +1,4 @@
 from django.conf import settings
-import json
-import requests
 from daraja.gateway.base import MpesaBase
 
 
@@ -25,15 +23,7 @@ class DynamicQR(MpesaBase):
              "Size": 300
         }
 
-        response = requests.request(
-            "POST",
-            self.dynamic_qr_url,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": "Bearer {}".format(self.get_access_token()),
-            },
-            data=json.dumps(payload)
-        )
+        response = self.send_request(self.dynamic_qr_url, payload, coalesce=True)
         response_data = response.json()
 
         return response_data
@@ -0,0 +1,125 @@
+import functools
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from daraja.gateway.base import http_config
+
+logging = logging.getLogger("default")
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+DEFAULT_IDEMPOTENCY = {
+    "CACHE": "default",
+    "TTL": 24 * 60 * 60,
+    # Seconds a key stays locked while its request runs. None derives it from DARAJA_HTTP["TIMEOUT"], so the
+    # lock outlives the token fetch and the Daraja call a checkout can make.
+    "LOCK_TIMEOUT": None,
+    "WAIT_TIMEOUT": 30,
+    "POLL_INTERVAL": 0.1,
+}
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used with a different request."
+    default_code = "idempotency_key_reused"
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still in progress, retry later."
+    default_code = "idempotency_key_in_progress"
+
+
+def get_config() -> dict:
+    config = {**DEFAULT_IDEMPOTENCY, **getattr(settings, "DARAJA_IDEMPOTENCY", {})}
+    # A lock that expired while the Daraja call was still running would let a retry send the payment again.
+    http_timeout = http_config()["TIMEOUT"]
+    if config["LOCK_TIMEOUT"] is None:
+        config["LOCK_TIMEOUT"] = 3 * http_timeout
+    elif config["LOCK_TIMEOUT"] <= 2 * http_timeout:
+        raise ImproperlyConfigured(
+            "DARAJA_IDEMPOTENCY LOCK_TIMEOUT must be more than twice DARAJA_HTTP TIMEOUT ({}s)".format(http_timeout)
+        )
+    return config
+
+
+def request_fingerprint(request) -> str:
+    return hashlib.sha256(request.path.encode() + b"\n" + request.body).hexdigest()
+
+
+def replay(stored: dict, fingerprint: str) -> Response:
+    if stored["fingerprint"] != fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(stored["data"], status=stored["status"], headers={"Idempotent-Replayed": "true"})
+
+
+def idempotent(view_method):
+    """
+    Makes a checkout view's post safe to retry with an Idempotency-Key header.
+
+    The first request with a key runs the view under a cache lock and its response is stored for TTL
+    seconds. Retries get the stored response without calling Daraja again; duplicates that arrive while the
+    first request is still running wait for its response instead of making their own call. Reusing a key
+    with a different body is rejected with 422. Requests without the header are not affected.
+
+    Use a cache shared by all workers (CACHE in DARAJA_IDEMPOTENCY) when running more than one process.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({HEADER: "Must be at most {} characters".format(MAX_KEY_LENGTH)})
+
+        config = get_config()
+        store = caches[config["CACHE"]]
+        user = request.user.pk if request.user and request.user.is_authenticated else "anonymous"
+        scope = hashlib.sha256("{}:{}:{}".format(type(self).__name__, user, key).encode()).hexdigest()
+        record_key, lock_key = "daraja:idempotency:{}".format(scope), "daraja:idempotency:lock:{}".format(scope)
+        fingerprint = request_fingerprint(request)
+
+        deadline = time.monotonic() + config["WAIT_TIMEOUT"]
+        while True:
+            stored = store.get(record_key)
+            if stored is not None:
+                return replay(stored, fingerprint)
+            if store.add(lock_key, fingerprint, config["LOCK_TIMEOUT"]):
+                break
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInProgress()
+            time.sleep(config["POLL_INTERVAL"])
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except APIException:
+            # Rejected before anything was sent, e.g. by validation, so a retry may run again.
+            store.delete(lock_key)
+            raise
+        except Exception:
+            # The outbound call may have been made. Keep the lock so retries are refused until it expires
+            # rather than risk paying twice.
+            logging.error("Request with {} {} failed, key locked for {}s".format(
+                HEADER, key, config["LOCK_TIMEOUT"]
+            ))
+            raise
+
+        if response.status_code < 500:
+            store.set(
+                record_key,
+                {"fingerprint": fingerprint, "status": response.status_code, "data": response.data},
+                config["TTL"]
+            )
+        store.delete(lock_key)
+        return response
+    return wrapper
@@ -0,0 +1,94 @@
+import functools
+import threading
+import time
+from typing import Callable, Dict
+
+from django.conf import settings
+
+CALLBACKS, OUTBOUND = "callbacks", "outbound"
+
+DEFAULT_LANES = {
+    "ENABLED": False,
+    "LATENCY_ALPHA": 0.1,
+}
+
+
+class Lane:
+    """
+    One class of routes, e.g. the callbacks or the outbound checkouts, and its request metrics.
+
+    Requests run on the thread that serves them: handing them to a separate pool would still hold that
+    thread until they finish. Keeping worker threads free for callbacks is left to admission control's
+    RESERVED_FOR_CALLBACKS, see daraja/admission.py; the lanes show how each class of routes is doing.
+    """
+    def __init__(self, name: str, latency_alpha: float):
+        self.name = name
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+        self.metrics = {"completed": 0, "failed": 0, "active": 0, "max_active": 0, "run_ms": 0.0}
+
+    def average(self, key: str, value: float):
+        previous = self.metrics[key]
+        self.metrics[key] = value if not previous else self.latency_alpha * value + (1 - self.latency_alpha) * previous
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """
+        Runs fn on the calling thread and returns its result, counting it in the lane's metrics.
+        """
+        with self._lock:
+            self.metrics["active"] += 1
+            self.metrics["max_active"] = max(self.metrics["max_active"], self.metrics["active"])
+        started, failed = time.monotonic(), True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            with self._lock:
+                self.metrics["active"] -= 1
+                self.metrics["failed" if failed else "completed"] += 1
+                self.average("run_ms", (time.monotonic() - started) * 1000)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = dict(self.metrics)
+        metrics["run_ms"] = round(metrics["run_ms"], 3)
+        return metrics
+
+
+class LaneRegistry:
+    def __init__(self):
+        self._lanes: Dict[str, Lane] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        return {**DEFAULT_LANES, **getattr(settings, "DARAJA_LANES", {})}
+
+    def get(self, name: str) -> Lane:
+        lane = self._lanes.get(name)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.get(name)
+                if lane is None:
+                    lane = self._lanes[name] = Lane(name, self.config["LATENCY_ALPHA"])
+        return lane
+
+    def snapshot(self) -> dict:
+        return {name: lane.snapshot() for name, lane in list(self._lanes.items())}
+
+    def run_in(self, name: str):
+        """
+        Decorates a view method so that its requests are counted in the named lane.
+        """
+        def decorator(view_method):
+            @functools.wraps(view_method)
+            def wrapper(view, request, *args, **kwargs):
+                if not self.config["ENABLED"]:
+                    return view_method(view, request, *args, **kwargs)
+                return self.get(name).run(view_method, view, request, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+lanes = LaneRegistry()
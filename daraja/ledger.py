@@ -0,0 +1,223 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from daraja.batching import WriteBehindBuffer
+from daraja.events import TRANSACTION_TYPE_IDS
+from daraja.models import JournalEntry, LedgerAccount, Posting
+from daraja.reports import AMOUNT_FIELDS, CHARGES_FIELDS
+from daraja.serializers import READ_SERIALIZERS, transaction_kind
+from daraja.sharding import sharding
+from daraja.signals import is_dry_run, transaction_updated
+
+# The chart of accounts: code -> (name, kind). Extra accounts can be added in DARAJA_LEDGER["ACCOUNTS"].
+ACCOUNTS = {
+    "mpesa_collections": ("M-Pesa collection account", LedgerAccount.ASSET),
+    "mpesa_working": ("M-Pesa working account", LedgerAccount.ASSET),
+    "mpesa_utility": ("M-Pesa B2C utility account", LedgerAccount.ASSET),
+    "customer_payments": ("Customer payments", LedgerAccount.INCOME),
+    "b2c_payouts": ("B2C payouts", LedgerAccount.EXPENSE),
+    "b2b_payments": ("B2B payments", LedgerAccount.EXPENSE),
+    "transaction_charges": ("M-Pesa transaction charges", LedgerAccount.EXPENSE),
+}
+
+# The accounts debited and credited with a completed transaction's amount, by transaction type. Charges are
+# debited to CHARGES_ACCOUNT and credited to the same account as the amount. Override in DARAJA_LEDGER["RULES"].
+RULES = {
+    "stk": ("mpesa_collections", "customer_payments"),
+    "b2c": ("b2c_payouts", "mpesa_utility"),
+    "b2b": ("b2b_payments", "mpesa_working"),
+    "topup": ("mpesa_utility", "mpesa_working"),
+    "express": ("b2b_payments", "mpesa_working"),
+}
+CHARGES_ACCOUNT = "transaction_charges"
+
+# A pending entry: transaction type id, transaction id, description and (account code, amount) lines.
+PendingEntry = Tuple[int, int, str, List[Tuple[str, Decimal]]]
+
+
+class Ledger(WriteBehindBuffer):
+    """
+    Double-entry ledger of the completed transactions.
+
+    Every transaction that completes gets one JournalEntry whose Postings sum to zero: its amount debited
+    and credited to the accounts in RULES, and its debit_party_charges, if any, to CHARGES_ACCOUNT. Entries
+    are buffered and written in batches; a batch locks the accounts it touches, skips transactions that
+    already have an entry and bulk inserts the rest, keeping each account's balance and every posting's
+    running_balance up to date as it goes. Reading a balance is then a single row, now or at any past time.
+    """
+    settings_name = "DARAJA_LEDGER"
+    thread_name = "daraja-ledger"
+    defaults = {
+        "ASYNC": True,
+        "BATCH_SIZE": 200,
+        "FLUSH_INTERVAL": 0.5,
+        "ACCOUNTS": {},
+        "RULES": {},
+    }
+
+    @property
+    def accounts(self) -> Dict[str, tuple]:
+        return {**ACCOUNTS, **self.config["ACCOUNTS"]}
+
+    @property
+    def rules(self) -> Dict[str, tuple]:
+        return {**RULES, **self.config["RULES"]}
+
+    def entry_for(self, instance) -> Optional[PendingEntry]:
+        """
+        Builds the balanced entry of a completed transaction, or None if it has no amount.
+        """
+        kind = transaction_kind(type(instance))
+        amount = getattr(instance, AMOUNT_FIELDS[kind])
+        if not amount:
+            return None
+        debit, credit = self.rules[kind]
+        amount = Decimal(str(amount))
+        lines = [(debit, amount), (credit, -amount)]
+        charges = getattr(instance, CHARGES_FIELDS[kind]) if kind in CHARGES_FIELDS else None
+        if charges:
+            charges = Decimal(str(charges))
+            lines += [(CHARGES_ACCOUNT, charges), (credit, -charges)]
+        description = "{} {}".format(kind, getattr(instance, "transaction_id", None) or getattr(
+            instance, "receipt_no", None) or instance.pk)
+        return TRANSACTION_TYPE_IDS[kind], instance.pk, description[:255], lines
+
+    def post(self, instance):
+        """
+        Queues the entry of a completed transaction once the database transaction that completed it commits,
+        so an entry is never written for a completion that is rolled back. Posting a transaction twice writes
+        one entry.
+        """
+        entry = self.entry_for(instance)
+        if entry is not None:
+            transaction.on_commit(lambda: self.add(entry), using=instance._state.db or DEFAULT_DB_ALIAS)
+
+    def write(self, entries: List[PendingEntry]):
+        accounts_config = self.accounts
+        codes = sorted({code for _, _, _, lines in entries for code, _ in lines})
+        with transaction.atomic():
+            LedgerAccount.objects.bulk_create([
+                LedgerAccount(code=code, name=accounts_config[code][0], kind=accounts_config[code][1])
+                for code in codes
+            ], ignore_conflicts=True)
+            # Locked in a fixed order, so concurrent writers queue up instead of deadlocking. Holding the locks
+            # also makes the check for existing entries below safe.
+            accounts = {
+                account.code: account
+                for account in LedgerAccount.objects.select_for_update().filter(code__in=codes).order_by("id")
+            }
+            posted = set()
+            for type_id in {type_id for type_id, _, _, _ in entries}:
+                posted.update(JournalEntry.objects.filter(
+                    transaction_type=type_id,
+                    object_id__in=[object_id for entry_type, object_id, _, _ in entries if entry_type == type_id]
+                ).values_list("transaction_type", "object_id"))
+            new = []
+            for entry in entries:
+                if (entry[0], entry[1]) not in posted:
+                    posted.add((entry[0], entry[1]))
+                    new.append(entry)
+            if not new:
+                return
+
+            now = timezone.now()
+            journal = JournalEntry.objects.bulk_create([
+                JournalEntry(transaction_type=type_id, object_id=object_id, description=description, created_at=now)
+                for type_id, object_id, description, _ in new
+            ], batch_size=self.config["BATCH_SIZE"])
+            if any(journal_entry.pk is None for journal_entry in journal):
+                # Backends that cannot return ids from a bulk insert.
+                ids = {
+                    (journal_entry.transaction_type, journal_entry.object_id): journal_entry.pk
+                    for journal_entry in JournalEntry.objects.filter(created_at=now)
+                }
+                for journal_entry in journal:
+                    journal_entry.pk = ids[(journal_entry.transaction_type, journal_entry.object_id)]
+
+            postings = []
+            for journal_entry, (_, _, _, lines) in zip(journal, new):
+                for code, amount in lines:
+                    account = accounts[code]
+                    account.balance += amount
+                    postings.append(Posting(
+                        entry=journal_entry, account=account, amount=amount, running_balance=account.balance,
+                        created_at=now
+                    ))
+            Posting.objects.bulk_create(postings, batch_size=self.config["BATCH_SIZE"])
+            for account in accounts.values():
+                account.updated_at = now
+            LedgerAccount.objects.bulk_update(list(accounts.values()), ["balance", "updated_at"])
+
+    def backfill(self, kind: str, batch_size: int = 1000) -> int:
+        """
+        Posts the completed transactions of a type that have no entry yet, e.g. ones completed before the
+        ledger existed or whose entries were still buffered when a worker died.
+        Returns:
+            int: The number of transactions posted.
+        """
+        model = READ_SERIALIZERS[kind].Meta.model
+        type_id = TRANSACTION_TYPE_IDS[kind]
+        posted = 0
+        for alias in sharding.aliases():
+            # Journal entries live on the default database, which may not be this transaction's shard.
+            transactions = model.objects.using(alias).filter(status=0).order_by("pk")
+            last_pk = 0
+            while True:
+                chunk = list(transactions.filter(pk__gt=last_pk)[:batch_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                have_entries = set(JournalEntry.objects.filter(
+                    transaction_type=type_id, object_id__in=[instance.pk for instance in chunk]
+                ).values_list("object_id", flat=True))
+                batch = [
+                    entry for entry in (
+                        self.entry_for(instance) for instance in chunk if instance.pk not in have_entries
+                    ) if entry is not None
+                ]
+                if batch:
+                    self.write(batch)
+                    posted += len(batch)
+        return posted
+
+    def balance(self, code: str, at: Optional[datetime] = None) -> Decimal:
+        """
+        The balance of an account, debits minus credits, now or right after the last posting at or before at.
+        """
+        if at is None:
+            balance = LedgerAccount.objects.filter(code=code).values_list("balance", flat=True).first()
+        else:
+            balance = Posting.objects.filter(account__code=code, created_at__lte=at).order_by(
+                "-created_at", "-id"
+            ).values_list("running_balance", flat=True).first()
+        return balance if balance is not None else Decimal(0)
+
+    def balances(self, at: Optional[datetime] = None) -> List[LedgerAccount]:
+        """
+        Every account, with balance set as of at when given.
+        """
+        accounts = list(LedgerAccount.objects.order_by("code"))
+        if at is not None:
+            for account in accounts:
+                account.balance = self.balance(account.code, at)
+        return accounts
+
+
+ledger = Ledger()
+
+
+@receiver(transaction_updated)
+def post_completed_transaction(sender, instance, previous_status=None, **kwargs):
+    """
+    Posts transactions as their callback completes them. Replayed callbacks are posted as well: a replay can
+    complete a transaction whose original callback failed, and transactions with an entry are skipped. Dry
+    run replays are rolled back and are not posted.
+    """
+    if str(instance.status) != "0" or str(previous_status) == "0" or is_dry_run():
+        return
+    ledger.post(instance)
@@ -0,0 +1,92 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import serializers
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from daraja.caching import LOOKUP_FIELDS
+from daraja.events import TRANSACTION_TYPE_IDS
+from daraja.models import ArchivedTransaction
+from daraja.serializers import READ_SERIALIZERS
+from daraja.sharding import sharding
+
+DEFAULT_ARCHIVE = {
+    "AFTER_DAYS": 90,
+    "CHUNK_SIZE": 1000,
+    "DIRECTORY": "archive",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves finalized transactions older than --days out of the hot tables, in chunks, either into the "
+        "ArchivedTransaction table or into gzip compressed JSON lines files."
+    )
+
+    def add_arguments(self, parser):
+        config = {**DEFAULT_ARCHIVE, **getattr(settings, "DARAJA_ARCHIVE", {})}
+        parser.add_argument("--days", type=int, default=config["AFTER_DAYS"])
+        parser.add_argument("--type", choices=sorted(READ_SERIALIZERS), action="append", dest="types")
+        parser.add_argument("--chunk-size", type=int, default=config["CHUNK_SIZE"])
+        parser.add_argument(
+            "--to-files", nargs="?", const=config["DIRECTORY"], default=None, metavar="DIRECTORY",
+            help="Write archived rows to <DIRECTORY>/<type>-<date>.jsonl.gz instead of the ArchivedTransaction table."
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only count the rows that would be archived.")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        if options["to_files"]:
+            os.makedirs(options["to_files"], exist_ok=True)
+
+        for kind in options["types"] or sorted(READ_SERIALIZERS):
+            model = READ_SERIALIZERS[kind].Meta.model
+            for alias in sharding.aliases():
+                # Pending rows can still receive a callback, so only finalized rows leave the hot table.
+                candidates = model.objects.using(alias).filter(created_at__lt=cutoff).exclude(status="1")
+                if options["dry_run"]:
+                    self.stdout.write("Would archive {} {} transactions from {}".format(
+                        candidates.count(), kind, alias
+                    ))
+                    continue
+
+                archived = 0
+                while True:
+                    ids = list(candidates.order_by("id").values_list("id", flat=True)[:options["chunk_size"]])
+                    if not ids:
+                        break
+                    archived += self.archive_chunk(kind, model, ids, options["to_files"], alias)
+                self.stdout.write("Archived {} {} transactions from {}".format(archived, kind, alias))
+
+    def archive_chunk(self, kind: str, model, ids: list, directory: str = None, using: str = "default") -> int:
+        lookup_field = LOOKUP_FIELDS[model]
+        # The archive commits before the rows are deleted from their shard, so a failure in between leaves
+        # rows in both places and the next run skips the archived copies.
+        with transaction.atomic(using=using), transaction.atomic():
+            rows = list(model.objects.using(using).select_for_update().filter(pk__in=ids).order_by("id"))
+            records = serializers.serialize("python", rows)
+            if directory:
+                path = os.path.join(directory, "{}-{}.jsonl.gz".format(kind, timezone.now().strftime("%Y%m%d")))
+                with gzip.open(path, "at") as archive_file:
+                    for record in records:
+                        archive_file.write(json.dumps(record, cls=DjangoJSONEncoder) + "\n")
+            else:
+                ArchivedTransaction.objects.bulk_create([
+                    ArchivedTransaction(
+                        transaction_type=TRANSACTION_TYPE_IDS[kind],
+                        object_id=row.pk,
+                        lookup_value=getattr(row, lookup_field),
+                        status=row.status,
+                        created_at=row.created_at,
+                        payload=ArchivedTransaction.compress(record["fields"]),
+                    )
+                    for row, record in zip(rows, records)
+                ], ignore_conflicts=True)
+            model.objects.using(using).filter(pk__in=[row.pk for row in rows]).delete()
+        return len(rows)
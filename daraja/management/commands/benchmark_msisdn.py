@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from phonenumber_field.serializerfields import PhoneNumberField
+
+from daraja.msisdn import _components, cache_info, normalize
+
+PREFIXES = ("700", "710", "712", "720", "722", "740", "790", "110", "111", "115")
+FORMATS = (
+    lambda n: "0" + n,
+    lambda n: "254" + n,
+    lambda n: "+254" + n,
+    lambda n: "+254 {} {} {}".format(n[:3], n[3:6], n[6:]),
+)
+
+
+def sample_numbers(count: int, distinct: int):
+    numbers = []
+    for _ in range(distinct):
+        national = "{}{:06d}".format(random.choice(PREFIXES), random.randint(0, 999999))
+        numbers.append(random.choice(FORMATS)(national))
+    return [random.choice(numbers) for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = "Compares daraja.msisdn normalization with phonenumber_field parsing on Kenyan numbers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=100000, help="Numbers to normalize.")
+        parser.add_argument("--distinct", type=int, default=5000, help="Distinct numbers among them.")
+
+    def time(self, label: str, fn, numbers):
+        started = time.perf_counter()
+        for number in numbers:
+            fn(number)
+        elapsed = time.perf_counter() - started
+        self.stdout.write("{:<32} {:>8.0f} numbers/s {:>8.2f} us/number".format(
+            label, len(numbers) / elapsed, elapsed / len(numbers) * 1e6
+        ))
+
+    def handle(self, *args, **options):
+        numbers = sample_numbers(options["count"], options["distinct"])
+        field = PhoneNumberField(region="KE")
+
+        self.time("phonenumber_field", field.to_internal_value, numbers)
+        _components.cache_clear()
+        self.time("msisdn.normalize (cold cache)", normalize, list(dict.fromkeys(numbers)))
+        self.time("msisdn.normalize (warm cache)", normalize, numbers)
+        self.stdout.write(str(cache_info()))
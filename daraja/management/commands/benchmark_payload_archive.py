@@ -0,0 +1,84 @@
+import tempfile
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from daraja.models import PayloadIndex
+from daraja.payloads import PayloadArchive
+
+
+def sample_callback(index: int) -> dict:
+    checkout_request_id = "ws_CO_{}".format(uuid.uuid4().hex)
+    return {
+        "Body": {
+            "stkCallback": {
+                "MerchantRequestID": "{}-{}".format(index, uuid.uuid4().hex[:8]),
+                "CheckoutRequestID": checkout_request_id,
+                "ResultCode": 0,
+                "ResultDesc": "The service request is processed successfully.",
+                "CallbackMetadata": {
+                    "Item": [
+                        {"Name": "Amount", "Value": index % 5000 + 1},
+                        {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+                        {"Name": "TransactionDate", "Value": 20240101120000 + index},
+                        {"Name": "PhoneNumber", "Value": 254700000000 + index},
+                    ]
+                },
+            }
+        }
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures payload archive write throughput, compression ratio and lookup latency on synthetic STK "
+        "callbacks. Segments go to a temporary directory and the index rows are rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--records", type=int, default=20000)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--codec", choices=("zstd", "zlib"), default="zstd")
+        parser.add_argument("--lookups", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        payloads = [sample_callback(index) for index in range(options["records"])]
+        raw_bytes = sum(len(str(payload)) for payload in payloads)
+
+        with tempfile.TemporaryDirectory() as directory, transaction.atomic():
+            archive = PayloadArchive()
+            archive._config = {
+                **archive.config, "DIRECTORY": directory, "ASYNC": False, "ENABLED": True,
+                "BATCH_SIZE": options["batch_size"], "CODEC": options["codec"],
+            }
+            records = [
+                {"at": "", "kind": PayloadIndex.CALLBACK, "payload": payload} for payload in payloads
+            ]
+
+            started = time.perf_counter()
+            archive.write(records)
+            write_seconds = time.perf_counter() - started
+            stored_bytes = archive._segment[1]
+
+            keys = [
+                payload["Body"]["stkCallback"]["CheckoutRequestID"]
+                for payload in payloads[::max(1, len(payloads) // options["lookups"])]
+            ]
+            started = time.perf_counter()
+            for key in keys:
+                assert archive.lookup(key), key
+            lookup_seconds = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write("Codec: {}".format("zstd" if archive.codec else "zlib"))
+        self.stdout.write("Wrote {} records in {:.2f}s, {:.0f} records/s".format(
+            len(records), write_seconds, len(records) / write_seconds
+        ))
+        self.stdout.write("Stored {:.1f} KiB for {:.1f} KiB of payloads, ratio {:.1f}x".format(
+            stored_bytes / 1024, raw_bytes / 1024, raw_bytes / stored_bytes
+        ))
+        self.stdout.write("Looked up {} ids in {:.2f}s, {:.2f} ms per lookup".format(
+            len(keys), lookup_seconds, lookup_seconds / len(keys) * 1000
+        ))
@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from daraja.models import WebhookDelivery
+from daraja.webhooks import get_dispatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends pending webhook deliveries that are due, e.g. retries whose timer was lost on a restart. "
+        "Deliveries that fail are left pending with their next attempt time for a later run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace", type=int, default=60,
+            help="Seconds a never attempted delivery is left to the live dispatcher before it is picked up."
+        )
+        parser.add_argument("--limit", type=int, default=1000, help="Maximum number of deliveries to send.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        due = WebhookDelivery.objects.filter(status=1).filter(
+            Q(next_attempt_at__lte=now) |
+            Q(next_attempt_at__isnull=True, created_at__lte=now - timedelta(seconds=options["grace"]))
+        ).order_by("id").values_list("id", flat=True)[:options["limit"]]
+
+        dispatcher = get_dispatcher()
+        # Sent without retry timers, which would outlive the command; failures are due again on a later run.
+        with ThreadPoolExecutor(max_workers=dispatcher.config["MAX_WORKERS"]) as executor:
+            results = list(executor.map(dispatcher.deliver_now, list(due)))
+        self.stdout.write("Sent {} webhook deliveries, {} failed, {} no longer pending".format(
+            results.count(True), results.count(False), results.count(None)
+        ))
@@ -0,0 +1,62 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from daraja.export import EXPORT_FORMATS, export_config, export_filters, iter_csv, iter_rows, pyarrow, write_parquet
+from daraja.serializers import READ_SERIALIZERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports the transactions of a type, archived ones included, oldest first, as CSV or as a Parquet file "
+        "for offline analysis. Rows are streamed from server-side cursors, so memory stays flat whatever the "
+        "number of rows."
+    )
+
+    def add_arguments(self, parser):
+        config = export_config()
+        parser.add_argument("type", choices=sorted(READ_SERIALIZERS))
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument(
+            "--output", "-o",
+            help="File to write. CSV goes to stdout when omitted; Parquet needs a file."
+        )
+        parser.add_argument("--status", help="Only export transactions with this status.")
+        parser.add_argument("--since", help="Only export transactions created at or after this ISO datetime.")
+        parser.add_argument("--until", help="Only export transactions created before this ISO datetime.")
+        parser.add_argument("--no-archived", action="store_true", help="Leave out archived transactions.")
+        parser.add_argument("--chunk-size", type=int, default=config["CHUNK_SIZE"], help="Rows per fetch.")
+        parser.add_argument("--row-group-size", type=int, default=config["ROW_GROUP_SIZE"], help="Parquet rows per group.")
+
+    def handle(self, *args, **options):
+        if options["format"] == "parquet":
+            if not options["output"]:
+                raise CommandError("--format parquet needs --output")
+            if pyarrow is None:
+                raise CommandError("The pyarrow package is needed to export Parquet files")
+
+        filters = export_filters(options["status"], self.parse(options, "since"), self.parse(options, "until"))
+        kind = options["type"]
+        rows = iter_rows(kind, filters, not options["no_archived"], options["chunk_size"])
+        if options["format"] == "parquet":
+            written = write_parquet(kind, rows, options["output"], options["row_group_size"])
+            self.stderr.write("Exported {} {} transactions to {}".format(written, kind, options["output"]))
+            return
+
+        output = open(options["output"], "w", newline="") if options["output"] else sys.stdout
+        try:
+            for block in iter_csv(kind, rows, options["chunk_size"]):
+                output.write(block)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    def parse(self, options, name: str):
+        if not options[name]:
+            return None
+        value = parse_datetime(options[name])
+        if value is None:
+            raise CommandError("--{} must be an ISO datetime".format(name))
+        return timezone.make_aware(value) if timezone.is_naive(value) else value
@@ -0,0 +1,29 @@
+import csv
+
+from django.core.management.base import BaseCommand
+
+from daraja.campaigns import load_recipients
+from daraja.models import Campaign
+
+
+class Command(BaseCommand):
+    help = "Creates a bulk STK push campaign from a CSV file with phone_number, amount and reference columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--name", required=True)
+        parser.add_argument("--description", required=True, help="The TransactionDesc sent with every push.")
+        parser.add_argument("--reference", required=True, help="The AccountReference of rows without one.")
+        parser.add_argument("--rate", type=float, default=10, help="Pushes per second.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Pushes in flight at once.")
+
+    def handle(self, *args, **options):
+        campaign = Campaign.objects.create(
+            name=options["name"], description=options["description"], reference=options["reference"],
+            rate_per_second=options["rate"], max_concurrency=options["concurrency"],
+        )
+        with open(options["path"], newline="") as recipients_file:
+            loaded, rejected = load_recipients(campaign, csv.DictReader(recipients_file))
+        self.stdout.write("Created campaign {} with {} recipients, {} rows rejected".format(
+            campaign.pk, loaded, rejected
+        ))
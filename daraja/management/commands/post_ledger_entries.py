@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from daraja.ledger import ledger
+from daraja.serializers import READ_SERIALIZERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Posts ledger entries for completed transactions that have none yet, e.g. ones completed before the ledger "
+        "existed. Transactions that already have an entry are left alone, so it is safe to run at any time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=sorted(READ_SERIALIZERS), action="append", dest="types")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = 0
+        for kind in options["types"] or sorted(READ_SERIALIZERS):
+            posted = ledger.backfill(kind, options["batch_size"])
+            self.stdout.write("Posted {} {} transactions".format(posted, kind))
+            total += posted
+        self.stdout.write(self.style.SUCCESS("Posted {} transactions".format(total)))
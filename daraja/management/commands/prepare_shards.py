@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from daraja.sharding import SHARDED_MODELS, sharding
+
+# Moves a table's id sequence to at least the shard's offset, without going back below ids in use.
+SEQUENCE_SQL = {
+    "postgresql": (
+        "SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+        "GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {table})))",
+    ),
+    "sqlite": (
+        "DELETE FROM sqlite_sequence WHERE name = '{table}'",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT '{table}', MAX(%s, COALESCE(MAX(id), 0)) FROM {table}",
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Starts the transaction id sequences of each shard at its ID_OFFSET, so ids are unique across shards. "
+        "Run it after migrating a new shard and before it takes writes."
+    )
+
+    def handle(self, *args, **options):
+        if not sharding.enabled:
+            raise CommandError("Sharding is not enabled")
+        for alias, shard in sharding.config["SHARDS"].items():
+            offset = shard.get("ID_OFFSET", 0)
+            if not offset:
+                continue
+            connection = connections[alias]
+            statements = SEQUENCE_SQL.get(connection.vendor)
+            if statements is None:
+                raise CommandError("Setting id sequences on {} is not supported".format(connection.vendor))
+            with connection.cursor() as cursor:
+                for model in SHARDED_MODELS:
+                    for statement in statements:
+                        sql = statement.format(table=model._meta.db_table)
+                        cursor.execute(sql, [offset - 1] if "%s" in sql else [])
+            self.stdout.write("Ids on {} start after {}".format(alias, offset - 1))
+        self.stdout.write(self.style.SUCCESS("Shards prepared"))
@@ -0,0 +1,84 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Run in a fresh interpreter, so nothing is imported yet.
+PROBE = """
+import os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", {settings!r})
+started = time.perf_counter()
+import {module}
+loaded = time.perf_counter()
+sys.stderr.write("{marker}\\n")
+{first_request}
+print("{marker}", loaded - started, time.perf_counter() - loaded)
+"""
+
+FIRST_REQUEST = """
+from django.urls import get_resolver
+get_resolver().url_patterns
+"""
+
+MARKER = "daraja-startup"
+
+
+class Command(BaseCommand):
+    help = (
+        "Profiles worker startup: imports the WSGI or ASGI application in a fresh interpreter with -X importtime "
+        "and reports the slowest modules and packages, and what the first request still has to import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--asgi", action="store_true", help="Profile the ASGI application instead of WSGI.")
+        parser.add_argument("--top", type=int, default=20, help="Modules and packages to list.")
+        parser.add_argument("--warmup", action="store_true", help="Profile with DARAJA_WARMUP_ENABLED set.")
+
+    def handle(self, *args, **options):
+        application = settings.ASGI_APPLICATION if options["asgi"] else settings.WSGI_APPLICATION
+        module = (application or "project.wsgi.application").rsplit(".", 1)[0]
+        probe = PROBE.format(
+            settings=os.environ["DJANGO_SETTINGS_MODULE"], module=module, first_request=FIRST_REQUEST, marker=MARKER
+        )
+        env = {**os.environ, "DARAJA_WARMUP_ENABLED": "True" if options["warmup"] else "False"}
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True, env=env
+        )
+        if result.returncode:
+            self.stderr.write(result.stderr[-2000:])
+            return
+
+        boot, first_request = next(
+            map(float, line.split()[1:]) for line in result.stdout.splitlines() if line.startswith(MARKER)
+        )
+        # Imports before the marker happen at boot, the ones after it on the first request.
+        phases, packages = ([], []), defaultdict(int)
+        phase = 0
+        for line in result.stderr.splitlines():
+            if line == MARKER:
+                phase = 1
+                continue
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                own, cumulative, _, name = match.groups()
+                phases[phase].append((int(cumulative), int(own), name))
+                packages[name.split(".")[0]] += int(own)
+
+        self.stdout.write("Import of {}: {:.1f} ms".format(module, boot * 1000))
+        self.write_modules("Slowest imports at boot (cumulative / self, ms):", phases[0], options["top"])
+        self.stdout.write("\nURLconf and views on the first request: {:.1f} ms".format(first_request * 1000))
+        self.write_modules("Slowest imports on the first request (cumulative / self, ms):", phases[1], options["top"])
+        self.stdout.write("\nImport time by package, boot and first request (ms):")
+        for name, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:options["top"]]:
+            self.stdout.write("  {:>8.1f}  {}".format(own / 1000, name))
+
+    def write_modules(self, title: str, modules, top: int):
+        self.stdout.write(title)
+        for cumulative, own, name in sorted(modules, reverse=True)[:top]:
+            self.stdout.write("  {:>8.1f} {:>8.1f}  {}".format(cumulative / 1000, own / 1000, name))
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from daraja.events import project_acknowledgement, project_request
+from daraja.models import TransactionEvent
+from daraja.replay import CALLBACK_HANDLERS
+from daraja.serializers import READ_SERIALIZERS
+from daraja.signals import replaying
+
+
+class Command(BaseCommand):
+    help = "Regenerates transaction rows from the TransactionEvent log, in parallel chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--type", choices=sorted(READ_SERIALIZERS), action="append", dest="types")
+        parser.add_argument("--since", help="Only rebuild transactions with events at or after this ISO datetime.")
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=4)
+
+    def handle(self, *args, **options):
+        since = parse_datetime(options["since"]) if options["since"] else None
+        rebuilt = 0
+        for kind in options["types"] or sorted(READ_SERIALIZERS):
+            type_id = dict((name, value) for value, name in TransactionEvent.TRANSACTION_TYPE)[kind]
+            events = TransactionEvent.objects.filter(transaction_type=type_id)
+            if since:
+                events = events.filter(created_at__gte=since)
+            object_ids = list(events.order_by("object_id").values_list("object_id", flat=True).distinct())
+            chunks = [
+                object_ids[start:start + options["chunk_size"]]
+                for start in range(0, len(object_ids), options["chunk_size"])
+            ]
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                rebuilt += sum(executor.map(lambda chunk: self.rebuild_chunk(kind, type_id, chunk), chunks))
+            self.stdout.write("Rebuilt {} {} transactions".format(len(object_ids), kind))
+        self.stdout.write(self.style.SUCCESS("Rebuilt {} transactions".format(rebuilt)))
+
+    def rebuild_chunk(self, kind: str, type_id: int, object_ids: list) -> int:
+        close_old_connections()
+        model = READ_SERIALIZERS[kind].Meta.model
+        handler = CALLBACK_HANDLERS[kind]()
+        events = TransactionEvent.objects.filter(
+            transaction_type=type_id, object_id__in=object_ids
+        ).order_by("object_id", "id")
+        try:
+            with replaying(), transaction.atomic():
+                for object_id, object_events in groupby(events.iterator(), key=lambda event: event.object_id):
+                    self.rebuild_one(kind, model, handler, object_id, list(object_events))
+        finally:
+            close_old_connections()
+        return len(object_ids)
+
+    def rebuild_one(self, kind, model, handler, object_id, events):
+        fields = {}
+        for event in events:
+            if event.kind == TransactionEvent.REQUEST_SENT:
+                fields.update(project_request(kind, event.data))
+            elif event.kind == TransactionEvent.ACKNOWLEDGED:
+                fields.update(project_acknowledgement(kind, event.data))
+        if fields:
+            model.objects.update_or_create(pk=object_id, defaults=fields)
+        for event in events:
+            if event.kind == TransactionEvent.CALLBACK_RECEIVED:
+                handler(event.data)
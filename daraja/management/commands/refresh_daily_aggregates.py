@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from daraja.reports import refresh_daily_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily transaction aggregates of the days that changed since the last run. "
+        "Schedule it every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Recompute every day instead of only the changed ones.")
+
+    def handle(self, *args, **options):
+        refreshed = refresh_daily_aggregates(full=options["full"])
+        self.stdout.write("Refreshed {} daily aggregates".format(refreshed))
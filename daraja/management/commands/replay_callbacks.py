@@ -0,0 +1,134 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils.dateparse import parse_datetime
+
+from daraja.payloads import payload_archive
+from daraja.replay import apply_batch, read_archive, read_events, read_files, shard
+from daraja.serializers import READ_SERIALIZERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-applies stored raw callbacks with the current handlers, e.g. after a parsing fix. Callbacks are read "
+        "from the event log, payload archive segments or JSON lines files, sharded by transaction across a "
+        "process pool and applied in batched transactions. Webhooks, the event log and the payload archive "
+        "are not fed by the replay."
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument(
+            "--archive", nargs="*", metavar="SEGMENT",
+            help="Read payload archive segments, all of them when none are named."
+        )
+        source.add_argument("--files", nargs="+", metavar="PATH", help="Read JSON lines files (.jsonl or .jsonl.gz).")
+        parser.add_argument(
+            "--type", choices=sorted(READ_SERIALIZERS), action="append", dest="types",
+            help="Only replay these transaction types. With a single type, archive and file callbacks are taken "
+                 "to be of that type instead of being detected."
+        )
+        parser.add_argument("--since", help="Only replay event log callbacks recorded at or after this ISO datetime.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=1000, help="Callbacks per transaction.")
+        parser.add_argument("--window", type=int, default=50000, help="Callbacks read between checkpoints.")
+        parser.add_argument("--dry-run", action="store_true", help="Roll back and print the changes instead.")
+        parser.add_argument("--diff-limit", type=int, default=20, help="Changed rows to print in a dry run.")
+        parser.add_argument("--checkpoint", help="File recording the last replayed position.")
+        parser.add_argument("--resume", action="store_true", help="Continue after the position in --checkpoint.")
+
+    def handle(self, *args, **options):
+        if options["resume"] and not options["checkpoint"]:
+            raise CommandError("--resume needs --checkpoint")
+        types = options["types"] or sorted(READ_SERIALIZERS)
+        source, reader = self.get_source(options, types)
+
+        after = None
+        if options["resume"] and os.path.exists(options["checkpoint"]):
+            with open(options["checkpoint"]) as checkpoint:
+                saved = json.load(checkpoint)
+            if saved["source"] != source:
+                raise CommandError("The checkpoint was written for {}".format(saved["source"]))
+            after = saved["position"]
+            self.stdout.write("Resuming after {}".format(after))
+        callbacks = reader(after)
+        if len(types) == 1 and (options["archive"] is not None or options["files"]):
+            callbacks = self.with_type(callbacks, types[0])
+
+        workers = max(options["workers"], 1)
+        if workers > 1 and connection.vendor == "sqlite":
+            self.stdout.write("SQLite allows one writer at a time, replaying with one worker")
+            workers = 1
+        apply = partial(apply_batch, dry_run=options["dry_run"], batch_size=options["batch_size"], types=types)
+        pool = None
+        if workers > 1:
+            # Forked workers open their own connections; none may be inherited from this process.
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+
+        totals = {"applied": 0, "changed": 0, "skipped": 0, "failed": 0}
+        printed, started, checkpointed = 0, time.monotonic(), True
+        try:
+            while True:
+                window = list(islice(callbacks, options["window"]))
+                if not window:
+                    break
+                shards = [part for part in shard(window, workers) if part]
+                failed = totals["failed"]
+                for result in (pool.map(apply, shards) if pool else map(apply, shards)):
+                    for key in totals:
+                        totals[key] += result[key]
+                    for diff in (result["diffs"] or [])[:max(options["diff_limit"] - printed, 0)]:
+                        self.stdout.write(json.dumps(diff))
+                        printed += 1
+                # A resume retries from the first window with failures; replaying a callback twice is harmless.
+                checkpointed = checkpointed and totals["failed"] == failed
+                if options["checkpoint"] and not options["dry_run"] and checkpointed:
+                    self.save_checkpoint(options["checkpoint"], source, window[-1][0])
+                elapsed = time.monotonic() - started
+                self.stdout.write("Replayed {} callbacks, {:.0f}/s".format(
+                    totals["applied"], totals["applied"] / elapsed if elapsed else 0
+                ))
+        finally:
+            if pool:
+                pool.shutdown()
+
+        summary = "{} {} callbacks, {} skipped, {} failed".format(
+            "Would change {} rows with".format(totals["changed"]) if options["dry_run"] else "Replayed",
+            totals["applied"], totals["skipped"], totals["failed"],
+        )
+        self.stdout.write(self.style.SUCCESS(summary) if not totals["failed"] else self.style.WARNING(summary))
+
+    def get_source(self, options, types):
+        if options["files"]:
+            paths = [os.path.abspath(path) for path in options["files"]]
+            return "files:{}".format(",".join(paths)), lambda after: read_files(paths, after)
+        if options["archive"] is not None:
+            if not payload_archive.config["DIRECTORY"]:
+                raise CommandError("--archive needs DARAJA_PAYLOAD_ARCHIVE DIRECTORY to be set")
+            segments = options["archive"] or sorted(
+                name for name in os.listdir(payload_archive.config["DIRECTORY"]) if name.endswith(".dpa")
+            )
+            return "archive:{}".format(",".join(segments)), lambda after: read_archive(segments, after)
+        since = parse_datetime(options["since"]) if options["since"] else None
+        if options["since"] and since is None:
+            raise CommandError("--since must be an ISO datetime")
+        source = "events:{}:{}".format(",".join(types), options["since"] or "")
+        return source, lambda after: read_events(types, since, after)
+
+    def with_type(self, callbacks, kind: str):
+        for position, _, payload, key in callbacks:
+            yield position, kind, payload, key
+
+    def save_checkpoint(self, path: str, source: str, position):
+        temporary = path + ".tmp"
+        with open(temporary, "w") as checkpoint:
+            json.dump({"source": source, "position": position}, checkpoint)
+        os.replace(temporary, path)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from daraja.campaigns import CampaignRunner
+from daraja.models import Campaign
+
+
+class Command(BaseCommand):
+    help = "Sends, or resumes sending, the STK pushes of a campaign. Use --pause to stop a running campaign."
+
+    def add_arguments(self, parser):
+        parser.add_argument("campaign_id", type=int)
+        parser.add_argument("--pause", action="store_true")
+
+    def handle(self, *args, **options):
+        campaign = Campaign.objects.filter(pk=options["campaign_id"]).first()
+        if campaign is None:
+            raise CommandError("Campaign {} does not exist".format(options["campaign_id"]))
+        runner = CampaignRunner(campaign)
+        if options["pause"]:
+            runner.pause()
+            self.stdout.write("Paused campaign {}".format(campaign.pk))
+            return
+
+        completed = runner.run()
+        campaign.refresh_from_db()
+        self.stdout.write("Campaign {} {}: {} sent, {} failed, {} unknown of {}".format(
+            campaign.pk, "completed" if completed else campaign.get_status_display().lower(),
+            campaign.sent_count, campaign.failed_count, campaign.unknown_count, campaign.total_count
+        ))
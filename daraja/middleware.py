@@ -0,0 +1,140 @@
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from daraja.tracing import tracer
+
+logging = logging.getLogger("default")
+
+DEFAULT_PROFILING = {
+    "ENABLED": False,
+    "PATH_PREFIX": "/daraja/",
+    "QUERY_BUDGETS": {},
+    "DEFAULT_QUERY_BUDGET": None,
+    "STRICT": False,
+    "SLOW_REQUEST_MS": 1000,
+    "PROFILE_SAMPLE_RATE": 0.0,
+    "PROFILE_DIR": "profiles",
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a view runs more queries than its budget and profiling is strict.
+    """
+
+
+class TracingMiddleware:
+    """
+    Opens the root "view" span for every request under the daraja url prefix.
+    Removed from the middleware chain when tracing is disabled.
+    """
+    def __init__(self, get_response):
+        if not tracer.enabled:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.path_prefix = tracer.config["PATH_PREFIX"]
+
+    def __call__(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return self.get_response(request)
+
+        with tracer.span("view", path=request.path, method=request.method) as span:
+            response = self.get_response(request)
+            span.set_attribute("status_code", response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        tracer.current_span().set_attribute("view", getattr(view_func, "view_class", view_func).__name__)
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that counts queries and the time spent in them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class ProfilingMiddleware:
+    """
+    Records CPU time, wall time and query count/time for every daraja view and enforces per-view
+    query budgets. Budgets are keyed by view class name; when STRICT is on (e.g. in tests) going
+    over budget raises QueryBudgetExceeded, otherwise it is logged. A sample of requests is run
+    under cProfile and the stats are dumped to PROFILE_DIR when the request is slower than
+    SLOW_REQUEST_MS. Removed from the middleware chain unless enabled.
+    """
+    def __init__(self, get_response):
+        self.config = {**DEFAULT_PROFILING, **getattr(settings, "DARAJA_PROFILING", {})}
+        if not self.config["ENABLED"]:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(self.config["PATH_PREFIX"]):
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        profiler = cProfile.Profile() if random.random() < self.config["PROFILE_SAMPLE_RATE"] else None
+        cpu_start, wall_start = time.thread_time(), time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            if profiler:
+                profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profiler:
+                    profiler.disable()
+        cpu_ms = (time.thread_time() - cpu_start) * 1000
+        wall_ms = (time.perf_counter() - wall_start) * 1000
+        query_ms = counter.duration * 1000
+
+        view_name = getattr(request, "daraja_view_name", request.path)
+        response["Server-Timing"] = "total;dur={:.1f}, cpu;dur={:.1f}, db;dur={:.1f};desc=\"{} queries\"".format(
+            wall_ms, cpu_ms, query_ms, counter.count
+        )
+        logging.info(
+            "profile view={} wall_ms={:.1f} cpu_ms={:.1f} queries={} query_ms={:.1f}".format(
+                view_name, wall_ms, cpu_ms, counter.count, query_ms
+            )
+        )
+        if profiler and wall_ms >= self.config["SLOW_REQUEST_MS"]:
+            self.dump_profile(profiler, view_name)
+        self.check_budget(view_name, counter.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.daraja_view_name = getattr(view_func, "view_class", view_func).__name__
+
+    def check_budget(self, view_name: str, query_count: int):
+        budget = self.config["QUERY_BUDGETS"].get(view_name, self.config["DEFAULT_QUERY_BUDGET"])
+        if budget is None or query_count <= budget:
+            return
+        message = "{} ran {} queries, budget is {}".format(view_name, query_count, budget)
+        if self.config["STRICT"]:
+            raise QueryBudgetExceeded(message)
+        logging.warning(message)
+
+    def dump_profile(self, profiler: cProfile.Profile, view_name: str):
+        os.makedirs(self.config["PROFILE_DIR"], exist_ok=True)
+        path = os.path.join(self.config["PROFILE_DIR"], "{}-{}.prof".format(view_name, int(time.time() * 1000)))
+        profiler.dump_stats(path)
+        logging.info("Dumped profile for slow request to {}".format(path))
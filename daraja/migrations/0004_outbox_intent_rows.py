@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0003_b2bexpresstransaction_ailure_description'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='b2btransaction',
+            name='conversation_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='b2ctransaction',
+            name='conversation_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stktransaction',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='stktransaction',
+            name='status',
+            field=models.CharField(choices=[(0, 'Complete'), (1, 'Pending'), (2, 'Failed')], default=1, max_length=10),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0004_outbox_intent_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='b2bexpresstransaction',
+            name='status',
+            field=models.CharField(choices=[(0, 'Complete'), (1, 'Pending'), (2, 'Failed')], default=1, max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='b2ctopup',
+            name='conversation_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='b2bexpresstransaction',
+            index=models.Index(fields=['created_at', 'id'], name='b2b_express_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2bexpresstransaction',
+            index=models.Index(fields=['status', 'created_at'], name='b2b_express_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2btransaction',
+            index=models.Index(fields=['created_at', 'id'], name='b2b_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2btransaction',
+            index=models.Index(fields=['status', 'created_at'], name='b2b_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2ctopup',
+            index=models.Index(fields=['created_at', 'id'], name='b2c_topup_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2ctopup',
+            index=models.Index(fields=['status', 'created_at'], name='b2c_topup_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2ctransaction',
+            index=models.Index(fields=['created_at', 'id'], name='b2c_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='b2ctransaction',
+            index=models.Index(fields=['status', 'created_at'], name='b2c_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stktransaction',
+            index=models.Index(fields=['created_at', 'id'], name='stk_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stktransaction',
+            index=models.Index(fields=['status', 'created_at'], name='stk_status_created_idx'),
+        ),
+    ]
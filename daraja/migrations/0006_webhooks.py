@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:39
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0005_read_api_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('url', models.URLField(max_length=500)),
+                ('secret', models.CharField(max_length=255)),
+                ('event_types', models.JSONField(blank=True, default=list)),
+                ('max_concurrency', models.PositiveSmallIntegerField(default=4)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'WebhookSubscription',
+                'verbose_name_plural': 'WebhookSubscriptions',
+            },
+        ),
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event_id', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('event_type', models.CharField(max_length=50)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[(0, 'Delivered'), (1, 'Pending'), (2, 'Failed')], default=1, max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('response_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('next_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='daraja.webhooksubscription')),
+            ],
+            options={
+                'verbose_name': 'WebhookDelivery',
+                'verbose_name_plural': 'WebhookDeliveries',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='webhook_status_next_idx')],
+            },
+        ),
+    ]
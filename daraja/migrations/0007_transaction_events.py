@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:41
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0006_webhooks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Request sent'), (1, 'Daraja acknowledged'), (2, 'Callback received'), (3, 'Status changed')])),
+                ('transaction_type', models.PositiveSmallIntegerField(choices=[(0, 'stk'), (1, 'b2c'), (2, 'b2b'), (3, 'topup'), (4, 'express')])),
+                ('object_id', models.BigIntegerField()),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('payload', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'TransactionEvent',
+                'verbose_name_plural': 'TransactionEvents',
+                'indexes': [models.Index(fields=['transaction_type', 'object_id', 'id'], name='event_object_idx'), models.Index(fields=['created_at'], name='event_created_idx')],
+            },
+        ),
+    ]
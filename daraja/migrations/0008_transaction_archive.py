@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0007_transaction_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.BinaryField()),
+                ('transaction_type', models.PositiveSmallIntegerField(choices=[(0, 'stk'), (1, 'b2c'), (2, 'b2b'), (3, 'topup'), (4, 'express')])),
+                ('object_id', models.BigIntegerField()),
+                ('lookup_value', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('status', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'ArchivedTransaction',
+                'verbose_name_plural': 'ArchivedTransactions',
+                'indexes': [models.Index(fields=['transaction_type', 'created_at'], name='archived_type_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='archivedtransaction',
+            constraint=models.UniqueConstraint(fields=('transaction_type', 'object_id'), name='archived_object_uniq'),
+        ),
+    ]
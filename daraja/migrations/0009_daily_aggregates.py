@@ -0,0 +1,61 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0008_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(choices=[('working', 'B2C working account'), ('utility', 'B2C utility account'), ('charges_paid', 'B2C charges paid account'), ('b2b_debit', 'B2B debit account'), ('b2b_initiator', 'B2B initiator account'), ('topup_debit', 'Top up debit account'), ('topup_initiator', 'Top up initiator account')], max_length=20, unique=True)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('transaction_type', models.PositiveSmallIntegerField(choices=[(0, 'stk'), (1, 'b2c'), (2, 'b2b'), (3, 'topup'), (4, 'express')])),
+                ('object_id', models.BigIntegerField()),
+                ('observed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'AccountBalance',
+                'verbose_name_plural': 'AccountBalances',
+            },
+        ),
+        migrations.CreateModel(
+            name='AggregateWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('processed_until', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'AggregateWatermark',
+                'verbose_name_plural': 'AggregateWatermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyTransactionAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('transaction_type', models.PositiveSmallIntegerField(choices=[(0, 'stk'), (1, 'b2c'), (2, 'b2b'), (3, 'topup'), (4, 'express')])),
+                ('status', models.CharField(max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('amount', models.BigIntegerField(default=0)),
+                ('charges', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'DailyTransactionAggregate',
+                'verbose_name_plural': 'DailyTransactionAggregates',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailytransactionaggregate',
+            constraint=models.UniqueConstraint(fields=('date', 'transaction_type', 'status'), name='daily_aggregate_uniq'),
+        ),
+    ]
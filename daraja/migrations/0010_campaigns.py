@@ -0,0 +1,60 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:48
+
+import django.db.models.deletion
+import phonenumber_field.modelfields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0009_daily_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=255)),
+                ('description', models.CharField(max_length=200)),
+                ('reference', models.CharField(max_length=200)),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Draft'), (1, 'Running'), (2, 'Paused'), (3, 'Completed')], default=0)),
+                ('rate_per_second', models.FloatField(default=10)),
+                ('max_concurrency', models.PositiveSmallIntegerField(default=8)),
+                ('total_count', models.PositiveIntegerField(default=0)),
+                ('sent_count', models.PositiveIntegerField(default=0)),
+                ('failed_count', models.PositiveIntegerField(default=0)),
+                ('unknown_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Campaign',
+                'verbose_name_plural': 'Campaigns',
+            },
+        ),
+        migrations.CreateModel(
+            name='CampaignRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', phonenumber_field.modelfields.PhoneNumberField(max_length=128, region=None)),
+                ('amount', models.PositiveIntegerField()),
+                ('reference', models.CharField(blank=True, max_length=200, null=True)),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Queued'), (1, 'Sending'), (2, 'Sent'), (3, 'Failed'), (4, 'Unknown')], default=0)),
+                ('checkout_request_id', models.CharField(blank=True, max_length=200, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('attempted_at', models.DateTimeField(blank=True, null=True)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='daraja.campaign')),
+            ],
+            options={
+                'verbose_name': 'CampaignRecipient',
+                'verbose_name_plural': 'CampaignRecipients',
+                'indexes': [models.Index(fields=['campaign', 'status', 'id'], name='campaign_recipient_status_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='campaignrecipient',
+            constraint=models.UniqueConstraint(fields=('campaign', 'phone_number'), name='campaign_recipient_uniq'),
+        ),
+    ]
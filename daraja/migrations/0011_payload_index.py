@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0010_campaigns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayloadIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Outbound request'), (1, 'Callback')])),
+                ('segment', models.CharField(max_length=100)),
+                ('offset', models.BigIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'PayloadIndex',
+                'verbose_name_plural': 'PayloadIndexes',
+                'indexes': [models.Index(fields=['key', 'kind'], name='payload_key_idx')],
+            },
+        ),
+    ]
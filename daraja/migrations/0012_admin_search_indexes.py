@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-19 16:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0011_payload_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='b2ctransaction',
+            index=models.Index(fields=['recipient_phonenumber', 'created_at'], name='b2c_recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stktransaction',
+            index=models.Index(fields=['phone_number', 'created_at'], name='stk_phone_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stktransaction',
+            index=models.Index(fields=['receipt_no'], name='stk_receipt_idx'),
+        ),
+    ]
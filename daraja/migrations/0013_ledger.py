@@ -0,0 +1,76 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:06
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0012_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(0, 'Asset'), (1, 'Liability'), (2, 'Income'), (3, 'Expense')])),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'LedgerAccount',
+                'verbose_name_plural': 'LedgerAccounts',
+            },
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('running_balance', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Posting',
+                'verbose_name_plural': 'Postings',
+            },
+        ),
+        migrations.CreateModel(
+            name='JournalEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.PositiveSmallIntegerField(choices=[(0, 'stk'), (1, 'b2c'), (2, 'b2b'), (3, 'topup'), (4, 'express')])),
+                ('object_id', models.BigIntegerField()),
+                ('description', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'JournalEntry',
+                'verbose_name_plural': 'JournalEntries',
+                'indexes': [models.Index(fields=['created_at'], name='journal_entry_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='journalentry',
+            constraint=models.UniqueConstraint(fields=('transaction_type', 'object_id'), name='journal_entry_source_uniq'),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='daraja.ledgeraccount'),
+        ),
+        migrations.AddField(
+            model_name='posting',
+            name='entry',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='daraja.journalentry'),
+        ),
+        migrations.AddIndex(
+            model_name='posting',
+            index=models.Index(fields=['account', 'created_at', 'id'], name='posting_account_created_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-19 17:22
+
+import phonenumber_field.modelfields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daraja', '0013_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stktransaction',
+            name='amount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='stktransaction',
+            name='phone_number',
+            field=phonenumber_field.modelfields.PhoneNumberField(blank=True, max_length=128, null=True, region=None),
+        ),
+    ]
@@ -1,6 +1,9 @@
+import json
 import uuid
+import zlib
 
 from django.db import models
+from django.utils import timezone
 
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
@@ -15,11 +18,13 @@ class BaseModel(models.Model):
 
 
 class STKTransaction(BaseModel):
-    STATUS = ((0, "Complete"), (1, "Pending"),)
-    phone_number = PhoneNumberField()
-    checkout_request_id = models.CharField(max_length=200, unique=True)
+    STATUS = ((0, "Complete"), (1, "Pending"), (2, "Failed"),)
+    # Null only on the placeholder row of a callback that arrived before its checkout_request_id was written,
+    # until the intent row is merged into it.
+    phone_number = PhoneNumberField(null=True, blank=True)
+    checkout_request_id = models.CharField(max_length=200, unique=True, null=True, blank=True)
     description = models.TextField(blank=True, null=True)
-    amount = models.IntegerField()
+    amount = models.IntegerField(null=True, blank=True)
     status = models.CharField(max_length=10, choices=STATUS, default=1)
     receipt_no = models.CharField(max_length=200, blank=True, null=True)
     ip_address = models.CharField(max_length=200, blank=True, null=True)
@@ -29,10 +34,16 @@ class STKTransaction(BaseModel):
     class Meta:
         verbose_name = _("STKTransaction")
         verbose_name_plural = _("STKTransactions")
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="stk_created_id_idx"),
+            models.Index(fields=["status", "created_at"], name="stk_status_created_idx"),
+            models.Index(fields=["phone_number", "created_at"], name="stk_phone_created_idx"),
+            models.Index(fields=["receipt_no"], name="stk_receipt_idx"),
+        ]
 
 class B2CTransaction(BaseModel):
     STATUS = ((0, "Complete"), (1, "Pending"),  (2, "Failed"),)
-    conversation_id = models.CharField(max_length=255, unique=True)
+    conversation_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
     transaction_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     transaction_amount = models.PositiveIntegerField(null=True, blank=True)
     working_account_balance = models.DecimalField(max_digits=14, decimal_places=2, null=True, blank=True)
@@ -51,12 +62,17 @@ class B2CTransaction(BaseModel):
     class Meta:
         verbose_name = _('B2CTransaction')
         verbose_name_plural = _('B2CTransactions')
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="b2c_created_id_idx"),
+            models.Index(fields=["status", "created_at"], name="b2c_status_created_idx"),
+            models.Index(fields=["recipient_phonenumber", "created_at"], name="b2c_recipient_created_idx"),
+        ]
 
 
 class B2BTransaction(BaseModel):
     STATUS = ((0, "Complete"), (1, "Pending"), (2, "Failed"))
     RECIPIENT_TYPE = (('paybill', "PayBill"), ('buygoods', 'BuyGoods'))
-    conversation_id = models.CharField(max_length=255, unique=True)
+    conversation_id = models.CharField(max_length=255, unique=True, null=True, blank=True)
     transaction_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     status = models.CharField(max_length=10, choices=STATUS, default=1)
     ip_address = models.CharField(max_length=200, blank=True, null=True)
@@ -78,13 +94,17 @@ class B2BTransaction(BaseModel):
     class Meta:
         verbose_name = _('B2BTransaction')
         verbose_name_plural = _('B2BTransactions')
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="b2b_created_id_idx"),
+            models.Index(fields=["status", "created_at"], name="b2b_status_created_idx"),
+        ]
 
 
 class B2CTopup(BaseModel):
     STATUS = ((0, "Complete"), (1, "Pending"), (2, "Failed"), )
     transaction_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
     status = models.CharField(max_length=10, choices=STATUS, default=1)
-    conversation_id = models.CharField(max_length=255, blank=True, null=True)
+    conversation_id = models.CharField(max_length=255, blank=True, null=True, db_index=True)
     debit_account_balance = models.DecimalField(max_digits=14, decimal_places=2, blank=True, null=True)
     transaction_time = models.DateTimeField(null=True, blank=True)
     amount = models.IntegerField()
@@ -101,9 +121,14 @@ class B2CTopup(BaseModel):
     class Meta:
         verbose_name = _('B2CTopup')
         verbose_name_plural = _('B2CTopups')
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="b2c_topup_created_id_idx"),
+            models.Index(fields=["status", "created_at"], name="b2c_topup_status_created_idx"),
+        ]
 
 class B2BExpressTransaction(BaseModel):
     STATUS = ((0, "Complete"), (1, "Pending"), (2, "Failed"),)
+    status = models.CharField(max_length=10, choices=STATUS, default=1)
     ip_address = models.CharField(max_length=200, blank=True, null=True)
     receiver_short_code = models.IntegerField()
     amount = models.IntegerField()
@@ -116,4 +141,303 @@ class B2BExpressTransaction(BaseModel):
 
     class Meta:
         verbose_name = _('B2BExpressTransaction')
-        verbose_name_plural = _('B2BExpressTransactions')
\ No newline at end of file
+        verbose_name_plural = _('B2BExpressTransactions')
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="b2b_express_created_id_idx"),
+            models.Index(fields=["status", "created_at"], name="b2b_express_status_created_idx"),
+        ]
+
+
+class WebhookSubscription(BaseModel):
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=255)
+    event_types = models.JSONField(default=list, blank=True)
+    max_concurrency = models.PositiveSmallIntegerField(default=4)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name = _('WebhookSubscription')
+        verbose_name_plural = _('WebhookSubscriptions')
+
+    def __str__(self):
+        return self.url
+
+    def accepts(self, event_type: str) -> bool:
+        return not self.event_types or event_type in self.event_types or event_type.split(".")[0] in self.event_types
+
+
+class WebhookDelivery(BaseModel):
+    STATUS = ((0, "Delivered"), (1, "Pending"), (2, "Failed"),)
+    subscription = models.ForeignKey(WebhookSubscription, on_delete=models.CASCADE, related_name="deliveries")
+    event_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS, default=1)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    response_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('WebhookDelivery')
+        verbose_name_plural = _('WebhookDeliveries')
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="webhook_status_next_idx"),
+        ]
+
+
+class CompressedPayloadModel(models.Model):
+    """
+    Stores a JSON document as zlib compressed bytes.
+    """
+    payload = models.BinaryField()
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def compress(data) -> bytes:
+        return zlib.compress(json.dumps(data, separators=(",", ":"), default=str).encode())
+
+    @property
+    def data(self):
+        return json.loads(zlib.decompress(self.payload))
+
+
+class TransactionEvent(CompressedPayloadModel):
+    """
+    Append-only history of a transaction. Events point at the transaction row by type and primary key,
+    and payloads are stored as zlib compressed JSON.
+    """
+    REQUEST_SENT, ACKNOWLEDGED, CALLBACK_RECEIVED, STATUS_CHANGED = 0, 1, 2, 3
+    KIND = (
+        (REQUEST_SENT, "Request sent"), (ACKNOWLEDGED, "Daraja acknowledged"),
+        (CALLBACK_RECEIVED, "Callback received"), (STATUS_CHANGED, "Status changed"),
+    )
+    TRANSACTION_TYPE = ((0, "stk"), (1, "b2c"), (2, "b2b"), (3, "topup"), (4, "express"),)
+    created_at = models.DateTimeField(default=timezone.now)
+    kind = models.PositiveSmallIntegerField(choices=KIND)
+    transaction_type = models.PositiveSmallIntegerField(choices=TRANSACTION_TYPE)
+    object_id = models.BigIntegerField()
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('TransactionEvent')
+        verbose_name_plural = _('TransactionEvents')
+        indexes = [
+            models.Index(fields=["transaction_type", "object_id", "id"], name="event_object_idx"),
+            models.Index(fields=["created_at"], name="event_created_idx"),
+        ]
+
+
+class ArchivedTransaction(CompressedPayloadModel):
+    """
+    Cold storage for finalized transactions moved out of the hot tables by the archive_transactions command.
+    The full row is kept in payload; the Daraja id it was looked up by stays indexed in lookup_value.
+    """
+    transaction_type = models.PositiveSmallIntegerField(choices=TransactionEvent.TRANSACTION_TYPE)
+    object_id = models.BigIntegerField()
+    lookup_value = models.CharField(max_length=255, blank=True, null=True, db_index=True)
+    status = models.CharField(max_length=10)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('ArchivedTransaction')
+        verbose_name_plural = _('ArchivedTransactions')
+        constraints = [
+            models.UniqueConstraint(fields=["transaction_type", "object_id"], name="archived_object_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["transaction_type", "created_at"], name="archived_type_created_idx"),
+        ]
+
+
+class DailyTransactionAggregate(models.Model):
+    """
+    Count and totals of the transactions created on a day in Nairobi time, per type and status.
+    Maintained by the refresh_daily_aggregates command, see daraja/reports.py.
+    """
+    date = models.DateField()
+    transaction_type = models.PositiveSmallIntegerField(choices=TransactionEvent.TRANSACTION_TYPE)
+    status = models.CharField(max_length=10)
+    count = models.PositiveIntegerField(default=0)
+    amount = models.BigIntegerField(default=0)
+    charges = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('DailyTransactionAggregate')
+        verbose_name_plural = _('DailyTransactionAggregates')
+        constraints = [
+            models.UniqueConstraint(fields=["date", "transaction_type", "status"], name="daily_aggregate_uniq"),
+        ]
+
+
+class AccountBalance(models.Model):
+    """
+    The latest balance Daraja reported for an account in a result callback.
+    """
+    ACCOUNT = (
+        ("working", "B2C working account"), ("utility", "B2C utility account"),
+        ("charges_paid", "B2C charges paid account"), ("b2b_debit", "B2B debit account"),
+        ("b2b_initiator", "B2B initiator account"), ("topup_debit", "Top up debit account"),
+        ("topup_initiator", "Top up initiator account"),
+    )
+    account = models.CharField(max_length=20, choices=ACCOUNT, unique=True)
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    transaction_type = models.PositiveSmallIntegerField(choices=TransactionEvent.TRANSACTION_TYPE)
+    object_id = models.BigIntegerField()
+    observed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = _('AccountBalance')
+        verbose_name_plural = _('AccountBalances')
+
+
+class AggregateWatermark(models.Model):
+    """
+    How far into the transaction event log an incremental job has processed.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    processed_until = models.DateTimeField()
+
+    class Meta:
+        verbose_name = _('AggregateWatermark')
+        verbose_name_plural = _('AggregateWatermarks')
+
+
+class Campaign(BaseModel):
+    """
+    A bulk STK push to a list of CampaignRecipients, sent by the run_campaign command.
+    """
+    DRAFT, RUNNING, PAUSED, COMPLETED = 0, 1, 2, 3
+    STATUS = ((DRAFT, "Draft"), (RUNNING, "Running"), (PAUSED, "Paused"), (COMPLETED, "Completed"),)
+    name = models.CharField(max_length=255)
+    description = models.CharField(max_length=200)
+    reference = models.CharField(max_length=200)
+    status = models.PositiveSmallIntegerField(choices=STATUS, default=DRAFT)
+    rate_per_second = models.FloatField(default=10)
+    max_concurrency = models.PositiveSmallIntegerField(default=8)
+    total_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)
+    unknown_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _('Campaign')
+        verbose_name_plural = _('Campaigns')
+
+    def __str__(self):
+        return self.name
+
+
+class CampaignRecipient(models.Model):
+    """
+    One push of a campaign. A recipient is claimed (QUEUED to SENDING) before its push is made, so a
+    recipient left SENDING by a crash may or may not have been pushed and is marked UNKNOWN, never resent.
+    """
+    QUEUED, SENDING, SENT, FAILED, UNKNOWN = 0, 1, 2, 3, 4
+    STATUS = ((QUEUED, "Queued"), (SENDING, "Sending"), (SENT, "Sent"), (FAILED, "Failed"), (UNKNOWN, "Unknown"),)
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name="recipients")
+    phone_number = PhoneNumberField()
+    amount = models.PositiveIntegerField()
+    reference = models.CharField(max_length=200, blank=True, null=True)
+    status = models.PositiveSmallIntegerField(choices=STATUS, default=QUEUED)
+    checkout_request_id = models.CharField(max_length=200, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    attempted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('CampaignRecipient')
+        verbose_name_plural = _('CampaignRecipients')
+        constraints = [
+            models.UniqueConstraint(fields=["campaign", "phone_number"], name="campaign_recipient_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["campaign", "status", "id"], name="campaign_recipient_status_idx"),
+        ]
+
+
+class PayloadIndex(models.Model):
+    """
+    Locates archived raw payloads by the Daraja ids they carry, see daraja/payloads.py.
+    """
+    OUTBOUND, CALLBACK = 0, 1
+    KIND = ((OUTBOUND, "Outbound request"), (CALLBACK, "Callback"),)
+    key = models.CharField(max_length=255)
+    kind = models.PositiveSmallIntegerField(choices=KIND)
+    segment = models.CharField(max_length=100)
+    offset = models.BigIntegerField()
+    length = models.PositiveIntegerField()
+    position = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('PayloadIndex')
+        verbose_name_plural = _('PayloadIndexes')
+        indexes = [
+            models.Index(fields=["key", "kind"], name="payload_key_idx"),
+        ]
+
+
+class LedgerAccount(models.Model):
+    """
+    An account of the double-entry ledger, see daraja/ledger.py. balance is the sum of the account's postings,
+    debits positive and credits negative, kept up to date as postings are written.
+    """
+    ASSET, LIABILITY, INCOME, EXPENSE = 0, 1, 2, 3
+    KIND = ((ASSET, "Asset"), (LIABILITY, "Liability"), (INCOME, "Income"), (EXPENSE, "Expense"),)
+    code = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255)
+    kind = models.PositiveSmallIntegerField(choices=KIND)
+    balance = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _('LedgerAccount')
+        verbose_name_plural = _('LedgerAccounts')
+
+    def __str__(self):
+        return self.code
+
+
+class JournalEntry(models.Model):
+    """
+    The balanced postings of one completed transaction. There is at most one entry per transaction, so
+    posting a transaction again is a no-op.
+    """
+    transaction_type = models.PositiveSmallIntegerField(choices=TransactionEvent.TRANSACTION_TYPE)
+    object_id = models.BigIntegerField()
+    description = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('JournalEntry')
+        verbose_name_plural = _('JournalEntries')
+        constraints = [
+            models.UniqueConstraint(fields=["transaction_type", "object_id"], name="journal_entry_source_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["created_at"], name="journal_entry_created_idx"),
+        ]
+
+
+class Posting(models.Model):
+    """
+    One line of a journal entry, a debit (positive amount) or credit (negative amount) to an account.
+    running_balance is the account's balance right after the posting.
+    """
+    entry = models.ForeignKey(JournalEntry, on_delete=models.PROTECT, related_name="postings")
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name="postings")
+    amount = models.DecimalField(max_digits=16, decimal_places=2)
+    running_balance = models.DecimalField(max_digits=18, decimal_places=2)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = _('Posting')
+        verbose_name_plural = _('Postings')
+        indexes = [
+            models.Index(fields=["account", "created_at", "id"], name="posting_account_created_idx"),
+        ]
@@ -0,0 +1,86 @@
+import re
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import phonenumbers
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework import serializers
+
+KENYA_COUNTRY_CODE = 254
+DEFAULT_REGION = "KE"
+CACHE_SIZE = 65536
+
+# 0712345678, 712345678, 254712345678 and +254712345678, for the 07xx and 01xx ranges.
+KENYAN_MSISDN = re.compile(r"^(?:\+?254|0)?([17]\d{8})$")
+SEPARATORS = re.compile(r"[\s\-().]")
+
+
+class InvalidMSISDN(ValueError):
+    pass
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _components(value: str) -> Tuple[int, int]:
+    compact = SEPARATORS.sub("", value)
+    match = KENYAN_MSISDN.match(compact)
+    if match:
+        return KENYA_COUNTRY_CODE, int(match.group(1))
+
+    # Anything else goes through the full libphonenumber parser.
+    try:
+        number = phonenumbers.parse(value, DEFAULT_REGION)
+    except phonenumbers.NumberParseException as e:
+        raise InvalidMSISDN(value) from e
+    if not phonenumbers.is_valid_number(number):
+        raise InvalidMSISDN(value)
+    return number.country_code, number.national_number
+
+
+def normalize(value) -> str:
+    """
+    Normalizes a phone number to the MSISDN format Daraja expects, e.g. "0712 345 678" to "254712345678".
+    Common Kenyan formats are matched with a regular expression; other input falls back to libphonenumber.
+    Results are kept in a bounded LRU cache.
+    Args:
+        value (str | int): The phone number as entered or as sent in a callback.
+    Returns:
+        str: The country code and national number without a leading "+".
+    Raises:
+        InvalidMSISDN: If the value is not a valid phone number.
+    """
+    country_code, national_number = _components(str(value).strip())
+    return "{}{}".format(country_code, national_number)
+
+
+def to_phone_number(value) -> Optional[PhoneNumber]:
+    """
+    Builds a PhoneNumber for a PhoneNumberField from a normalized or raw phone number without parsing it again.
+    Values that are not valid numbers, such as the masked numbers in some callbacks, are kept as raw input.
+    """
+    if value in (None, ""):
+        return None
+    try:
+        country_code, national_number = _components(str(value).strip())
+    except InvalidMSISDN:
+        return PhoneNumber(raw_input=str(value))
+    return PhoneNumber(country_code=country_code, national_number=national_number)
+
+
+def cache_info():
+    return _components.cache_info()
+
+
+class MSISDNField(serializers.CharField):
+    """
+    A phone number input normalized to the Daraja MSISDN format ("2547XXXXXXXX").
+    """
+    default_error_messages = {
+        "invalid": "Enter a valid phone number.",
+    }
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            return normalize(value)
+        except InvalidMSISDN:
+            self.fail("invalid")
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from daraja.caching import LOOKUP_FIELDS
+from daraja.serializers import READ_SERIALIZERS, transaction_kind
+from daraja.signals import transaction_updated
+
+logging = logging.getLogger("default")
+
+DEFAULT_NOTIFIER = {
+    "BACKEND": "daraja.notifier.LocalNotifier",
+    "POLL_INTERVAL": 0.5,
+    "TTL": 300,
+}
+
+
+class Subscription:
+    """
+    A pending wait for the next message published under a key.
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+
+class LocalNotifier:
+    """
+    Wakes waiters in the same process. Callback handlers publish from their request thread and
+    waiters are resolved on their own event loop, so a waiting request costs no CPU and no queries.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, key: str) -> Subscription:
+        """
+        Registers interest in a key. Subscribe before reading the current state so that a publish in
+        between is not missed. Must be called from a running event loop.
+        """
+        subscription = Subscription(key)
+        with self._lock:
+            self._subscriptions[key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.key]
+
+    async def wait(self, subscription: Subscription, timeout: float) -> Optional[dict]:
+        """
+        Waits for a message on the subscription.
+        Returns:
+            Optional[dict]: The published message, or None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(subscription.future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def publish(self, key: str, message: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(self._resolve, subscription.future, message)
+            except RuntimeError:
+                # The waiting request's loop has already closed.
+                self.unsubscribe(subscription)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, message: dict):
+        if not future.done():
+            future.set_result(message)
+
+
+class CacheNotifier(LocalNotifier):
+    """
+    Wakes waiters across worker processes through the shared cache. Published messages are kept in
+    the cache for TTL seconds and waiters check for them every POLL_INTERVAL, so callbacks handled by
+    another worker are picked up without any database reads. Waiters in the publishing process are
+    still woken immediately.
+    """
+    def cache_key(self, key: str) -> str:
+        return "daraja:notify:{}".format(key)
+
+    def publish(self, key: str, message: dict):
+        message = {**message, "published_at": time.time()}
+        cache.set(self.cache_key(key), message, self.config["TTL"])
+        super().publish(key, message)
+
+    async def wait(self, subscription: Subscription, timeout: float) -> Optional[dict]:
+        subscribed_at = time.time()
+        deadline = time.monotonic() + timeout
+        while True:
+            message = await sync_to_async(cache.get)(self.cache_key(subscription.key))
+            if message is not None and message["published_at"] >= subscribed_at:
+                return message
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = await super().wait(subscription, min(self.config["POLL_INTERVAL"], remaining))
+            if message is not None:
+                return message
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> LocalNotifier:
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                config = {**DEFAULT_NOTIFIER, **getattr(settings, "DARAJA_NOTIFIER", {})}
+                _notifier = import_string(config["BACKEND"])(config)
+    return _notifier
+
+
+def status_message(kind: str, instance) -> dict:
+    return {
+        "type": kind,
+        "final": str(instance.status) != "1",
+        "transaction": dict(READ_SERIALIZERS[kind](instance).data),
+    }
+
+
+@receiver(transaction_updated)
+def publish_transaction_update(sender, instance, **kwargs):
+    key = getattr(instance, LOOKUP_FIELDS[sender])
+    if not key:
+        return
+    try:
+        get_notifier().publish(key, status_message(transaction_kind(sender), instance))
+    except Exception as e:
+        logging.error("Status notification failed for {} {}".format(key, e))
@@ -0,0 +1,120 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List, Tuple, Type
+
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+from daraja.batching import WriteBehindBuffer
+from daraja.caching import invalidate_cached_transactions
+from daraja.events import event_log, transaction_type_id
+from daraja.models import TransactionEvent
+from daraja.sharding import sharding
+from daraja.tracing import tracer
+
+logging = logging.getLogger("default")
+
+
+class TransactionOutbox(WriteBehindBuffer):
+    """
+    Records a transaction row before the Daraja call is made and fills in the Daraja ids afterwards.
+
+    The intent row is inserted synchronously so a record exists before any money moves. Completions
+    (the ids returned by Daraja, or a failed status) are written synchronously too by default. With ASYNC
+    they are queued and flushed by a background thread with one bulk_update per model and field set, so
+    the extra write does not add to the checkout latency, at the cost of intent rows left without their
+    Daraja ids if a worker dies with completions queued. If a callback raced ahead and already created a
+    row under the returned id, the intent row is merged into it instead.
+    """
+    settings_name = "DARAJA_OUTBOX"
+    thread_name = "daraja-outbox"
+    defaults = {
+        "ASYNC": False,
+        "BATCH_SIZE": 100,
+        "FLUSH_INTERVAL": 0.05,
+    }
+
+    def record_intent(self, model: Type[models.Model], using: str = "default", **fields) -> models.Model:
+        """
+        Inserts the pending transaction row before the outbound call.
+        Args:
+            model (Type[Model]): The transaction model.
+            using (str): The database alias to write to.
+            **fields: The request details known before calling Daraja.
+        Returns:
+            Model: The saved intent row.
+        """
+        with tracer.span("db.write", model=model.__name__, outbox="intent"):
+            instance = model.objects.db_manager(using).create(**fields)
+        sharding.remember(instance)
+        return instance
+
+    def complete(self, instance: models.Model, **fields):
+        """
+        Applies the Daraja response to an intent row.
+        Args:
+            instance (Model): The intent row returned by record_intent.
+            **fields: The fields to update, e.g. checkout_request_id or conversation_id.
+        """
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        sharding.remember(instance)
+        self.add((instance, tuple(sorted(fields))))
+
+    def write(self, entries: List[Tuple[models.Model, Tuple[str, ...]]]):
+        groups: Dict[tuple, List[models.Model]] = defaultdict(list)
+        for instance, fields in entries:
+            groups[(type(instance), instance._state.db or "default", fields)].append(instance)
+
+        now = timezone.now()
+        for (model, using, fields), instances in groups.items():
+            for instance in instances:
+                instance.updated_at = now
+            update_fields = list(fields) + ["updated_at"]
+            with tracer.span("db.write", model=model.__name__, outbox="complete", rows=len(instances)):
+                try:
+                    with transaction.atomic(using=using):
+                        model.objects.db_manager(using).bulk_update(
+                            instances, update_fields, batch_size=self.config["BATCH_SIZE"]
+                        )
+                except IntegrityError:
+                    for instance in instances:
+                        self._write_one(instance, fields, update_fields)
+                else:
+                    # bulk_update sends no post_save, so the cached read responses are dropped here.
+                    invalidate_cached_transactions(model, instances)
+
+    def _write_one(self, instance: models.Model, fields: Tuple[str, ...], update_fields: List[str]):
+        try:
+            with transaction.atomic(using=instance._state.db):
+                instance.save(update_fields=update_fields)
+        except IntegrityError:
+            self._merge(instance, fields)
+
+    def _merge(self, instance: models.Model, fields: Tuple[str, ...]):
+        """
+        Folds an intent row into the row a callback created first under the same unique id.
+        Values the callback already filled in win; the request details come from the intent row.
+        """
+        model = type(instance)
+        lookup = {
+            name: getattr(instance, name) for name in fields if model._meta.get_field(name).unique
+        }
+        using = instance._state.db
+        with transaction.atomic(using=using):
+            existing = model.objects.using(using).select_for_update().get(**lookup)
+            for field in model._meta.concrete_fields:
+                if field.primary_key or field.name in ("created_at", "status"):
+                    continue
+                if getattr(existing, field.attname) in (None, "") or field.name == "originator_conversation_id":
+                    setattr(existing, field.attname, getattr(instance, field.attname))
+            model.objects.using(using).filter(pk=instance.pk).delete()
+            existing.save()
+        event_log.flush()
+        TransactionEvent.objects.filter(
+            transaction_type=transaction_type_id(model), object_id=instance.pk
+        ).update(object_id=existing.pk)
+        logging.info("Merged outbox intent {} {} into {}".format(model.__name__, instance.pk, existing.pk))
+
+
+outbox = TransactionOutbox()
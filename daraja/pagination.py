@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import heapq
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from daraja.sharding import sharding
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over (created_at, id), newest first.
+
+    Each page is a single range scan on the (created_at, id) index: the cursor carries the last
+    row's created_at and id, and the next page is the rows strictly before it. Unlike offset
+    pagination the cost of a page does not grow with its depth. With sharding each shard returns its
+    newest page and the pages are merged, ids being unique across shards.
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 50
+    max_page_size = 500
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            page_size = self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def decode_cursor(self, cursor: str):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(cursor)
+            return created_at, int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, instance) -> str:
+        position = "{}|{}".format(instance.created_at.isoformat(), instance.pk)
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def window(self, queryset, request):
+        """
+        The rows of the requested page and the next one, newest first, and the page size.
+        """
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            created_at, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return queryset.order_by("-created_at", "-id"), page_size
+
+    def fetch(self, queryset, limit: int, key=lambda row: (row.created_at, row.pk)) -> list:
+        if sharding.is_sharded(queryset.model):
+            pages = sharding.fan_out(lambda alias: list(queryset.using(alias)[:limit]))
+            return list(heapq.merge(*pages, key=key, reverse=True))[:limit]
+        return list(queryset[:limit])
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        queryset, page_size = self.window(queryset, request)
+        rows = self.fetch(queryset, page_size + 1)
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def page_etag(self, queryset, request) -> str:
+        """
+        An ETag for the page a request would be served, from the ids and updated_at of its rows only, so a
+        conditional request is answered without loading or serializing the page.
+        """
+        queryset, page_size = self.window(queryset, request)
+        rows = self.fetch(
+            queryset.values_list("created_at", "pk", "updated_at"), page_size + 1, key=lambda row: row[:2]
+        )
+        versions = ",".join(
+            "{}-{}".format(pk, int(updated_at.timestamp() * 1000000)) for _, pk, updated_at in rows[:page_size]
+        )
+        digest = hashlib.md5("{}|{}".format(versions, len(rows) > page_size).encode()).hexdigest()
+        return '"{}"'.format(digest)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+def estimate_count(queryset) -> Optional[int]:
+    """
+    Estimates the number of rows a queryset returns from the PostgreSQL planner statistics: reltuples for an
+    unfiltered table, the planner's row estimate otherwise. Returns None on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+            # -1 until the table has been vacuumed or analyzed.
+            return int(row[0]) if row and row[0] >= 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Admin change list paginator for the large transaction tables.
+
+    The total is taken from the planner estimate when that is above exact_count_threshold, so opening a
+    change list does not scan the whole table to count it. Page numbers past the estimate are allowed and
+    are simply empty.
+
+    Pages are fetched keyset style when the list is ordered newest first, by id or by (created_at, id): the
+    position of the last row of every page served is cached, and the next page is read as the rows strictly
+    before it, a range scan on the primary key or the (created_at, id) index. Pages reached without going
+    through the one before them select their ids with an offset first and then load only those rows.
+    """
+    exact_count_threshold = 10000
+    boundary_timeout = 10 * 60
+    id_orderings = (("-pk",), ("-id",))
+    created_at_orderings = (("-created_at", "-pk"), ("-created_at", "-id"))
+
+    estimated = False
+
+    @cached_property
+    def count(self) -> int:
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate > self.exact_count_threshold:
+            self.estimated = True
+            return estimate
+        return super().count
+
+    def validate_number(self, number) -> int:
+        if not self.estimated:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+        return number
+
+    @cached_property
+    def keyset_fields(self) -> Optional[tuple]:
+        ordering = tuple(self.object_list.query.order_by)
+        if ordering in self.id_orderings:
+            return ("pk",)
+        if ordering in self.created_at_orderings:
+            return ("created_at", "pk")
+        return None
+
+    def after(self, boundary: tuple) -> Q:
+        if self.keyset_fields == ("pk",):
+            return Q(pk__lt=boundary[0])
+        created_at, pk = boundary
+        return Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+
+    def boundary_key(self, number: int) -> str:
+        sql, params = self.object_list.query.sql_with_params()
+        digest = hashlib.sha256("{}\n{}\n{}".format(sql, params, self.per_page).encode()).hexdigest()
+        return "daraja:admin:page:{}:{}".format(digest, number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        if self.keyset_fields is None:
+            return super().page(number)
+
+        boundary = cache.get(self.boundary_key(number - 1)) if number > 1 else None
+        if number == 1:
+            rows = list(self.object_list[:self.per_page])
+        elif boundary is not None:
+            rows = list(self.object_list.filter(self.after(boundary))[:self.per_page])
+        else:
+            ids = list(self.object_list.values_list("pk", flat=True)[bottom:bottom + self.per_page])
+            rows = list(self.object_list.filter(pk__in=ids))
+
+        if rows:
+            last = rows[-1]
+            boundary = tuple(getattr(last, field) for field in self.keyset_fields)
+            cache.set(self.boundary_key(number), boundary, self.boundary_timeout)
+        return self._get_page(rows, number, self)
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from daraja.batching import WriteBehindBuffer
+from daraja.events import redact
+from daraja.models import PayloadIndex
+from daraja.signals import is_replaying
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logging = logging.getLogger("default")
+
+# Block header: magic, codec, compressed length, record count.
+BLOCK_HEADER = struct.Struct(">4sBII")
+BLOCK_MAGIC = b"DPA1"
+CODEC_ZLIB, CODEC_ZSTD = 0, 1
+
+# The ids a payload is indexed by, wherever they appear in it.
+INDEXED_KEYS = (
+    "CheckoutRequestID", "MerchantRequestID", "ConversationID", "OriginatorConversationID", "RequestRefID",
+    "TransID", "TransactionID",
+)
+
+
+def correlation_ids(data: Any, depth: int = 4) -> Set[str]:
+    """
+    Collects the Daraja ids found in a payload, looking into nested objects such as Body.stkCallback
+    and Result.
+    """
+    ids = set()
+    if depth < 0:
+        return ids
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key in INDEXED_KEYS and isinstance(value, (str, int)) and value != "":
+                ids.add(str(value))
+            elif isinstance(value, (dict, list)):
+                ids |= correlation_ids(value, depth - 1)
+    elif isinstance(data, list):
+        for item in data:
+            ids |= correlation_ids(item, depth - 1)
+    return ids
+
+
+def compress_block(data: bytes, codec: int, level: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, level)
+
+
+def decompress_block(data: bytes, codec: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed to read this payload archive block")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PayloadArchive(WriteBehindBuffer):
+    """
+    Append-only archive of the raw Daraja payloads: every outbound request with its response, and every
+    callback body.
+
+    Records are buffered and flushed in batches; each flush compresses the batch as one block (zstd when the
+    zstandard package is installed, zlib otherwise) and appends it to the current segment file. Segments are
+    per process, so workers never share a file, and roll over at SEGMENT_SIZE bytes. PayloadIndex maps every
+    CheckoutRequestID, ConversationID and the like to the block and position of its records, so a lookup
+    reads and decompresses a single block.
+
+    The archive is off by default. Raw payloads carry phone numbers and names, so enabling it needs an
+    explicit DIRECTORY, kept outside the source checkout and away from anything served or deployed.
+    """
+    settings_name = "DARAJA_PAYLOAD_ARCHIVE"
+    thread_name = "daraja-payloads"
+    defaults = {
+        "ENABLED": False,
+        "ASYNC": True,
+        "BATCH_SIZE": 500,
+        "FLUSH_INTERVAL": 1,
+        "DIRECTORY": None,
+        "SEGMENT_SIZE": 256 * 1024 * 1024,
+        "CODEC": "zstd",
+        "LEVEL": 3,
+    }
+
+    def __init__(self):
+        super().__init__()
+        self._segment = None
+        self._segment_lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        config = super().config
+        if config["ENABLED"] and not config["DIRECTORY"]:
+            raise ImproperlyConfigured("DARAJA_PAYLOAD_ARCHIVE needs a DIRECTORY when it is enabled")
+        return config
+
+    @property
+    def codec(self) -> int:
+        return CODEC_ZSTD if self.config["CODEC"] == "zstd" and zstandard is not None else CODEC_ZLIB
+
+    def record(self, kind: int, payload: Any, response: Any = None, url: str = None):
+        """
+        Queues a payload for the archive.
+        Args:
+            kind (int): PayloadIndex.OUTBOUND or PayloadIndex.CALLBACK.
+            payload (Any): The request or callback body. Credentials are masked.
+            response (Any, optional): The response to an outbound request.
+            url (str, optional): The endpoint an outbound request was sent to.
+        """
+        if not self.config["ENABLED"] or is_replaying():
+            return
+        record = {"at": timezone.now().isoformat(), "kind": kind, "payload": redact(payload)}
+        if url is not None:
+            record["url"] = url
+        if response is not None:
+            record["response"] = response
+        self.add(record)
+
+    def reset_segment(self):
+        # Segments are per process: a child forked after a write (e.g. by a preloading master) must start its
+        # own instead of appending to the parent's.
+        self._segment, self._segment_lock = None, threading.Lock()
+
+    def segment_path(self, name: str) -> str:
+        return os.path.join(self.config["DIRECTORY"], name)
+
+    def _current_segment(self) -> Tuple[str, int]:
+        if self._segment is not None:
+            name, size = self._segment
+            if size < self.config["SEGMENT_SIZE"]:
+                return self._segment
+        os.makedirs(self.config["DIRECTORY"], exist_ok=True)
+        name = "segment-{}-{}.dpa".format(time.strftime("%Y%m%d%H%M%S"), os.getpid())
+        self._segment = (name, 0)
+        return self._segment
+
+    def write_block(self, records: List[dict]) -> Tuple[str, int, int]:
+        """
+        Appends records to the current segment as one compressed block.
+        Returns:
+            tuple: The segment name, the block offset and the block length including its header.
+        """
+        body = "".join(json.dumps(record, separators=(",", ":"), default=str) + "\n" for record in records)
+        codec = self.codec
+        compressed = compress_block(body.encode(), codec, self.config["LEVEL"])
+        block = BLOCK_HEADER.pack(BLOCK_MAGIC, codec, len(compressed), len(records)) + compressed
+        with self._segment_lock:
+            name, _ = self._current_segment()
+            with open(self.segment_path(name), "ab") as segment:
+                offset = segment.tell()
+                segment.write(block)
+            self._segment = (name, offset + len(block))
+        return name, offset, len(block)
+
+    def write(self, records: List[dict]):
+        for start in range(0, len(records), self.config["BATCH_SIZE"]):
+            chunk = records[start:start + self.config["BATCH_SIZE"]]
+            name, offset, length = self.write_block(chunk)
+            PayloadIndex.objects.bulk_create([
+                PayloadIndex(
+                    key=key, kind=record["kind"], segment=name, offset=offset, length=length, position=position
+                )
+                for position, record in enumerate(chunk)
+                for key in correlation_ids([record["payload"], record.get("response")])
+            ])
+
+    def read_block(self, segment: str, offset: int, length: int) -> List[bytes]:
+        """
+        Reads and decompresses one block. Records are returned as raw JSON lines so callers only parse
+        the ones they need.
+        """
+        with open(self.segment_path(segment), "rb") as segment_file:
+            segment_file.seek(offset)
+            block = segment_file.read(length)
+        magic, codec, size, _ = BLOCK_HEADER.unpack_from(block)
+        if magic != BLOCK_MAGIC:
+            raise ValueError("No payload archive block at {}:{}".format(segment, offset))
+        return decompress_block(block[BLOCK_HEADER.size:BLOCK_HEADER.size + size], codec).splitlines()
+
+    def read_segment(self, segment: str) -> Iterable[dict]:
+        """
+        Yields every record of a segment file in the order it was written.
+        """
+        with open(self.segment_path(segment), "rb") as segment_file:
+            while True:
+                header = segment_file.read(BLOCK_HEADER.size)
+                if len(header) < BLOCK_HEADER.size:
+                    return
+                magic, codec, size, _ = BLOCK_HEADER.unpack(header)
+                if magic != BLOCK_MAGIC:
+                    raise ValueError("Corrupt payload archive segment {}".format(segment))
+                body = decompress_block(segment_file.read(size), codec)
+                for line in body.decode().splitlines():
+                    yield json.loads(line)
+
+    def lookup(self, key: str, kind: Optional[int] = None) -> List[dict]:
+        """
+        Returns the archived payloads that carry a Daraja id, oldest first.
+        Args:
+            key (str): A CheckoutRequestID, ConversationID, OriginatorConversationID or similar id.
+            kind (int, optional): Only return outbound calls or only callbacks.
+        """
+        self.flush()
+        entries = PayloadIndex.objects.filter(key=key)
+        if kind is not None:
+            entries = entries.filter(kind=kind)
+        blocks: Dict[Tuple[str, int, int], List[int]] = {}
+        for segment, offset, length, position in entries.order_by("id").values_list(
+                "segment", "offset", "length", "position"):
+            blocks.setdefault((segment, offset, length), []).append(position)
+
+        records = []
+        for (segment, offset, length), positions in blocks.items():
+            lines = self.read_block(segment, offset, length)
+            records.extend(json.loads(lines[position]) for position in positions)
+        return records
+
+
+payload_archive = PayloadArchive()
+
+os.register_at_fork(after_in_child=payload_archive.reset_segment)
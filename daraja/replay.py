@@ -0,0 +1,255 @@
+import gzip
+import json
+import logging
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import close_old_connections, transaction
+from django.forms.models import model_to_dict
+
+from daraja.events import event_log
+from daraja.gateway.b2b import B2B
+from daraja.gateway.b2c import B2C
+from daraja.gateway.c2b import C2B
+from daraja.ledger import ledger
+from daraja.models import B2BTransaction, B2CTopup, B2CTransaction, PayloadIndex, TransactionEvent
+from daraja.outbox import outbox
+from daraja.payloads import payload_archive
+from daraja.serializers import READ_SERIALIZERS
+from daraja.signals import replaying
+
+logging = logging.getLogger("default")
+
+# A replayed callback: its position in the source, its transaction type (None when it has to be detected),
+# its body (zlib compressed for callbacks read from the event log) and the key it is sharded by (None to use
+# its correlation key).
+Callback = Tuple[Any, Optional[str], Any, Optional[str]]
+
+
+CALLBACK_HANDLERS = {
+    "stk": lambda: C2B().stk_callback_handler,
+    "b2c": lambda: B2C().b2c_callback_handler,
+    "b2b": lambda: B2B().b2b_callback_handler,
+    "topup": lambda: B2C().b2c_topup_callback_handler,
+    "express": lambda: B2B().b2b_express_callback_handler,
+}
+
+# How each handler finds the row a callback applies to, used for dry-run diffs.
+TRANSACTION_LOOKUPS = {
+    "stk": lambda: C2B().stk_get_transaction_object,
+    "b2c": lambda: B2C().b2c_get_transaction_object,
+    "b2b": lambda: B2B().b2b_get_transaction_object,
+    "topup": lambda: B2C().b2c_get_transaction_topup_object,
+    "express": lambda: B2B().b2b_express_get_transaction_object,
+}
+
+
+def correlation_key(data: dict) -> str:
+    """
+    The id that ties a callback to its transaction. Callbacks with the same key are replayed in order by
+    the same worker.
+    """
+    if "Body" in data:
+        return str(data["Body"].get("stkCallback", {}).get("CheckoutRequestID"))
+    result = data.get("Result", {})
+    return str(
+        result.get("OriginatorConversationID") or result.get("ConversationID") or result.get("requestId")
+        or result.get("conversationID")
+    )
+
+
+def detect_kind(data: dict) -> Optional[str]:
+    """
+    Works out which transaction type a callback body belongs to. B2C, B2B and top up results share one
+    shape, so the ones without B2C result parameters are looked up by their ids.
+    """
+    if "stkCallback" in data.get("Body", {}):
+        return "stk"
+    result = data.get("Result")
+    if not isinstance(result, dict):
+        return None
+    if "requestId" in result:
+        return "express"
+    parameters = result.get("ResultParameters", {}).get("ResultParameter", [])
+    if any(str(parameter.get("Key", "")).startswith("B2C") for parameter in parameters):
+        return "b2c"
+    originator_conversation_id, conversation_id = result.get("OriginatorConversationID"), result.get("ConversationID")
+    for kind, model in (("b2c", B2CTransaction), ("b2b", B2BTransaction)):
+        if originator_conversation_id and model.objects.filter(
+                originator_conversation_id=originator_conversation_id).exists():
+            return kind
+        if conversation_id and model.objects.filter(conversation_id=conversation_id).exists():
+            return kind
+    if conversation_id and B2CTopup.objects.filter(conversation_id=conversation_id).exists():
+        return "topup"
+    return None
+
+
+def unwrap(data: Any) -> Tuple[Optional[str], Any]:
+    """
+    Accepts a callback body, or a record with the body under "payload" (as written by the payload archive)
+    and optionally its transaction type under "type".
+    """
+    if isinstance(data, dict) and "payload" in data and "Body" not in data and "Result" not in data:
+        return data.get("type"), data["payload"]
+    return None, data
+
+
+def read_events(types: List[str], since=None, after: Optional[int] = None) -> Iterator[Callback]:
+    """
+    Callbacks recorded in the TransactionEvent log, oldest first. Bodies stay compressed; workers decompress
+    them.
+    """
+    type_names = {value: name for value, name in TransactionEvent.TRANSACTION_TYPE}
+    events = TransactionEvent.objects.filter(
+        kind=TransactionEvent.CALLBACK_RECEIVED, transaction_type__in=[
+            value for value, name in TransactionEvent.TRANSACTION_TYPE if name in types
+        ]
+    )
+    if since:
+        events = events.filter(created_at__gte=since)
+    if after is not None:
+        events = events.filter(id__gt=after)
+    rows = events.order_by("id").values_list("id", "transaction_type", "object_id", "payload")
+    for event_id, type_id, object_id, payload in rows.iterator(chunk_size=5000):
+        yield event_id, type_names[type_id], bytes(payload), "{}:{}".format(type_id, object_id)
+
+
+def read_archive(segments: List[str], after: Optional[list] = None) -> Iterator[Callback]:
+    """
+    Callbacks from payload archive segments, in segment and write order.
+    """
+    for segment_index, segment in enumerate(segments):
+        if after and segment_index < after[0]:
+            continue
+        for record_index, record in enumerate(payload_archive.read_segment(segment)):
+            position = [segment_index, record_index]
+            if record["kind"] != PayloadIndex.CALLBACK or (after and position <= after):
+                continue
+            kind, payload = unwrap(record)
+            yield position, kind, payload, None
+
+
+def read_files(paths: List[str], after: Optional[list] = None) -> Iterator[Callback]:
+    """
+    Callbacks from JSON lines files, optionally gzipped, one callback body or archive record per line.
+    """
+    for file_index, path in enumerate(paths):
+        if after and file_index < after[0]:
+            continue
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as lines:
+            for line_no, line in enumerate(lines):
+                position = [file_index, line_no]
+                if not line.strip() or (after and position <= after):
+                    continue
+                kind, payload = unwrap(json.loads(line))
+                yield position, kind, payload, None
+
+
+def shard(callbacks: Iterable[Callback], shards: int) -> List[List[Callback]]:
+    """
+    Splits callbacks by correlation key, keeping the source order within each shard.
+    """
+    sharded = [[] for _ in range(shards)]
+    for callback in callbacks:
+        _, _, payload, key = callback
+        sharded[zlib.crc32((key or correlation_key(payload)).encode()) % shards].append(callback)
+    return sharded
+
+
+_handlers: Dict[str, Any] = {}
+_lookups: Dict[str, Any] = {}
+
+
+def handler_for(kind: str):
+    if kind not in _handlers:
+        _handlers[kind] = CALLBACK_HANDLERS[kind]()
+    return _handlers[kind]
+
+
+def snapshot(instance) -> dict:
+    return {key: str(value) if value is not None else None for key, value in model_to_dict(instance).items()}
+
+
+def apply_one(kind: str, data: dict, diffs: Optional[list]) -> bool:
+    """
+    Applies one callback. With diffs, the fields it changed are appended to it.
+    Returns:
+        bool: Whether the row changed.
+    """
+    if diffs is None:
+        handler_for(kind)(data)
+        return True
+    if kind not in _lookups:
+        _lookups[kind] = TRANSACTION_LOOKUPS[kind]()
+    found = _lookups[kind](data)
+    model = READ_SERIALIZERS[kind].Meta.model
+    before = snapshot(model.objects.get(pk=found.pk))
+    after = snapshot(handler_for(kind)(data))
+    changes = {key: [before.get(key), value] for key, value in after.items() if before.get(key) != value}
+    if changes:
+        diffs.append({"type": kind, "id": found.pk, "changes": changes})
+    return bool(changes)
+
+
+def apply_batch(
+        callbacks: List[Callback], dry_run: bool = False, batch_size: int = 1000, types: Optional[List[str]] = None
+) -> dict:
+    """
+    Re-applies callbacks with the current handlers, batch_size callbacks per transaction. A batch that fails
+    is retried one callback per transaction so a single bad callback only skips itself. In a dry run every
+    batch is rolled back and the changes it would have made are returned instead. Callbacks whose type
+    cannot be detected, or is not in types, are skipped.
+    """
+    close_old_connections()
+    stats = {"applied": 0, "changed": 0, "skipped": 0, "failed": 0, "diffs": [] if dry_run else None}
+    prepared = []
+    for position, kind, payload, _ in callbacks:
+        data = json.loads(zlib.decompress(payload)) if isinstance(payload, bytes) else payload
+        kind = kind or detect_kind(data)
+        if kind is None or (types and kind not in types):
+            stats["skipped"] += 1
+            continue
+        prepared.append((position, kind, data))
+
+    def run(batch, diffs):
+        changed = 0
+        with transaction.atomic():
+            for _, kind, data in batch:
+                changed += apply_one(kind, data, diffs)
+            if dry_run:
+                transaction.set_rollback(True)
+        return changed
+
+    try:
+        with replaying(dry_run=dry_run):
+            for start in range(0, len(prepared), batch_size):
+                batch = prepared[start:start + batch_size]
+                try:
+                    diffs = [] if dry_run else None
+                    stats["changed"] += run(batch, diffs)
+                    stats["applied"] += len(batch)
+                    if dry_run:
+                        stats["diffs"].extend(diffs)
+                except Exception:
+                    for callback in batch:
+                        try:
+                            diffs = [] if dry_run else None
+                            stats["changed"] += run([callback], diffs)
+                            stats["applied"] += 1
+                            if dry_run:
+                                stats["diffs"].extend(diffs)
+                        except Exception as e:
+                            stats["failed"] += 1
+                            logging.error("Replay of callback at {} failed {}".format(callback[0], e))
+    finally:
+        # Forked workers exit without running atexit handlers, so nothing may be left queued.
+        for buffer in (outbox, event_log, ledger):
+            try:
+                buffer.flush()
+            except Exception as e:
+                logging.error("Replay could not flush {} {}".format(type(buffer).__name__, e))
+        close_old_connections()
+    return stats
+
@@ -0,0 +1,138 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Set
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from daraja.events import TRANSACTION_TYPE_IDS
+from daraja.gateway.c2b import NAIROBI
+from daraja.models import AggregateWatermark, ArchivedTransaction, DailyTransactionAggregate, TransactionEvent
+from daraja.serializers import READ_SERIALIZERS
+from daraja.sharding import sharding
+
+WATERMARK_NAME = "daily_aggregates"
+# Events are inserted write-behind, so each run looks this far behind the previous watermark as well.
+WATERMARK_OVERLAP = timedelta(minutes=1)
+
+AMOUNT_FIELDS = {"stk": "amount", "b2c": "transaction_amount", "b2b": "amount", "topup": "amount", "express": "amount"}
+CHARGES_FIELDS = {"b2b": "debit_party_charges", "topup": "debit_party_charges"}
+
+
+def day_range(day: date):
+    """
+    Returns the start and end of a day in Nairobi time, the day Safaricom and the merchants report in.
+    """
+    start = datetime.combine(day, time.min, tzinfo=NAIROBI)
+    return start, start + timedelta(days=1)
+
+
+def days_of(queryset) -> Set[date]:
+    """
+    Returns the Nairobi days the rows of queryset were created on.
+    """
+    return {value.date() for value in queryset.datetimes("created_at", "day", tzinfo=NAIROBI)}
+
+
+def aggregate_day(kind: str, day: date) -> int:
+    """
+    Recomputes the DailyTransactionAggregate rows of one transaction type and day.
+    The day is read through the (created_at, id) index on every shard, together with any rows archived
+    from it, so the cost depends on the day's volume and not on the size of the table.
+    Returns:
+        int: The number of aggregate rows written.
+    """
+    model = READ_SERIALIZERS[kind].Meta.model
+    amount_field, charges_field = AMOUNT_FIELDS[kind], CHARGES_FIELDS.get(kind)
+    start, end = day_range(day)
+
+    totals = defaultdict(lambda: {"count": 0, "amount": 0, "charges": Decimal(0)})
+    annotations = {"row_count": Count("id"), "total_amount": Sum(amount_field)}
+    if charges_field:
+        annotations["total_charges"] = Sum(charges_field)
+    shard_rows = sharding.fan_out(lambda alias: list(
+        model.objects.using(alias).filter(created_at__gte=start, created_at__lt=end).values("status").annotate(
+            **annotations
+        )
+    ))
+    for row in (row for rows in shard_rows for row in rows):
+        bucket = totals[str(row["status"])]
+        bucket["count"] += row["row_count"]
+        bucket["amount"] += row["total_amount"] or 0
+        bucket["charges"] += row.get("total_charges") or 0
+
+    archived = ArchivedTransaction.objects.filter(
+        transaction_type=TRANSACTION_TYPE_IDS[kind], created_at__gte=start, created_at__lt=end
+    ).only("status", "payload")
+    for row in archived.iterator():
+        data = row.data
+        bucket = totals[str(row.status)]
+        bucket["count"] += 1
+        bucket["amount"] += data.get(amount_field) or 0
+        bucket["charges"] += Decimal(str(data.get(charges_field) or 0)) if charges_field else 0
+
+    with transaction.atomic():
+        DailyTransactionAggregate.objects.filter(date=day, transaction_type=TRANSACTION_TYPE_IDS[kind]).delete()
+        DailyTransactionAggregate.objects.bulk_create([
+            DailyTransactionAggregate(date=day, transaction_type=TRANSACTION_TYPE_IDS[kind], status=status, **values)
+            for status, values in totals.items()
+        ])
+    return len(totals)
+
+
+def touched_days(since: datetime) -> Dict[str, Set[date]]:
+    """
+    Returns the creation days of the transactions that have events recorded after since, by type.
+    """
+    days = defaultdict(set)
+    events = TransactionEvent.objects.filter(created_at__gt=since).values_list("transaction_type", "object_id")
+    object_ids = defaultdict(set)
+    for type_id, object_id in events.iterator():
+        object_ids[type_id].add(object_id)
+
+    kinds = {value: kind for kind, value in TRANSACTION_TYPE_IDS.items()}
+    for type_id, ids in object_ids.items():
+        model = READ_SERIALIZERS[kinds[type_id]].Meta.model
+        ids = list(ids)
+        for start in range(0, len(ids), 1000):
+            for alias in sharding.aliases():
+                chunk = model.objects.using(alias).filter(pk__in=ids[start:start + 1000])
+                days[kinds[type_id]].update(days_of(chunk))
+    return days
+
+
+def all_days() -> Dict[str, Set[date]]:
+    days = {}
+    for kind, serializer_class in READ_SERIALIZERS.items():
+        model = serializer_class.Meta.model
+        days[kind] = {day for alias in sharding.aliases() for day in days_of(model.objects.using(alias))}
+        days[kind].update(days_of(ArchivedTransaction.objects.filter(transaction_type=TRANSACTION_TYPE_IDS[kind])))
+    return days
+
+
+def refresh_daily_aggregates(full: bool = False) -> int:
+    """
+    Brings DailyTransactionAggregate up to date.
+    Only the days of transactions with events since the last run are recomputed, unless full is set.
+    Args:
+        full (bool): Recompute every day that has transactions.
+    Returns:
+        int: The number of days recomputed.
+    """
+    now = timezone.now()
+    watermark = AggregateWatermark.objects.filter(name=WATERMARK_NAME).first()
+    if full or watermark is None:
+        days = all_days()
+    else:
+        days = touched_days(watermark.processed_until - WATERMARK_OVERLAP)
+
+    refreshed = 0
+    for kind, kind_days in days.items():
+        for day in sorted(kind_days):
+            aggregate_day(kind, day)
+            refreshed += 1
+    AggregateWatermark.objects.update_or_create(name=WATERMARK_NAME, defaults={"processed_until": now})
+    return refreshed
+
@@ -0,0 +1,129 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logging = logging.getLogger("default")
+
+DEFAULT_REPLICAS = {
+    "ALIASES": [],
+    "MAX_LAG_SECONDS": 5,
+    "LAG_CHECK_INTERVAL": 5,
+}
+
+_use_replica = ContextVar("daraja_use_replica", default=False)
+
+# Seconds of replay lag on a PostgreSQL standby. A standby that has replayed everything it received is
+# not lagging, however old its last replayed transaction is.
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def get_replica_config() -> dict:
+    return {**DEFAULT_REPLICAS, **getattr(settings, "DARAJA_REPLICAS", {})}
+
+
+class ReplicaSelector:
+    """
+    Picks a read replica whose replication lag is within MAX_LAG_SECONDS.
+    Lag is measured at most once per LAG_CHECK_INTERVAL per replica; when every replica is lagging or
+    unreachable reads fall back to the primary.
+    """
+    def __init__(self):
+        self._checked: Dict[str, Tuple[float, bool]] = {}
+        self._lock = threading.Lock()
+
+    def lag(self, alias: str) -> Optional[float]:
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRES_LAG_SQL)
+            row = cursor.fetchone()
+        return float(row[0]) if row and row[0] is not None else 0
+
+    def is_healthy(self, alias: str, config: dict) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            checked = self._checked.get(alias)
+            if checked and now - checked[0] < config["LAG_CHECK_INTERVAL"]:
+                return checked[1]
+        try:
+            lag = self.lag(alias)
+            healthy = lag <= config["MAX_LAG_SECONDS"]
+            if not healthy:
+                logging.warning("Replica {} is {}s behind, reading from the primary".format(alias, lag))
+        except DatabaseError as e:
+            logging.error("Replica {} lag check failed {}".format(alias, e))
+            healthy = False
+        with self._lock:
+            self._checked[alias] = (now, healthy)
+        return healthy
+
+    def select(self) -> str:
+        config = get_replica_config()
+        aliases: List[str] = list(config["ALIASES"])
+        random.shuffle(aliases)
+        for alias in aliases:
+            if self.is_healthy(alias, config):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+
+replica_selector = ReplicaSelector()
+
+
+def read_replica_alias() -> str:
+    """
+    Returns the database alias reporting reads should use: a healthy replica, or the primary.
+    """
+    return replica_selector.select()
+
+
+@contextmanager
+def use_replica():
+    """
+    Routes the reads made inside the block to a replica, e.g. for reports and reconciliation.
+    Querysets are lazy, so they have to be evaluated before the block exits.
+    """
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a replica only when asked to, through use_replica() or an explicit .using().
+    Everything else, including the reads in the callback path, stays on the primary. Writes never
+    go to a replica and migrations never run against one.
+    """
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return read_replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Rows read from a replica, e.g. in the admin, are saved back to the primary.
+        instance = hints.get("instance")
+        using = instance._state.db if instance is not None else None
+        if using is None or using in get_replica_config()["ALIASES"]:
+            return DEFAULT_DB_ALIAS
+        return using
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replica_config()["ALIASES"]:
+            return False
+        return None
@@ -1,7 +1,10 @@
-from phonenumber_field.serializerfields import PhoneNumberField
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
-from daraja.models import STKTransaction, B2CTransaction, B2BTransaction
+from daraja.models import (
+    STKTransaction, B2CTransaction, B2BTransaction, B2CTopup, B2BExpressTransaction, DailyTransactionAggregate,
+    Campaign, LedgerAccount
+)
+from daraja.msisdn import MSISDNField
 
 class STKTransactionSerializer(serializers.ModelSerializer):
 
@@ -10,43 +13,41 @@ class STKTransactionSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 class STKCheckoutSerializer(serializers.Serializer):
-    phone_number = PhoneNumberField()
+    phone_number = MSISDNField()
     amount = serializers.IntegerField(min_value=1)
     reference = serializers.CharField(default="")
     description = serializers.CharField(default="")
 
     def validate(self, attrs):
-        phone_number = attrs.pop("phone_number")
-        attrs["phone_number"] = str(phone_number)[1:]
+        phone_number = attrs["phone_number"]
         reference = attrs.get("reference", )
         description = attrs.get("description")
         amount = attrs.get("amount")
         if reference == "":
-            attrs["reference"] = "{}-{}".format(phone_number, amount)
+            attrs["reference"] = "+{}-{}".format(phone_number, amount)
         if description == "":
-            attrs["description"] = "{}-{}".format(phone_number, amount)
+            attrs["description"] = "+{}-{}".format(phone_number, amount)
         return attrs
 
 
 class B2CCheckoutSerializer(serializers.Serializer):
-    phone_number = PhoneNumberField()
+    phone_number = MSISDNField()
     amount = serializers.IntegerField(min_value=1)
     remarks = serializers.CharField(default="")
     occasion = serializers.CharField(default="")
 
     def validate(self, attrs):
-        phone_number = attrs.pop("phone_number")
-        attrs["phone_number"] = str(phone_number)[1:]
+        phone_number = attrs["phone_number"]
         remarks = attrs.get("remarks", )
         occasion = attrs.get("occasion")
         amount = attrs.get("amount")
         if remarks == "":
-            attrs["remarks"] = "{}-{}".format(phone_number, amount)
+            attrs["remarks"] = "+{}-{}".format(phone_number, amount)
         if occasion == "":
-            attrs["occasion"] = "{}-{}".format(phone_number, amount)
+            attrs["occasion"] = "+{}-{}".format(phone_number, amount)
         return attrs
 
-class B2BTransactionSerializer(serializers.Serializer):
+class B2BTransactionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = B2BTransaction
@@ -59,7 +60,7 @@ class B2BCheckoutSerializer(serializers.Serializer):
     account_reference = serializers.CharField(required=False)
     till_number = serializers.IntegerField(required=False)
     remarks = serializers.CharField(required=False)
-    phone_number = PhoneNumberField(required=False)
+    phone_number = MSISDNField(required=False)
 
     def validate(self, attrs):
         phone_number = attrs.pop("phone_number", None)
@@ -77,14 +78,11 @@ class B2BCheckoutSerializer(serializers.Serializer):
                 raise ValidationError("paybill_number and account_reference must be provided for paybill")
             attrs['party_b'] = paybill_number
         if phone_number:
-            attrs["phone_number"] = str(phone_number)[1:]
+            attrs["phone_number"] = phone_number
         remarks = attrs.pop("remarks", None )
         amount = attrs.get("amount")
         if not remarks:
             attrs["remarks"] = "{}-{}".format(till_number if till_number else paybill_number, amount)
-
-        from pprint import pprint
-        pprint(attrs)
         return attrs
 
 
@@ -105,7 +103,7 @@ class DynamicQRInputSerializer(serializers.Serializer):
         choices=["BuyGoods", "PayBill", "SendMoney", "Withdraw", "SentToBusiness"]
     )
     party_identifier = serializers.CharField(required=False)
-    phone_number = PhoneNumberField(required=False)
+    phone_number = MSISDNField(required=False)
 
     def validate(self, attrs):
         transaction_type = attrs.pop('transaction_type',)
@@ -117,7 +115,7 @@ class DynamicQRInputSerializer(serializers.Serializer):
             if not phone_number:
                 raise ValidationError("phone_number must be provided for SendMoney and SendToBusiness")
             else:
-                attrs["party_identifier"] = str(phone_number)[1:]
+                attrs["party_identifier"] = phone_number
         else:
             if not party_identifier:
                 raise ValidationError("Agent Till, Paybill or Merchant BuyGoods must be provided as a party_identifier")
@@ -129,15 +127,9 @@ class B2CTopupInputSerializer(serializers.Serializer):
     amount = serializers.IntegerField()
     paybill_number = serializers.IntegerField()
     remarks = serializers.CharField()
-    requester_phone_number = PhoneNumberField(required=False)
+    requester_phone_number = MSISDNField(required=False)
     account_reference = serializers.CharField(required=False)
 
-    def validate(self, attrs):
-        phone_number = attrs.pop("phone_number", None)
-        if phone_number:
-            attrs["phone_number"] = str(phone_number)[1:]
-        return attrs
-
 class B2BExpressCheckoutSerializer(serializers.Serializer):
     amount = serializers.IntegerField()
     receiver_short_code = serializers.IntegerField()
@@ -147,3 +139,106 @@ class B2BExpressCheckoutSerializer(serializers.Serializer):
         reference = attrs.pop("reference")
         attrs["reference"] = reference.replace(" ", "")
         return attrs
+
+
+class STKTransactionReadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = STKTransaction
+        fields = (
+            "id", "created_at", "updated_at", "checkout_request_id", "phone_number", "amount", "status", "receipt_no",
+            "transaction_date", "reference", "description"
+        )
+
+
+class B2CTransactionReadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = B2CTransaction
+        fields = (
+            "id", "created_at", "updated_at", "conversation_id", "originator_conversation_id", "transaction_id",
+            "transaction_amount", "recipient_phonenumber", "recipient_public_name", "status", "transaction_time",
+            "occasion", "remarks"
+        )
+
+
+class B2BTransactionReadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = B2BTransaction
+        fields = (
+            "id", "created_at", "updated_at", "conversation_id", "originator_conversation_id", "transaction_id",
+            "amount", "recipient_number", "recipient_type", "account_reference", "recipient_public_name", "status",
+            "transaction_time", "currency", "debit_party_charges", "failure_description", "remarks"
+        )
+
+
+class B2CTopupReadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = B2CTopup
+        fields = (
+            "id", "created_at", "updated_at", "conversation_id", "transaction_id", "amount", "paybill_number",
+            "account_reference", "receiver_public_name", "status", "transaction_time", "currency",
+            "debit_party_charges", "remarks"
+        )
+
+
+class B2BExpressTransactionReadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = B2BExpressTransaction
+        fields = (
+            "id", "created_at", "updated_at", "request_ref_id", "conversation_id", "transaction_id", "amount",
+            "receiver_short_code", "reference", "status", "result_description"
+        )
+
+
+# Read serializers by the transaction type name used in urls and notifications.
+READ_SERIALIZERS = {
+    "stk": STKTransactionReadSerializer,
+    "b2c": B2CTransactionReadSerializer,
+    "b2b": B2BTransactionReadSerializer,
+    "topup": B2CTopupReadSerializer,
+    "express": B2BExpressTransactionReadSerializer,
+}
+
+
+def transaction_kind(model) -> str:
+    """
+    Returns the transaction type name ("stk", "b2c", ...) of a transaction model.
+    """
+    return next(kind for kind, serializer_class in READ_SERIALIZERS.items() if serializer_class.Meta.model is model)
+
+
+class DailyTransactionAggregateSerializer(serializers.ModelSerializer):
+    transaction_type = serializers.CharField(source="get_transaction_type_display")
+
+    class Meta:
+        model = DailyTransactionAggregate
+        fields = ("date", "transaction_type", "status", "count", "amount", "charges")
+
+
+class KnownBalanceSerializer(serializers.Serializer):
+    account = serializers.CharField()
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2)
+    observed_at = serializers.DateTimeField()
+
+
+class LedgerAccountSerializer(serializers.ModelSerializer):
+    kind = serializers.CharField(source="get_kind_display")
+
+    class Meta:
+        model = LedgerAccount
+        fields = ("code", "name", "kind", "balance")
+
+
+class CampaignSerializer(serializers.ModelSerializer):
+    status = serializers.CharField(source="get_status_display")
+
+    class Meta:
+        model = Campaign
+        fields = (
+            "id", "created_at", "updated_at", "name", "status", "rate_per_second", "max_concurrency", "total_count",
+            "sent_count", "failed_count", "unknown_count"
+        )
@@ -0,0 +1,224 @@
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, close_old_connections
+from django.db.models import Q
+
+from daraja.models import B2BExpressTransaction, B2BTransaction, B2CTopup, B2CTransaction, STKTransaction
+
+logging = logging.getLogger("default")
+
+DEFAULT_SHARDING = {
+    "ENABLED": False,
+    # Database alias -> {"KEYS": the shortcodes (or tenant ids) stored on it, "ID_OFFSET": where its ids start}.
+    "SHARDS": {},
+    # Where keys missing from SHARDS go.
+    "DEFAULT_SHARD": DEFAULT_DB_ALIAS,
+    # Seconds a located transaction id is remembered.
+    "LOCATE_TTL": 7 * 24 * 3600,
+}
+
+# The ids a transaction can be found by, i.e. the ones its callbacks and clients carry.
+LOCATOR_FIELDS = {
+    STKTransaction: ("checkout_request_id",),
+    B2CTransaction: ("originator_conversation_id", "conversation_id"),
+    B2BTransaction: ("originator_conversation_id", "conversation_id"),
+    B2CTopup: ("conversation_id",),
+    B2BExpressTransaction: ("request_ref_id",),
+}
+SHARDED_MODELS = tuple(LOCATOR_FIELDS)
+
+# The locator field values a callback body carries, by transaction model.
+CALLBACK_IDS = {
+    STKTransaction: lambda data: {"checkout_request_id": data["Body"]["stkCallback"].get("CheckoutRequestID")},
+    B2CTransaction: lambda data: {
+        "originator_conversation_id": data["Result"].get("OriginatorConversationID"),
+        "conversation_id": data["Result"].get("ConversationID"),
+    },
+    B2BTransaction: lambda data: {
+        "originator_conversation_id": data["Result"].get("OriginatorConversationID"),
+        "conversation_id": data["Result"].get("ConversationID"),
+    },
+    B2CTopup: lambda data: {"conversation_id": data["Result"].get("ConversationID")},
+    B2BExpressTransaction: lambda data: {"request_ref_id": data["Result"].get("requestId")},
+}
+
+_current_shard = ContextVar("daraja_current_shard", default=None)
+
+
+class Sharding:
+    """
+    Spreads the transaction tables over several databases by shortcode (or tenant).
+
+    Each gateway writes the transactions of its shortcode to that shortcode's shard. Callbacks only carry
+    Daraja's ids, so the shard of a transaction is remembered in the cache under each of its ids when it is
+    recorded, and found by asking every shard when the cache has forgotten it. Shards hand out disjoint id
+    ranges (see the prepare_shards command), so the event log, ledger and archive can keep pointing at
+    transactions by type and id alone. Everything but the transaction tables stays on the default database.
+    """
+    @property
+    def config(self) -> dict:
+        return {**DEFAULT_SHARDING, **getattr(settings, "DARAJA_SHARDING", {})}
+
+    @property
+    def enabled(self) -> bool:
+        return self.config["ENABLED"]
+
+    def aliases(self) -> List[str]:
+        """
+        Every database holding transactions, the default shard first.
+        """
+        config = self.config
+        if not config["ENABLED"]:
+            return [DEFAULT_DB_ALIAS]
+        return list(dict.fromkeys([config["DEFAULT_SHARD"], *config["SHARDS"]]))
+
+    def shard_for(self, key) -> str:
+        """
+        The shard storing the transactions of a shortcode or tenant.
+        """
+        config = self.config
+        if not config["ENABLED"]:
+            return DEFAULT_DB_ALIAS
+        key = str(key)
+        for alias, shard in config["SHARDS"].items():
+            if key in (str(shard_key) for shard_key in shard.get("KEYS", ())):
+                return alias
+        return config["DEFAULT_SHARD"]
+
+    def cache_key(self, model, field: str, value) -> str:
+        return "daraja:shard:{}:{}:{}".format(model._meta.model_name, field, value)
+
+    def remember(self, instance):
+        """
+        Records which shard a transaction is on under each of its locator ids.
+        """
+        if not self.enabled or instance._state.db is None:
+            return
+        model = type(instance)
+        keys = {
+            self.cache_key(model, field, getattr(instance, field)): instance._state.db
+            for field in LOCATOR_FIELDS.get(model, ()) if getattr(instance, field) not in (None, "")
+        }
+        if keys:
+            cache.set_many(keys, self.config["LOCATE_TTL"])
+
+    def locate(self, model, ids: Dict[str, str]) -> Optional[str]:
+        """
+        Finds the shard holding the transaction with any of the given locator ids.
+        Returns:
+            Optional[str]: The shard's alias, or None when no shard has it (or sharding is off).
+        """
+        ids = {field: str(value) for field, value in ids.items() if value not in (None, "")}
+        if not self.enabled or not ids:
+            return None
+        cached = cache.get_many([self.cache_key(model, field, value) for field, value in ids.items()])
+        if cached:
+            return next(iter(cached.values()))
+
+        lookup = Q()
+        for field, value in ids.items():
+            lookup |= Q(**{field: value})
+        for alias in self.aliases():
+            if model.objects.using(alias).filter(lookup).exists():
+                cache.set_many({
+                    self.cache_key(model, field, value): alias for field, value in ids.items()
+                }, self.config["LOCATE_TTL"])
+                return alias
+        return None
+
+    def is_sharded(self, model) -> bool:
+        return model in SHARDED_MODELS and len(self.aliases()) > 1
+
+    def fan_out(self, fn: Callable[[str], object]) -> list:
+        """
+        Calls fn with each shard's alias, in parallel, and returns the results in aliases() order.
+        """
+        aliases = self.aliases()
+        if len(aliases) == 1:
+            return [fn(aliases[0])]
+
+        def run(alias):
+            try:
+                return fn(alias)
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=len(aliases), thread_name_prefix="daraja-shard") as executor:
+            return list(executor.map(run, aliases))
+
+
+sharding = Sharding()
+
+
+def current_shard() -> Optional[str]:
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(alias: Optional[str]):
+    """
+    Routes the transaction model queries made inside the block to a shard.
+    """
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def route_callback(model):
+    """
+    Decorates a gateway callback handler so that its queries run on the shard holding the transaction the
+    callback is for, or on the gateway's own shard when no shard has it yet.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(gateway, data, *args, **kwargs):
+            if not sharding.enabled:
+                return handler(gateway, data, *args, **kwargs)
+            try:
+                ids = CALLBACK_IDS[model](data)
+            except (KeyError, TypeError, AttributeError):
+                ids = {}
+            with use_shard(sharding.locate(model, ids) or gateway.shard):
+                return handler(gateway, data, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ShardRouter:
+    """
+    Routes the transaction models to the shard selected with use_shard(), or to the shard a row was loaded
+    from. Queries made without either fall through to the next router and so to the default database.
+    Only the transaction tables are migrated on shards other than the default one.
+    """
+    def _db(self, model, **hints):
+        if model not in SHARDED_MODELS or not sharding.enabled:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db in sharding.aliases():
+            return instance._state.db
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if not sharding.enabled or db == DEFAULT_DB_ALIAS or db not in sharding.aliases():
+            return None
+        if app_label != "daraja" or model_name is None:
+            return False
+        return model_name in {model._meta.model_name for model in SHARDED_MODELS}
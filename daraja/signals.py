@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.dispatch import Signal
+
+# Sent by the gateway callback handlers once a transaction has been saved with the callback result.
+# Arguments: instance (the transaction), previous_status (its status before the callback).
+transaction_updated = Signal()
+
+_replaying = ContextVar("daraja_replaying", default=False)
+_dry_run = ContextVar("daraja_dry_run", default=False)
+
+
+@contextmanager
+def replaying(dry_run: bool = False):
+    """
+    Marks callbacks handled inside the block as a replay of history, e.g. when rebuilding rows from the
+    event log. Receivers with external side effects (webhooks, the event log itself) skip replays. With
+    dry_run the replay is rolled back afterwards, so receivers that write elsewhere skip it as well.
+    """
+    token, dry_run_token = _replaying.set(True), _dry_run.set(dry_run)
+    try:
+        yield
+    finally:
+        _dry_run.reset(dry_run_token)
+        _replaying.reset(token)
+
+
+def is_replaying() -> bool:
+    return _replaying.get()
+
+
+def is_dry_run() -> bool:
+    return _dry_run.get()
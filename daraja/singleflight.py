@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from django.conf import settings
+from django.core.cache import cache
+
+logging = logging.getLogger("default")
+
+DEFAULT_SINGLE_FLIGHT = {
+    "SHARED_TTL": 5,
+    "LOCK_TIMEOUT": 30,
+    "POLL_INTERVAL": 0.05,
+}
+
+
+def request_key(method: str, url: str, payload: Any) -> str:
+    """
+    Identifies an outbound call by its endpoint and a hash of its body.
+    """
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256("{} {}\n{}".format(method, url, body).encode()).hexdigest()
+
+
+class Flight:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight, other callers with the same
+    key wait for it and get its result (or its exception) instead of making their own.
+
+    Within a process this is always done. With shared=True the leader also coordinates with other worker
+    processes through the cache: the first one makes the call and keeps its result for SHARED_TTL seconds,
+    the others wait for that result. Only use it for calls whose result can be shared, never for calls that
+    move money.
+    """
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        return {**DEFAULT_SINGLE_FLIGHT, **getattr(settings, "DARAJA_SINGLE_FLIGHT", {})}
+
+    def do(self, key: str, fn: Callable[[], Any], shared: bool = False) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.followers += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._shared(key, fn) if shared else fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            if flight.followers:
+                logging.info("Coalesced {} calls into one for {}".format(flight.followers + 1, key[:12]))
+            flight.done.set()
+
+    def _shared(self, key: str, fn: Callable[[], Any]) -> Any:
+        config = self.config
+        result_key, lock_key = "daraja:flight:{}".format(key), "daraja:flight:lock:{}".format(key)
+        deadline = time.monotonic() + config["LOCK_TIMEOUT"]
+        while True:
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if cache.add(lock_key, 1, config["LOCK_TIMEOUT"]):
+                break
+            if time.monotonic() >= deadline:
+                # The other process is taking too long, make the call here.
+                return fn()
+            time.sleep(config["POLL_INTERVAL"])
+
+        try:
+            result = fn()
+            # Failed HTTP responses are returned to the callers waiting now but not kept for later ones.
+            if getattr(result, "ok", True):
+                cache.set(result_key, result, config["SHARED_TTL"])
+            return result
+        finally:
+            cache.delete(lock_key)
+
+
+single_flight = SingleFlight()
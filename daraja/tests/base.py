@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from daraja.events import event_log
+from daraja.ledger import ledger
+from daraja.outbox import outbox
+from daraja.payloads import payload_archive
+
+PHONE_NUMBER = "254712345678"
+
+# Buffers write synchronously in tests so rows exist when the assertions run.
+SYNC_SETTINGS = {
+    "DARAJA_EVENT_LOG": {"ASYNC": False},
+    "DARAJA_OUTBOX": {"ASYNC": False},
+    "DARAJA_LEDGER": {"ASYNC": False},
+    "DARAJA_PAYLOAD_ARCHIVE": {"ENABLED": False},
+}
+
+
+def reset_buffers():
+    for buffer in (event_log, outbox, ledger, payload_archive):
+        buffer._config = None
+
+
+def daraja_response(data: dict, ok: bool = True) -> mock.Mock:
+    return mock.Mock(ok=ok, status_code=200 if ok else 400, json=mock.Mock(return_value=data))
+
+
+def stk_accepted(checkout_request_id: str) -> mock.Mock:
+    return daraja_response({
+        "MerchantRequestID": "29115-34620561-1", "CheckoutRequestID": checkout_request_id,
+        "ResponseCode": "0", "ResponseDescription": "Success. Request accepted for processing",
+    })
+
+
+def stk_callback(checkout_request_id: str, amount: int = 10, receipt_no: str = "NLJ7RT61SV") -> dict:
+    return {"Body": {"stkCallback": {
+        "MerchantRequestID": "29115-34620561-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": 0,
+        "ResultDesc": "The service request is processed successfully.",
+        "CallbackMetadata": {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": receipt_no},
+            {"Name": "TransactionDate", "Value": 20240101120000},
+            {"Name": "PhoneNumber", "Value": int(PHONE_NUMBER)},
+        ]},
+    }}}
+
+
+class DarajaTestMixin:
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(reset_buffers)
+        settings_override = override_settings(**SYNC_SETTINGS)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_buffers()
+
+
+class DarajaTestCase(DarajaTestMixin, TestCase):
+    pass
+
+
+class DarajaTransactionTestCase(DarajaTestMixin, TransactionTestCase):
+    """
+    For code that manages its own transactions or database connections, such as callback replay.
+    """
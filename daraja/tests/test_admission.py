@@ -0,0 +1,63 @@
+import json
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from daraja.admission import admission
+from daraja.gateway.base import MpesaBase
+from daraja.models import STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, stk_accepted, stk_callback
+
+# One thread for checkouts, the other two are kept for callbacks.
+THREE_THREADS = {"ENABLED": True, "WORKER_THREADS": 3, "RESERVED_FOR_CALLBACKS": 2}
+
+
+class AdmissionTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def checkout(self):
+        return self.client.post("/daraja/stk/", {"phone_number": PHONE_NUMBER, "amount": 10}, format="json")
+
+    def hold(self, endpoint: str):
+        # A checkout that is still waiting on Safaricom.
+        config = admission.config
+        admission.acquire(endpoint, config)
+        self.addCleanup(admission.release, endpoint, None, config)
+
+    @override_settings(DARAJA_ADMISSION={"ENABLED": True, "WORKER_THREADS": 0})
+    def test_enabled_without_worker_threads_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            admission.config
+
+    @override_settings(DARAJA_ADMISSION=THREE_THREADS)
+    def test_callback_is_admitted_while_checkouts_are_shed(self):
+        STKTransaction.objects.create(checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER)
+        self.hold("b2c")
+        shed_before = admission.stats("stk_push").shed
+
+        with mock.patch.object(MpesaBase, "send_request", return_value=stk_accepted("ws_CO_2")) as send_request:
+            shed = self.checkout()
+        callback = self.client.post(
+            "/daraja/stk/callback/", json.dumps(stk_callback("ws_CO_1")), content_type="application/json"
+        )
+
+        self.assertEqual(shed.status_code, 429)
+        self.assertIn("Retry-After", shed)
+        send_request.assert_not_called()
+        self.assertEqual(callback.status_code, 200)
+        self.assertEqual(str(STKTransaction.objects.get(checkout_request_id="ws_CO_1").status), "0")
+        self.assertEqual(admission.snapshot()["stk_push"]["shed"], shed_before + 1)
+
+    @override_settings(DARAJA_ADMISSION={**THREE_THREADS, "WORKER_THREADS": 4})
+    def test_checkout_is_admitted_below_capacity(self):
+        self.hold("b2c")
+
+        with mock.patch.object(MpesaBase, "send_request", return_value=stk_accepted("ws_CO_2")):
+            response = self.checkout()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(admission.snapshot()["stk_push"]["in_flight"], 0)
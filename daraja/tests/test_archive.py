@@ -0,0 +1,80 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from daraja.gateway.c2b import C2B
+from daraja.models import ArchivedTransaction, STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, stk_callback
+
+
+class ArchiveTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        old = timezone.now() - timedelta(days=100)
+        self.completed = self.create("ws_CO_1", status=0, receipt_no="NLJ7RT61SV")
+        self.pending = self.create("ws_CO_2", status=1)
+        STKTransaction.objects.update(created_at=old)
+        self.recent = self.create("ws_CO_3", status=0)
+
+    def create(self, checkout_request_id: str, **fields) -> STKTransaction:
+        return STKTransaction.objects.create(
+            checkout_request_id=checkout_request_id, amount=10, phone_number="+" + PHONE_NUMBER, **fields
+        )
+
+    def archive(self, *args) -> str:
+        stdout = StringIO()
+        call_command("archive_transactions", "--type", "stk", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_only_old_finalized_rows_are_archived(self):
+        self.assertIn("Archived 1 stk transactions from default", self.archive())
+
+        self.assertEqual(
+            set(STKTransaction.objects.values_list("checkout_request_id", flat=True)), {"ws_CO_2", "ws_CO_3"}
+        )
+        archived = ArchivedTransaction.objects.get()
+        self.assertEqual((archived.object_id, archived.lookup_value), (self.completed.pk, "ws_CO_1"))
+        self.assertEqual(archived.data["receipt_no"], "NLJ7RT61SV")
+
+    def test_archived_transaction_is_still_served(self):
+        self.archive()
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("merchant", password="pw"))
+
+        response = client.get("/daraja/transactions/stk/ws_CO_1/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["receipt_no"], "NLJ7RT61SV")
+
+    def test_late_callback_restores_the_archived_row(self):
+        self.archive()
+
+        C2B().stk_callback_handler(stk_callback("ws_CO_1", receipt_no="NLJ7RT61SW"))
+
+        restored = STKTransaction.objects.get(checkout_request_id="ws_CO_1")
+        self.assertEqual(restored.pk, self.completed.pk)
+        self.assertEqual(restored.receipt_no, "NLJ7RT61SW")
+        self.assertEqual(STKTransaction.objects.filter(checkout_request_id="ws_CO_1").count(), 1)
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+    def test_archive_to_files(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.archive("--to-files", directory)
+
+        (name,) = os.listdir(directory)
+        with gzip.open(os.path.join(directory, name), "rt") as archive_file:
+            records = [json.loads(line) for line in archive_file]
+        self.assertEqual([record["pk"] for record in records], [self.completed.pk])
+        self.assertFalse(ArchivedTransaction.objects.exists())
+        self.assertFalse(STKTransaction.objects.filter(pk=self.completed.pk).exists())
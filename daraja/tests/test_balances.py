@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from daraja.balances import B2C_PAYOUT_ACCOUNT, balance_tracker
+from daraja.gateway.base import MpesaBase
+from daraja.models import AccountBalance, B2CTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, daraja_response
+
+
+def b2c_accepted() -> mock.Mock:
+    return daraja_response({
+        "ConversationID": "AG_20240101_1", "OriginatorConversationID": "1", "ResponseCode": "0",
+        "ResponseDescription": "Accept the service request successfully.",
+    })
+
+
+def b2c_result(originator_conversation_id: str, utility_balance: str, completed_at: str) -> dict:
+    return {"Result": {
+        "ResultType": 0, "ResultCode": 0, "ResultDesc": "The service request is processed successfully.",
+        "OriginatorConversationID": originator_conversation_id, "ConversationID": "AG_20240101_1",
+        "TransactionID": "NLJ41HAY6Q",
+        "ResultParameters": {"ResultParameter": [
+            {"Key": "TransactionAmount", "Value": 100},
+            {"Key": "ReceiverPartyPublicName", "Value": "254712345678 - John Doe"},
+            {"Key": "TransactionCompletedDateTime", "Value": completed_at},
+            {"Key": "B2CUtilityAccountAvailableFunds", "Value": utility_balance},
+            {"Key": "B2CWorkingAccountAvailableFunds", "Value": "900.00"},
+            {"Key": "B2CChargesPaidAccountAvailableFunds", "Value": "-4.00"},
+            {"Key": "B2CRecipientIsRegisteredCustomer", "Value": "Y"},
+        ]},
+    }}
+
+
+class BalanceTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(balance_tracker._local.clear)
+        self.addCleanup(setattr, balance_tracker, "_config", None)
+        self.client = APIClient()
+
+    def payout(self, amount: int):
+        return self.client.post("/daraja/b2c/", {"phone_number": PHONE_NUMBER, "amount": amount}, format="json")
+
+    def callback(self, utility_balance: str, completed_at: str):
+        B2CTransaction.objects.create(originator_conversation_id="oc-1", transaction_amount=100)
+        return self.client.post(
+            "/daraja/b2c/callback/", json.dumps(b2c_result("oc-1", utility_balance, completed_at)),
+            content_type="application/json",
+        )
+
+    def test_result_callback_reports_the_balances(self):
+        self.assertEqual(self.callback("1000.00", "01.01.2024 12:00:00").status_code, 200)
+
+        known = balance_tracker.get(B2C_PAYOUT_ACCOUNT)
+        self.assertEqual(known.balance, Decimal("1000.00"))
+        # Daraja reports East Africa Time.
+        self.assertEqual(known.observed_at, datetime(2024, 1, 1, 9, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(AccountBalance.objects.get(account="working").balance, Decimal("900.00"))
+
+        self.client.force_authenticate(get_user_model().objects.create_user("merchant", password="pw"))
+        balances = {row["account"]: row["balance"] for row in self.client.get("/daraja/reports/balances/").json()}
+        self.assertEqual(balances[B2C_PAYOUT_ACCOUNT], "1000.00")
+
+    def test_older_report_does_not_replace_a_newer_one(self):
+        now = timezone.now()
+        self.assertTrue(balance_tracker.observe(B2C_PAYOUT_ACCOUNT, 500, now, 1, 1))
+        self.assertFalse(balance_tracker.observe(B2C_PAYOUT_ACCOUNT, 1000, now - timedelta(minutes=1), 1, 2))
+
+        self.assertEqual(balance_tracker.get(B2C_PAYOUT_ACCOUNT).balance, 500)
+        self.assertEqual(AccountBalance.objects.get(account=B2C_PAYOUT_ACCOUNT).balance, 500)
+
+    def test_payouts_over_the_known_balance_are_rejected(self):
+        balance_tracker.observe(B2C_PAYOUT_ACCOUNT, 1000, timezone.now(), 1, 1)
+
+        with mock.patch.object(MpesaBase, "send_request", return_value=b2c_accepted()) as send_request:
+            accepted = self.payout(600)
+            rejected = self.payout(600)
+
+        self.assertEqual(accepted.status_code, 200)
+        self.assertEqual(rejected.status_code, 400)
+        self.assertIn("amount", rejected.json())
+        self.assertEqual(send_request.call_count, 1)
+        self.assertEqual(balance_tracker.get(B2C_PAYOUT_ACCOUNT).balance, 400)
+
+    def test_payout_refused_by_daraja_releases_its_reservation(self):
+        balance_tracker.observe(B2C_PAYOUT_ACCOUNT, 1000, timezone.now(), 1, 1)
+        refused = daraja_response({"errorCode": "401.002.01", "errorMessage": "Error Occurred"}, ok=False)
+
+        with mock.patch.object(MpesaBase, "send_request", return_value=refused):
+            self.payout(600)
+
+        self.assertEqual(balance_tracker.get(B2C_PAYOUT_ACCOUNT).balance, 1000)
+
+    def test_unknown_balance_is_not_checked(self):
+        with mock.patch.object(MpesaBase, "send_request", return_value=b2c_accepted()):
+            self.assertEqual(self.payout(10 ** 6).status_code, 200)
+        self.assertIsNone(balance_tracker.get(B2C_PAYOUT_ACCOUNT))
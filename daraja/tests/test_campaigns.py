@@ -0,0 +1,50 @@
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from daraja.campaigns import CampaignRunner
+from daraja.models import Campaign, CampaignRecipient
+
+
+class CampaignRecoveryTests(TestCase):
+    def setUp(self):
+        self.campaign = Campaign.objects.create(
+            name="Renewals", description="Renewal", reference="renewal", status=Campaign.RUNNING,
+            rate_per_second=1000, max_concurrency=2, total_count=3,
+        )
+        self.sending = CampaignRecipient.objects.create(
+            campaign=self.campaign, phone_number="+254712000001", amount=10,
+            status=CampaignRecipient.SENDING, attempted_at=timezone.now(),
+        )
+        self.queued = [
+            CampaignRecipient.objects.create(campaign=self.campaign, phone_number=phone_number, amount=10)
+            for phone_number in ("+254712000002", "+254712000003")
+        ]
+        self.pushed = []
+
+        def push(runner, recipient):
+            self.pushed.append(recipient.pk)
+            recipient.status = CampaignRecipient.SENT
+            recipient.checkout_request_id = "ws_CO_{}".format(recipient.pk)
+            return recipient
+
+        mock.patch.object(CampaignRunner, "push", push).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_crashed_run_is_resumed_without_pushing_twice(self):
+        self.assertTrue(CampaignRunner(self.campaign).run())
+
+        self.assertEqual(sorted(self.pushed), sorted(recipient.pk for recipient in self.queued))
+        self.sending.refresh_from_db()
+        self.assertEqual(self.sending.status, CampaignRecipient.UNKNOWN)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, Campaign.COMPLETED)
+        self.assertEqual((self.campaign.sent_count, self.campaign.unknown_count), (2, 1))
+
+    def test_completed_campaign_is_not_run_again(self):
+        CampaignRunner(self.campaign).run()
+        self.pushed.clear()
+
+        self.assertFalse(CampaignRunner(self.campaign).run())
+        self.assertEqual(self.pushed, [])
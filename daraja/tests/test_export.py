@@ -0,0 +1,80 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from daraja.export import export_columns, pyarrow
+from daraja.models import STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase
+
+
+class ExportTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        now = timezone.now()
+        for checkout_request_id, status, age in (("ws_CO_1", 0, 100), ("ws_CO_2", 2, 2), ("ws_CO_3", 0, 1)):
+            transaction = STKTransaction.objects.create(
+                checkout_request_id=checkout_request_id, amount=10, phone_number="+" + PHONE_NUMBER, status=status
+            )
+            STKTransaction.objects.filter(pk=transaction.pk).update(created_at=now - timedelta(days=age))
+        call_command("archive_transactions", "--type", "stk", stdout=io.StringIO())
+
+    def read_csv(self, content: str) -> list:
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(tuple(rows[0]), export_columns("stk"))
+        index = rows[0].index("checkout_request_id")
+        return [row[index] for row in rows[1:]]
+
+    def test_csv_endpoint_streams_live_and_archived_rows_oldest_first(self):
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+
+        response = client.get("/daraja/exports/stk/")
+        completed = client.get("/daraja/exports/stk/", {"status": "0"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(self.read_csv(response.getvalue().decode()), ["ws_CO_1", "ws_CO_2", "ws_CO_3"])
+        self.assertEqual(self.read_csv(completed.getvalue().decode()), ["ws_CO_1", "ws_CO_3"])
+        self.assertEqual(client.get("/daraja/exports/card/").status_code, 404)
+
+    def test_command_writes_csv_without_archived_rows(self):
+        path = os.path.join(self.directory, "stk.csv")
+
+        call_command("export_transactions", "stk", "--output", path, "--no-archived", "--chunk-size", "1")
+
+        with open(path, newline="") as export_file:
+            self.assertEqual(self.read_csv(export_file.read()), ["ws_CO_2", "ws_CO_3"])
+
+    @unittest.skipIf(pyarrow is None, "needs pyarrow")
+    def test_command_writes_parquet_in_row_groups(self):
+        import pyarrow.parquet
+        path = os.path.join(self.directory, "stk.parquet")
+
+        call_command("export_transactions", "stk", "--format", "parquet", "--output", path, "--row-group-size", "2",
+                     stderr=io.StringIO())
+
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.column("checkout_request_id").to_pylist(), ["ws_CO_1", "ws_CO_2", "ws_CO_3"])
+        self.assertEqual(table.schema.field("created_at").type, pyarrow.timestamp("us", tz="UTC"))
+
+    def test_parquet_needs_pyarrow(self):
+        path = os.path.join(self.directory, "stk.parquet")
+        with mock.patch("daraja.management.commands.export_transactions.pyarrow", None):
+            with self.assertRaises(CommandError):
+                call_command("export_transactions", "stk", "--format", "parquet", "--output", path)
+        with self.assertRaises(CommandError):
+            call_command("export_transactions", "stk", "--format", "parquet")
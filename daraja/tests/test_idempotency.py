@@ -0,0 +1,121 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from daraja.gateway.base import MpesaBase
+from daraja.idempotency import get_config
+from daraja.models import STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, stk_accepted
+
+
+class IdempotencyTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.send_request = mock.patch.object(MpesaBase, "send_request").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def checkout(self, key: str, amount: int = 10):
+        return self.client.post(
+            "/daraja/stk/", {"phone_number": PHONE_NUMBER, "amount": amount}, format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_the_stored_response(self):
+        self.send_request.return_value = stk_accepted("ws_CO_1")
+        first = self.checkout("order-1")
+        retry = self.checkout("order-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(self.send_request.call_count, 1)
+        self.assertEqual(STKTransaction.objects.count(), 1)
+
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.send_request.return_value = stk_accepted("ws_CO_1")
+        self.checkout("order-1")
+        response = self.checkout("order-1", amount=20)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.send_request.call_count, 1)
+
+    @override_settings(DARAJA_IDEMPOTENCY={"WAIT_TIMEOUT": 0})
+    def test_duplicate_in_flight_gets_a_conflict(self):
+        duplicates = []
+
+        def send_request(url, payload, *args, **kwargs):
+            duplicates.append(self.checkout("order-1"))
+            return stk_accepted("ws_CO_1")
+
+        self.send_request.side_effect = send_request
+        response = self.checkout("order-1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(duplicates[0].status_code, 409)
+        self.assertEqual(self.send_request.call_count, 1)
+
+    def test_duplicate_in_flight_waits_for_the_first_response(self):
+        duplicates = []
+
+        def send_request(url, payload, *args, **kwargs):
+            duplicate = threading.Thread(target=lambda: duplicates.append(self.checkout("order-1")))
+            duplicate.start()
+            # The duplicate polls the held lock until the first request has stored its response.
+            time.sleep(0.3)
+            self.assertTrue(duplicate.is_alive())
+            self.duplicate = duplicate
+            return stk_accepted("ws_CO_1")
+
+        self.send_request.side_effect = send_request
+        response = self.checkout("order-1")
+        self.duplicate.join(5)
+
+        self.assertEqual(duplicates[0].status_code, 200)
+        self.assertEqual(duplicates[0].json(), response.json())
+        self.assertEqual(duplicates[0]["Idempotent-Replayed"], "true")
+        self.assertEqual(self.send_request.call_count, 1)
+
+    def test_failed_validation_releases_the_key(self):
+        invalid = self.client.post(
+            "/daraja/stk/", {"phone_number": "12", "amount": 10}, format="json", HTTP_IDEMPOTENCY_KEY="order-1"
+        )
+        self.assertEqual(invalid.status_code, 400)
+
+        # Nothing was sent, so the corrected request runs under the same key instead of getting a 422.
+        self.send_request.return_value = stk_accepted("ws_CO_1")
+        response = self.checkout("order-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(self.send_request.call_count, 1)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        self.send_request.side_effect = [stk_accepted("ws_CO_1"), stk_accepted("ws_CO_2")]
+        for _ in range(2):
+            self.client.post("/daraja/stk/", {"phone_number": PHONE_NUMBER, "amount": 10}, format="json")
+
+        self.assertEqual(self.send_request.call_count, 2)
+
+
+class LockTimeoutTests(SimpleTestCase):
+    @override_settings(DARAJA_HTTP={"TIMEOUT": 20}, DARAJA_IDEMPOTENCY={})
+    def test_daraja_calls_time_out_before_the_key_lock_expires(self):
+        cache.set("mpesa_access_token", "token")
+        self.addCleanup(cache.delete, "mpesa_access_token")
+        with mock.patch("daraja.gateway.base.get_session") as get_session:
+            MpesaBase().send_request("https://sandbox.safaricom.co.ke/mpesa/b2c/v1/paymentrequest", {})
+
+        self.assertEqual(get_session.return_value.request.call_args.kwargs["timeout"], 20)
+        # A token fetch and the call itself both fit in the lock.
+        self.assertGreater(get_config()["LOCK_TIMEOUT"], 2 * 20)
+
+    @override_settings(DARAJA_HTTP={"TIMEOUT": 20}, DARAJA_IDEMPOTENCY={"LOCK_TIMEOUT": 30})
+    def test_lock_shorter_than_the_calls_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_config()
@@ -0,0 +1,54 @@
+import json
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APIClient
+
+from daraja.lanes import CALLBACKS, Lane, LaneRegistry, lanes
+from daraja.models import STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, stk_callback
+
+
+class LaneTests(SimpleTestCase):
+    def test_runs_on_the_calling_thread(self):
+        lane = Lane(CALLBACKS, 0.1)
+
+        self.assertEqual(lane.run(threading.get_ident), threading.get_ident())
+        with self.assertRaises(ZeroDivisionError):
+            lane.run(lambda: 1 / 0)
+
+        snapshot = lane.snapshot()
+        self.assertEqual((snapshot["completed"], snapshot["failed"], snapshot["active"]), (1, 1, 0))
+        self.assertEqual(snapshot["max_active"], 1)
+
+
+class LaneViewTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        STKTransaction.objects.create(checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER)
+
+    def callback(self):
+        return self.client.post(
+            "/daraja/stk/callback/", json.dumps(stk_callback("ws_CO_1")), content_type="application/json"
+        )
+
+    @override_settings(DARAJA_LANES={"ENABLED": True})
+    def test_callbacks_are_counted_in_their_lane(self):
+        completed = lanes.get(CALLBACKS).snapshot()["completed"]
+
+        self.assertEqual(self.callback().status_code, 200)
+
+        self.client.force_authenticate(get_user_model().objects.create_superuser("admin", "admin@example.com", "pw"))
+        metrics = self.client.get("/daraja/metrics/workers/").json()
+        self.assertEqual(metrics["lanes"][CALLBACKS]["completed"], completed + 1)
+        self.assertEqual(metrics["lanes"][CALLBACKS]["active"], 0)
+
+    def test_disabled_lanes_are_bypassed(self):
+        with mock.patch.object(LaneRegistry, "get") as get:
+            self.assertEqual(self.callback().status_code, 200)
+
+        get.assert_not_called()
+        self.assertEqual(str(STKTransaction.objects.get().status), "0")
@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.utils import timezone
+
+from daraja.gateway.c2b import C2B
+from daraja.ledger import ledger
+from daraja.models import JournalEntry, LedgerAccount, Posting, STKTransaction
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, stk_callback
+
+
+class LedgerTests(DarajaTestCase):
+    def complete(self, checkout_request_id: str, amount: int):
+        STKTransaction.objects.create(
+            checkout_request_id=checkout_request_id, amount=amount, phone_number="+" + PHONE_NUMBER
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return C2B().stk_callback_handler(stk_callback(checkout_request_id, amount, checkout_request_id[-10:]))
+
+    def test_completed_transaction_is_posted_balanced(self):
+        transaction = self.complete("ws_CO_1", 10)
+
+        entry = JournalEntry.objects.get()
+        self.assertEqual(entry.object_id, transaction.pk)
+        self.assertEqual(sum(entry.postings.values_list("amount", flat=True)), 0)
+        self.assertEqual(ledger.balance("mpesa_collections"), Decimal("10"))
+        self.assertEqual(ledger.balance("customer_payments"), Decimal("-10"))
+
+    def test_balances_accumulate_with_running_balances(self):
+        self.complete("ws_CO_1", 10)
+        first_posted = timezone.now()
+        self.complete("ws_CO_2", 25)
+
+        self.assertEqual(ledger.balance("mpesa_collections"), Decimal("35"))
+        self.assertEqual(ledger.balance("mpesa_collections", at=first_posted), Decimal("10"))
+        self.assertEqual(
+            list(Posting.objects.filter(account__code="mpesa_collections").order_by("id").values_list(
+                "running_balance", flat=True
+            )),
+            [Decimal("10"), Decimal("35")],
+        )
+
+    def test_transaction_is_posted_once(self):
+        transaction = self.complete("ws_CO_1", 10)
+        entry = ledger.entry_for(transaction)
+        ledger.write([entry, entry])
+        ledger.write([entry])
+        with self.captureOnCommitCallbacks(execute=True):
+            C2B().stk_callback_handler(stk_callback("ws_CO_1"))
+
+        self.assertEqual(JournalEntry.objects.count(), 1)
+        self.assertEqual(LedgerAccount.objects.get(code="mpesa_collections").balance, Decimal("10"))
+
+    def test_rolled_back_completion_is_not_posted(self):
+        STKTransaction.objects.create(checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            C2B().stk_callback_handler(stk_callback("ws_CO_1"))
+
+        self.assertTrue(callbacks)
+        self.assertFalse(JournalEntry.objects.exists())
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from daraja.models import STKTransaction
+from daraja.notifier import DEFAULT_NOTIFIER, CacheNotifier, LocalNotifier, get_notifier, status_message
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase
+
+
+class NotifierTests(SimpleTestCase):
+    def test_publish_from_another_thread_wakes_the_waiter(self):
+        notifier = LocalNotifier(DEFAULT_NOTIFIER)
+
+        async def wait():
+            subscription = notifier.subscribe("ws_CO_1")
+            threading.Timer(0.05, notifier.publish, args=("ws_CO_1", {"final": True})).start()
+            try:
+                return await notifier.wait(subscription, 5)
+            finally:
+                notifier.unsubscribe(subscription)
+
+        self.assertEqual(asyncio.run(wait()), {"final": True})
+        self.assertEqual(dict(notifier._subscriptions), {})
+
+    def test_wait_times_out(self):
+        notifier = LocalNotifier(DEFAULT_NOTIFIER)
+
+        async def wait():
+            subscription = notifier.subscribe("ws_CO_1")
+            notifier.publish("ws_CO_2", {"final": True})
+            return await notifier.wait(subscription, 0.05)
+
+        self.assertIsNone(asyncio.run(wait()))
+
+    def test_cache_notifier_sees_messages_published_by_other_processes(self):
+        notifier = CacheNotifier({**DEFAULT_NOTIFIER, "POLL_INTERVAL": 0.01})
+        cache.set(notifier.cache_key("ws_CO_1"), {"final": False, "published_at": time.time() - 60})
+
+        async def wait():
+            subscription = notifier.subscribe("ws_CO_1")
+            # Another worker handles the callback; only the cache entry reaches this one.
+            asyncio.get_running_loop().call_later(0.05, cache.set, notifier.cache_key("ws_CO_1"), {
+                "final": True, "published_at": time.time() + 1,
+            })
+            return await notifier.wait(subscription, 5)
+
+        self.assertTrue(asyncio.run(wait())["final"])
+
+
+@override_settings(DARAJA_STATUS_WAIT_TIMEOUT=5)
+class StatusWaitTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(get_user_model().objects.create_user("merchant", password="pw"))
+
+    def create(self, status: int) -> STKTransaction:
+        return STKTransaction.objects.create(
+            checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER, status=status
+        )
+
+    async def test_final_transaction_is_returned_at_once(self):
+        await sync_to_async(self.create)(0)
+
+        response = await self.async_client.get("/daraja/status/stk/ws_CO_1/wait/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["final"])
+
+    async def test_pending_transaction_waits_for_the_callback(self):
+        transaction = await sync_to_async(self.create)(1)
+        transaction.status = 0
+        update = await sync_to_async(status_message)("stk", transaction)
+        asyncio.get_running_loop().call_later(0.1, get_notifier().publish, "ws_CO_1", update)
+
+        started = time.monotonic()
+        response = await self.async_client.get("/daraja/status/stk/ws_CO_1/wait/")
+
+        self.assertTrue(response.json()["final"])
+        self.assertLess(time.monotonic() - started, 4)
+
+    async def test_wait_gives_up_with_the_current_state(self):
+        await sync_to_async(self.create)(1)
+
+        response = await self.async_client.get("/daraja/status/stk/ws_CO_1/wait/", {"timeout": "0.05"})
+
+        self.assertFalse(response.json()["final"])
+
+    @override_settings(DARAJA_STATUS_HEARTBEAT=0.05, DARAJA_STATUS_STREAM_TIMEOUT=0.12)
+    async def test_event_stream_sends_the_state_and_keep_alives(self):
+        await sync_to_async(self.create)(1)
+
+        response = await self.async_client.get("/daraja/status/stk/ws_CO_1/events/")
+        chunks = [chunk.decode() async for chunk in response.streaming_content]
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertTrue(chunks[0].startswith("event: status\ndata: "))
+        self.assertFalse(json.loads(chunks[0].split("data: ", 1)[1])["final"])
+        self.assertIn(": keep-alive\n\n", chunks[1:])
+
+    async def test_needs_credentials(self):
+        await self.async_client.alogout()
+        response = await self.async_client.get("/daraja/status/stk/ws_CO_1/wait/")
+        self.assertIn(response.status_code, (401, 403))
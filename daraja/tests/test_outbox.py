@@ -0,0 +1,93 @@
+from unittest import mock
+
+import requests
+from django.test import RequestFactory
+
+from daraja.gateway.b2b import B2B
+from daraja.gateway.b2c import B2C
+from daraja.gateway.base import MpesaBase
+from daraja.gateway.c2b import C2B
+from daraja.models import B2BTransaction, B2CTransaction, STKTransaction, TransactionEvent
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase, daraja_response, stk_accepted, stk_callback
+
+
+class OutboxTests(DarajaTestCase):
+    def stk_push(self, amount: int = 10) -> dict:
+        return C2B().stk_push(
+            request=None, amount=amount, phone_number=PHONE_NUMBER, description="Order 1", reference="order-1"
+        )
+
+    def test_intent_is_recorded_before_the_call(self):
+        def send_request(url, payload, *args, **kwargs):
+            intent = STKTransaction.objects.get()
+            self.assertIsNone(intent.checkout_request_id)
+            self.assertEqual(intent.amount, 10)
+            self.assertEqual(str(intent.status), "1")
+            return stk_accepted("ws_CO_1")
+
+        with mock.patch.object(MpesaBase, "send_request", side_effect=send_request):
+            self.stk_push()
+
+        transaction = STKTransaction.objects.get()
+        self.assertEqual(transaction.checkout_request_id, "ws_CO_1")
+        self.assertEqual(transaction.reference, "order-1")
+
+    def test_rejected_push_completes_the_intent_as_failed(self):
+        rejected = daraja_response({"errorCode": "400.002.02", "errorMessage": "Bad Request"}, ok=False)
+        with mock.patch.object(MpesaBase, "send_request", return_value=rejected):
+            self.stk_push()
+
+        transaction = STKTransaction.objects.get()
+        self.assertEqual(str(transaction.status), "2")
+        self.assertIsNone(transaction.checkout_request_id)
+
+    def test_callback_arriving_before_completion_is_merged(self):
+        def send_request(url, payload, *args, **kwargs):
+            # Safaricom's callback beats the write of the CheckoutRequestID.
+            C2B().stk_callback_handler(stk_callback("ws_CO_1"))
+            return stk_accepted("ws_CO_1")
+
+        with mock.patch.object(MpesaBase, "send_request", side_effect=send_request):
+            self.stk_push()
+
+        transaction = STKTransaction.objects.get()
+        self.assertEqual(transaction.checkout_request_id, "ws_CO_1")
+        self.assertEqual(str(transaction.status), "0")
+        self.assertEqual(transaction.receipt_no, "NLJ7RT61SV")
+        self.assertEqual(transaction.reference, "order-1")
+        self.assertEqual(transaction.description, "Order 1")
+        self.assertEqual(
+            set(TransactionEvent.objects.values_list("object_id", flat=True)), {transaction.pk}
+        )
+
+    def test_failed_call_marks_the_intent_failed(self):
+        with mock.patch.object(MpesaBase, "send_request", side_effect=requests.ConnectTimeout):
+            with self.assertRaises(requests.ConnectTimeout):
+                self.stk_push()
+
+        transaction = STKTransaction.objects.get()
+        self.assertEqual(str(transaction.status), "2")
+
+    def test_failed_b2c_call_marks_the_intent_failed(self):
+        with mock.patch.object(MpesaBase, "send_request", side_effect=requests.ReadTimeout):
+            with self.assertRaises(requests.ReadTimeout):
+                B2C().b2c_send(
+                    request=RequestFactory().post("/daraja/b2c/"), amount=100, phone_number=PHONE_NUMBER,
+                    occasion="Refund", remarks="Refund",
+                )
+
+        transaction = B2CTransaction.objects.get()
+        self.assertEqual(str(transaction.status), "2")
+        self.assertIsNone(transaction.conversation_id)
+
+    def test_failed_b2b_call_marks_the_intent_failed(self):
+        with mock.patch.object(MpesaBase, "send_request", side_effect=requests.ConnectionError("refused")):
+            with self.assertRaises(requests.ConnectionError):
+                B2B().b2b_send(
+                    request=RequestFactory().post("/daraja/b2b/"), amount=100, party_b=600000, remarks="Stock",
+                    recipient_type="paybill", account_reference="INV-1",
+                )
+
+        transaction = B2BTransaction.objects.get()
+        self.assertEqual(str(transaction.status), "2")
+        self.assertEqual(transaction.failure_description, "refused")
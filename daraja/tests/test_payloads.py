@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+
+from daraja.models import PayloadIndex
+from daraja.payloads import payload_archive
+from daraja.tests.base import DarajaTestCase, reset_buffers, stk_callback
+
+
+class PayloadArchiveTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(DARAJA_PAYLOAD_ARCHIVE={
+            "ENABLED": True, "ASYNC": False, "DIRECTORY": self.directory,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_buffers()
+        payload_archive.reset_segment()
+        self.addCleanup(payload_archive.reset_segment)
+
+    def test_callback_is_found_by_its_ids(self):
+        payload_archive.record(PayloadIndex.CALLBACK, stk_callback("ws_CO_1"))
+        payload_archive.record(PayloadIndex.CALLBACK, stk_callback("ws_CO_2"))
+
+        records = payload_archive.lookup("ws_CO_2", kind=PayloadIndex.CALLBACK)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["payload"]["Body"]["stkCallback"]["CheckoutRequestID"], "ws_CO_2")
+        self.assertEqual(payload_archive.lookup("ws_CO_2", kind=PayloadIndex.OUTBOUND), [])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_forked_child_starts_its_own_segment(self):
+        payload_archive.record(PayloadIndex.CALLBACK, stk_callback("ws_CO_1"))
+        parent_segment = payload_archive._segment
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if payload_archive._segment is None and not payload_archive._segment_lock.locked() else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(payload_archive._segment, parent_segment)
+
+    @override_settings(DARAJA_PAYLOAD_ARCHIVE={"ENABLED": True})
+    def test_enabled_without_a_directory_is_refused(self):
+        reset_buffers()
+        with self.assertRaises(ImproperlyConfigured):
+            payload_archive.record(PayloadIndex.CALLBACK, stk_callback("ws_CO_1"))
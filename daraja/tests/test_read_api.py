@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from daraja.models import B2CTopup, STKTransaction
+from daraja.outbox import outbox
+from daraja.pagination import KeysetPagination
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase
+
+
+class TransactionReadTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("merchant"))
+        self.transactions = [
+            STKTransaction.objects.create(
+                checkout_request_id="ws_CO_{}".format(index), amount=10, phone_number="+" + PHONE_NUMBER
+            )
+            for index in range(3)
+        ]
+
+    def test_list_pages_newest_first(self):
+        first = self.client.get("/daraja/transactions/stk/", {"page_size": 2}).json()
+        self.assertEqual(
+            [row["checkout_request_id"] for row in first["results"]], ["ws_CO_2", "ws_CO_1"]
+        )
+        second = self.client.get(first["next"]).json()
+        self.assertEqual([row["checkout_request_id"] for row in second["results"]], ["ws_CO_0"])
+        self.assertIsNone(second["next"])
+
+    def test_unchanged_list_is_not_loaded_again(self):
+        etag = self.client.get("/daraja/transactions/stk/", {"page_size": 2})["ETag"]
+
+        # Only the ids and versions of the page are read; the page itself is neither loaded nor serialized.
+        with self.assertNumQueries(1), mock.patch.object(
+                KeysetPagination, "paginate_queryset", side_effect=AssertionError("page loaded")):
+            response = self.client.get("/daraja/transactions/stk/", {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_list_etag_changes_with_the_page(self):
+        etag = self.client.get("/daraja/transactions/stk/", {"page_size": 2})["ETag"]
+
+        self.transactions[2].status = 2
+        self.transactions[2].save()
+        response = self.client.get("/daraja/transactions/stk/", {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # A row further back does not change the first page.
+        etag = response["ETag"]
+        self.transactions[0].status = 2
+        self.transactions[0].save()
+        response = self.client.get("/daraja/transactions/stk/", {"page_size": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_topup_detail_returns_the_newest_of_a_conversation(self):
+        B2CTopup.objects.create(conversation_id="AG_1", amount=5, paybill_number="600000")
+        newest = B2CTopup.objects.create(conversation_id="AG_1", amount=7, paybill_number="600000")
+
+        response = self.client.get("/daraja/transactions/topup/AG_1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["id"], newest.pk)
+
+    def test_completion_drops_the_cached_read(self):
+        transaction = self.transactions[1]
+        self.assertEqual(str(self.client.get("/daraja/transactions/stk/ws_CO_1/").json()["status"]), "1")
+
+        transaction.status = 2
+        outbox.write([(transaction, ("status",))])
+
+        self.assertEqual(str(self.client.get("/daraja/transactions/stk/ws_CO_1/").json()["status"]), "2")
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from daraja.gateway.c2b import C2B
+from daraja.models import STKTransaction, TransactionEvent
+from daraja.replay import correlation_key, detect_kind
+from daraja.tests.base import PHONE_NUMBER, DarajaTransactionTestCase, stk_callback
+from daraja.webhooks import WebhookDispatcher
+
+
+class DetectKindTests(SimpleTestCase):
+    def test_callback_shapes(self):
+        self.assertEqual(detect_kind(stk_callback("ws_CO_1")), "stk")
+        self.assertEqual(detect_kind({"Result": {"requestId": "ref-1", "ResultCode": 0}}), "express")
+        self.assertEqual(detect_kind({"Result": {"ResultCode": 0, "ResultParameters": {"ResultParameter": [
+            {"Key": "B2CRecipientIsRegisteredCustomer", "Value": "Y"},
+        ]}}}), "b2c")
+        self.assertIsNone(detect_kind({"ResultCode": 0}))
+        self.assertEqual(correlation_key(stk_callback("ws_CO_1")), "ws_CO_1")
+
+
+class ReplayCallbacksTests(DarajaTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.transaction = STKTransaction.objects.create(
+            checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER
+        )
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.dispatch = mock.patch.object(WebhookDispatcher, "dispatch").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def write_file(self, *callbacks) -> str:
+        path = os.path.join(self.directory, "callbacks.jsonl")
+        with open(path, "w") as callbacks_file:
+            for callback in callbacks:
+                callbacks_file.write(json.dumps(callback) + "\n")
+        return path
+
+    def replay(self, *args) -> str:
+        stdout = StringIO()
+        call_command("replay_callbacks", "--workers", "1", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_replays_callbacks_from_files(self):
+        path = self.write_file(stk_callback("ws_CO_1"), {"unknown": True})
+
+        output = self.replay("--files", path)
+
+        self.assertIn("Replayed 1 callbacks, 1 skipped, 0 failed", output)
+        self.transaction.refresh_from_db()
+        self.assertEqual(str(self.transaction.status), "0")
+        self.assertEqual(self.transaction.receipt_no, "NLJ7RT61SV")
+        self.assertFalse(TransactionEvent.objects.exists())
+        self.dispatch.assert_not_called()
+
+    def test_dry_run_prints_the_changes_and_rolls_back(self):
+        path = self.write_file(stk_callback("ws_CO_1"))
+
+        output = self.replay("--files", path, "--dry-run")
+
+        diff = json.loads(output.splitlines()[0])
+        self.assertEqual((diff["type"], diff["id"]), ("stk", self.transaction.pk))
+        self.assertEqual(diff["changes"]["receipt_no"], [None, "NLJ7RT61SV"])
+        self.assertIn("Would change 1 rows with 1 callbacks", output)
+        self.transaction.refresh_from_db()
+        self.assertEqual(str(self.transaction.status), "1")
+
+    def test_replays_the_event_log(self):
+        C2B().stk_callback_handler(stk_callback("ws_CO_1"))
+        # A parsing bug that lost the receipt number.
+        STKTransaction.objects.update(receipt_no=None)
+        events = TransactionEvent.objects.count()
+
+        self.assertIn("Replayed 1 callbacks", self.replay("--type", "stk"))
+
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.receipt_no, "NLJ7RT61SV")
+        self.assertEqual(TransactionEvent.objects.count(), events)
+
+    def test_resume_continues_after_the_checkpoint(self):
+        checkpoint = os.path.join(self.directory, "checkpoint.json")
+        path = self.write_file(stk_callback("ws_CO_1"))
+        self.replay("--files", path, "--checkpoint", checkpoint)
+        with open(checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)["position"], [0, 0])
+
+        self.assertIn("Replayed 0 callbacks", self.replay("--files", path, "--checkpoint", checkpoint, "--resume"))
@@ -0,0 +1,73 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from daraja.models import AggregateWatermark, DailyTransactionAggregate, STKTransaction, TransactionEvent
+from daraja.reports import WATERMARK_NAME, refresh_daily_aggregates
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class DailyAggregateTests(DarajaTestCase):
+    def create(self, checkout_request_id: str, amount: int, created_at: datetime, status: int = 0) -> STKTransaction:
+        transaction = STKTransaction.objects.create(
+            checkout_request_id=checkout_request_id, amount=amount, phone_number="+" + PHONE_NUMBER, status=status
+        )
+        STKTransaction.objects.filter(pk=transaction.pk).update(created_at=created_at)
+        return transaction
+
+    def totals(self) -> dict:
+        return {
+            (row.date, row.status): (row.count, row.amount)
+            for row in DailyTransactionAggregate.objects.filter(transaction_type=0)
+        }
+
+    def test_days_are_counted_in_nairobi_time(self):
+        # 22:30 UTC is already 01:30 the next day in Nairobi, 20:30 UTC is still 23:30 the same day.
+        self.create("ws_CO_1", 10, utc(2024, 1, 1, 20, 30))
+        self.create("ws_CO_2", 20, utc(2024, 1, 1, 22, 30))
+        self.create("ws_CO_3", 30, utc(2024, 1, 2, 12, 0), status=2)
+
+        self.assertEqual(refresh_daily_aggregates(full=True), 2)
+
+        self.assertEqual(self.totals(), {
+            (date(2024, 1, 1), "0"): (1, 10),
+            (date(2024, 1, 2), "0"): (1, 20),
+            (date(2024, 1, 2), "2"): (1, 30),
+        })
+
+    def test_only_days_with_new_events_are_recomputed(self):
+        old = self.create("ws_CO_1", 10, utc(2024, 1, 1, 12, 0))
+        late = self.create("ws_CO_2", 20, utc(2024, 1, 1, 22, 30))
+        AggregateWatermark.objects.create(name=WATERMARK_NAME, processed_until=timezone.now() - timedelta(hours=1))
+        TransactionEvent.objects.create(
+            kind=TransactionEvent.STATUS_CHANGED, transaction_type=0, object_id=late.pk, status=0
+        )
+        TransactionEvent.objects.create(
+            kind=TransactionEvent.STATUS_CHANGED, transaction_type=0, object_id=old.pk, status=0,
+            created_at=timezone.now() - timedelta(days=1),
+        )
+
+        self.assertEqual(refresh_daily_aggregates(), 1)
+        self.assertEqual(self.totals(), {(date(2024, 1, 2), "0"): (1, 20)})
+
+    def test_report_reads_the_aggregates(self):
+        self.create("ws_CO_1", 10, utc(2024, 1, 1, 20, 30))
+        self.create("ws_CO_2", 20, utc(2024, 1, 1, 22, 30))
+        refresh_daily_aggregates(full=True)
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user("reports", password="pw"))
+
+        response = client.get("/daraja/reports/daily/", {"date_from": "2024-01-02", "date_to": "2024-01-02"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{
+            "date": "2024-01-02", "transaction_type": "stk", "status": "0", "count": 1, "amount": 20,
+            "charges": "0.00",
+        }])
+        self.assertEqual(client.get("/daraja/reports/daily/", {"type": "card"}).status_code, 400)
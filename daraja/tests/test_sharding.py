@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from daraja.models import STKTransaction, TransactionEvent
+from daraja.sharding import ShardRouter, sharding, use_shard
+from daraja.tests.base import PHONE_NUMBER
+
+
+@override_settings(DARAJA_SHARDING={"ENABLED": True, "SHARDS": {"shard_1": {"KEYS": ["600100"]}}})
+class ShardingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_shortcodes_map_to_their_shard(self):
+        self.assertEqual(sharding.shard_for("600100"), "shard_1")
+        self.assertEqual(sharding.shard_for(600100), "shard_1")
+        self.assertEqual(sharding.shard_for("174379"), "default")
+        self.assertEqual(sharding.aliases(), ["default", "shard_1"])
+
+    @override_settings(DARAJA_SHARDING={"ENABLED": False})
+    def test_everything_is_on_default_when_disabled(self):
+        self.assertEqual(sharding.shard_for("600100"), "default")
+        self.assertIsNone(sharding.locate(STKTransaction, {"checkout_request_id": "ws_CO_1"}))
+        self.assertIsNone(ShardRouter().db_for_write(STKTransaction))
+
+    def test_router_follows_the_selected_shard(self):
+        router = ShardRouter()
+        self.assertIsNone(router.db_for_read(STKTransaction))
+        with use_shard("shard_1"):
+            self.assertEqual(router.db_for_read(STKTransaction), "shard_1")
+            self.assertEqual(router.db_for_write(STKTransaction), "shard_1")
+            self.assertIsNone(router.db_for_write(TransactionEvent))
+
+        instance = STKTransaction()
+        instance._state.db = "shard_1"
+        self.assertEqual(router.db_for_write(STKTransaction, instance=instance), "shard_1")
+
+    def test_only_transaction_tables_migrate_on_shards(self):
+        router = ShardRouter()
+        self.assertTrue(router.allow_migrate("shard_1", "daraja", model_name="stktransaction"))
+        self.assertFalse(router.allow_migrate("shard_1", "daraja", model_name="transactionevent"))
+        self.assertFalse(router.allow_migrate("shard_1", "auth", model_name="user"))
+        self.assertIsNone(router.allow_migrate("default", "daraja", model_name="stktransaction"))
+
+    def test_locate_remembers_recorded_transactions(self):
+        instance = STKTransaction(checkout_request_id="ws_CO_1")
+        instance._state.db = "shard_1"
+        sharding.remember(instance)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.locate(STKTransaction, {"checkout_request_id": "ws_CO_1"}), "shard_1")
+
+    def test_locate_searches_the_shards_on_a_cache_miss(self):
+        STKTransaction.objects.create(checkout_request_id="ws_CO_1", amount=10, phone_number="+" + PHONE_NUMBER)
+
+        self.assertEqual(sharding.locate(STKTransaction, {"checkout_request_id": "ws_CO_1"}), "default")
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.locate(STKTransaction, {"checkout_request_id": "ws_CO_1"}), "default")
+        self.assertIsNone(sharding.locate(STKTransaction, {"checkout_request_id": None}))
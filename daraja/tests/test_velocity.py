@@ -0,0 +1,113 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from daraja.balances import B2C_PAYOUT_ACCOUNT, balance_tracker
+from daraja.gateway.b2c import B2C
+from daraja.gateway.c2b import C2B
+from daraja.models import B2CTransaction, STKTransaction
+from daraja.outbox import outbox
+from daraja.tests.base import PHONE_NUMBER, DarajaTestCase
+from daraja.velocity import LocalCounter, Rule, VelocityLimiter, VelocityLimitExceeded, velocity
+
+
+class VelocityTests(TestCase):
+    rule = Rule("msisdn_minute", ("stk",), "msisdn", 60, 2, None)
+
+    def test_limit_applies_within_the_window(self):
+        counter = LocalCounter({"RULES": [], "MAX_KEYS": 100})
+        self.assertTrue(counter.hit(self.rule, PHONE_NUMBER, 10, 0))
+        self.assertTrue(counter.hit(self.rule, PHONE_NUMBER, 10, 30))
+        self.assertFalse(counter.hit(self.rule, PHONE_NUMBER, 10, 59))
+        self.assertTrue(counter.hit(self.rule, "254700000000", 10, 59))
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        counter = LocalCounter({"RULES": [], "MAX_KEYS": 100})
+        counter.hit(self.rule, PHONE_NUMBER, 10, 50)
+        counter.hit(self.rule, PHONE_NUMBER, 10, 55)
+        # 2 hits in the previous window, three quarters of which still overlap the sliding window.
+        self.assertFalse(counter.hit(self.rule, PHONE_NUMBER, 10, 75))
+        # A quarter overlaps: 0.5 + 1 stays within the limit of 2.
+        self.assertTrue(counter.hit(self.rule, PHONE_NUMBER, 10, 105))
+        self.assertTrue(counter.hit(self.rule, PHONE_NUMBER, 10, 200))
+
+    def test_amount_limit(self):
+        rule = Rule("msisdn_amount", ("b2c",), "msisdn", 3600, None, 1000)
+        counter = LocalCounter({"RULES": [], "MAX_KEYS": 100})
+        self.assertTrue(counter.hit(rule, PHONE_NUMBER, 600, 0))
+        self.assertFalse(counter.hit(rule, PHONE_NUMBER, 500, 1))
+        self.assertTrue(counter.hit(rule, PHONE_NUMBER, 400, 2))
+
+    @override_settings(DARAJA_VELOCITY={"ENABLED": True, "RULES": [
+        {"NAME": "stk_msisdn_minute", "OPERATIONS": ["stk"], "KEY": "msisdn", "WINDOW": 3600, "LIMIT": 1},
+    ]})
+    def test_released_hits_do_not_count(self):
+        limiter = VelocityLimiter()
+        hits = limiter.check("stk", 10, msisdn="0712345678")
+        with self.assertRaises(VelocityLimitExceeded):
+            limiter.check("stk", 10, msisdn="+254712345678")
+
+        limiter.release(hits)
+        self.assertEqual(len(limiter.check("stk", 10, msisdn=PHONE_NUMBER)), 1)
+
+    @override_settings(DARAJA_VELOCITY={"ENABLED": False, "RULES": [
+        {"NAME": "stk_msisdn_minute", "OPERATIONS": ["stk"], "KEY": "msisdn", "WINDOW": 3600, "LIMIT": 1},
+    ]})
+    def test_disabled_limiter_counts_nothing(self):
+        limiter = VelocityLimiter()
+        for _ in range(3):
+            self.assertEqual(limiter.check("stk", 10, msisdn=PHONE_NUMBER), [])
+
+
+ONE_PER_HOUR = {"ENABLED": True, "RULES": [
+    {"NAME": "stk_msisdn_hourly", "OPERATIONS": ["stk"], "KEY": "msisdn", "WINDOW": 3600, "LIMIT": 1},
+    {"NAME": "b2c_msisdn_hourly", "OPERATIONS": ["b2c"], "KEY": "msisdn", "WINDOW": 3600, "LIMIT": 1},
+]}
+
+
+@override_settings(DARAJA_VELOCITY=ONE_PER_HOUR)
+class ReleaseOnFailureTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        velocity._backend = velocity._rules = None
+        self.addCleanup(setattr, velocity, "_backend", None)
+        self.addCleanup(setattr, velocity, "_rules", None)
+        self.addCleanup(balance_tracker._local.clear)
+
+    def b2c_send(self):
+        return B2C().b2c_send(
+            request=RequestFactory().post("/daraja/b2c/"), amount=100, phone_number=PHONE_NUMBER,
+            occasion="Refund", remarks="Refund",
+        )
+
+    def test_failed_intent_releases_the_stk_hits(self):
+        with mock.patch.object(outbox, "record_intent", side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                C2B().stk_push(
+                    request=None, amount=10, phone_number=PHONE_NUMBER, description="Order 1", reference="order-1"
+                )
+
+        self.assertFalse(STKTransaction.objects.exists())
+        self.assertEqual(len(velocity.check("stk", 10, msisdn=PHONE_NUMBER)), 1)
+
+    def test_failed_intent_releases_the_b2c_hits_and_reservation(self):
+        observed_at = timezone.now() - timedelta(minutes=1)
+        balance_tracker.observe(B2C_PAYOUT_ACCOUNT, 1000, observed_at, 0, 0)
+
+        with mock.patch.object(outbox, "record_intent", side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                self.b2c_send()
+
+        self.assertFalse(B2CTransaction.objects.exists())
+        self.assertEqual(balance_tracker.get(B2C_PAYOUT_ACCOUNT).balance, 1000)
+        self.assertEqual(len(velocity.check("b2c", 100, msisdn=PHONE_NUMBER)), 1)
+
+    def test_failed_event_record_marks_the_intent_failed(self):
+        with mock.patch("daraja.gateway.b2c.event_log.record", side_effect=RuntimeError("queue full")):
+            with self.assertRaises(RuntimeError):
+                self.b2c_send()
+
+        self.assertEqual(str(B2CTransaction.objects.get().status), "2")
+        self.assertEqual(len(velocity.check("b2c", 100, msisdn=PHONE_NUMBER)), 1)
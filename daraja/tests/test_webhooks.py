@@ -0,0 +1,129 @@
+import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from daraja.models import B2BExpressTransaction, WebhookDelivery, WebhookSubscription
+from daraja.tests.base import DarajaTestCase
+from daraja.webhooks import DEFAULT_WEBHOOKS, WebhookDispatcher, sign_payload
+
+
+def express_callback(request_ref_id: str, result_code: int = 0) -> dict:
+    return {"Result": {
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully.",
+        "requestId": request_ref_id,
+        "conversationID": "AG_20240101_1234567890",
+        "TransactionID": "RDQ01NFT1Q",
+    }}
+
+
+def subscriber_response(ok: bool = True) -> mock.Mock:
+    return mock.Mock(ok=ok, status_code=200 if ok else 503, text="" if ok else "Service Unavailable")
+
+
+class WebhookDispatcherTests(DarajaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = WebhookDispatcher(DEFAULT_WEBHOOKS)
+        self.addCleanup(self.dispatcher.executor.shutdown)
+
+    def test_callback_dispatches_the_status_change(self):
+        transaction = B2BExpressTransaction.objects.create(
+            request_ref_id="ref-1", receiver_short_code=600000, amount=100
+        )
+
+        with mock.patch.object(WebhookDispatcher, "dispatch") as dispatch:
+            response = self.client.post(
+                "/daraja/b2b/express/callback/", json.dumps(express_callback("ref-1")),
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 200)
+        transaction.refresh_from_db()
+        self.assertEqual(str(transaction.status), "0")
+        self.assertEqual(transaction.transaction_id, "RDQ01NFT1Q")
+        event_type, payload = dispatch.call_args.args
+        self.assertEqual(event_type, "express.completed")
+        self.assertEqual(payload["request_ref_id"], "ref-1")
+
+    def test_fan_out_records_a_delivery_per_accepting_subscription(self):
+        everything = WebhookSubscription.objects.create(url="https://orders.example.com/hooks", secret="s1")
+        express = WebhookSubscription.objects.create(
+            url="https://ledger.example.com/hooks", secret="s2", event_types=["express"]
+        )
+        WebhookSubscription.objects.create(url="https://stk.example.com/hooks", secret="s3", event_types=["stk"])
+        WebhookSubscription.objects.create(url="https://old.example.com/hooks", secret="s4", is_active=False)
+
+        with mock.patch.object(self.dispatcher, "submit") as submit:
+            self.dispatcher._fan_out("express.completed", {"request_ref_id": "ref-1"})
+
+        deliveries = WebhookDelivery.objects.order_by("id")
+        self.assertEqual([delivery.subscription for delivery in deliveries], [everything, express])
+        self.assertEqual(sorted(call.args[0] for call in submit.call_args_list), [d.pk for d in deliveries])
+
+    def test_delivery_is_signed(self):
+        subscription = WebhookSubscription.objects.create(url="https://orders.example.com/hooks", secret="s1")
+        delivery = WebhookDelivery.objects.create(
+            subscription=subscription, event_type="stk.completed", payload={"checkout_request_id": "ws_CO_1"}
+        )
+
+        with mock.patch.object(self.dispatcher.session, "post", return_value=subscriber_response()) as post:
+            self.assertTrue(self.dispatcher.deliver_now(delivery.pk))
+
+        headers, body = post.call_args.kwargs["headers"], post.call_args.kwargs["data"]
+        timestamp, signature = (part.split("=", 1)[1] for part in headers["X-Daraja-Signature"].split(","))
+        self.assertEqual(signature, sign_payload("s1", int(timestamp), body))
+        self.assertEqual(json.loads(body)["data"], {"checkout_request_id": "ws_CO_1"})
+        delivery.refresh_from_db()
+        self.assertEqual(str(delivery.status), "0")
+        self.assertIsNotNone(delivery.delivered_at)
+
+    def test_failed_delivery_backs_off_until_max_attempts(self):
+        subscription = WebhookSubscription.objects.create(url="https://orders.example.com/hooks", secret="s1")
+        delivery = WebhookDelivery.objects.create(subscription=subscription, event_type="stk.failed", payload={})
+
+        with mock.patch.object(self.dispatcher.session, "post", return_value=subscriber_response(ok=False)):
+            self.assertFalse(self.dispatcher.deliver_now(delivery.pk))
+            delivery.refresh_from_db()
+            self.assertEqual(str(delivery.status), "1")
+            self.assertEqual(delivery.response_code, 503)
+            self.assertGreater(delivery.next_attempt_at, timezone.now() + timedelta(seconds=1))
+
+            WebhookDelivery.objects.filter(pk=delivery.pk).update(attempts=DEFAULT_WEBHOOKS["MAX_ATTEMPTS"] - 1)
+            self.assertFalse(self.dispatcher.deliver_now(delivery.pk))
+
+        delivery.refresh_from_db()
+        self.assertEqual(str(delivery.status), "2")
+        self.assertIsNone(delivery.next_attempt_at)
+        self.assertIsNone(self.dispatcher.deliver_now(delivery.pk))
+
+
+class DeliverWebhooksCommandTests(TransactionTestCase):
+    def test_sends_due_deliveries_and_reports_the_counts(self):
+        up = WebhookSubscription.objects.create(url="https://orders.example.com/hooks", secret="s1")
+        down = WebhookSubscription.objects.create(url="https://ledger.example.com/hooks", secret="s2")
+        due = timezone.now() - timedelta(minutes=1)
+        WebhookDelivery.objects.create(subscription=up, event_type="stk.completed", payload={}, next_attempt_at=due)
+        WebhookDelivery.objects.create(subscription=down, event_type="stk.completed", payload={}, next_attempt_at=due)
+        WebhookDelivery.objects.create(
+            subscription=up, event_type="stk.completed", payload={}, next_attempt_at=timezone.now() + timedelta(hours=1)
+        )
+
+        dispatcher = WebhookDispatcher(DEFAULT_WEBHOOKS)
+        self.addCleanup(dispatcher.executor.shutdown)
+
+        def post(url, **kwargs):
+            return subscriber_response(ok=url == up.url)
+
+        stdout = StringIO()
+        with mock.patch("daraja.management.commands.deliver_webhooks.get_dispatcher", return_value=dispatcher), \
+                mock.patch.object(dispatcher.session, "post", side_effect=post):
+            call_command("deliver_webhooks", stdout=stdout)
+
+        self.assertIn("Sent 1 webhook deliveries, 1 failed, 0 no longer pending", stdout.getvalue())
+        self.assertEqual(WebhookDelivery.objects.filter(status=1).count(), 2)
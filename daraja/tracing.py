@@ -0,0 +1,225 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logging = logging.getLogger("default")
+
+_current_trace = ContextVar("daraja_trace", default=None)
+_current_span = ContextVar("daraja_span", default=None)
+
+# Ids that are known on both the outbound and the callback side, in order of preference.
+SAMPLING_KEYS = ("checkout_request_id", "originator_conversation_id", "request_ref_id", "conversation_id")
+
+DEFAULT_TRACING = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.01,
+    "EXPORTERS": ["daraja.tracing.LoggingExporter"],
+    "FILE_PATH": "traces.jsonl",
+    "PATH_PREFIX": "/daraja/",
+}
+
+
+class Span:
+    """
+    A single timed unit of work inside a trace.
+    """
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "duration_ms")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration_ms = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration_ms = round((time.time() - self.start) * 1000, 3)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "correlation": self.trace.correlation,
+        }
+
+
+class NoopSpan:
+    """
+    Returned when tracing is disabled so call sites never need to branch.
+    """
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Trace:
+    """
+    Collects the spans of one unit of work (a request, a command run) until the root span ends.
+    """
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.correlation: Dict[str, str] = {}
+
+
+class LoggingExporter:
+    """
+    Writes finished spans to the "default" logger, one JSON document per span.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+
+    def export(self, spans: List[dict]):
+        for span in spans:
+            logging.info("trace %s", json.dumps(span, default=str))
+
+
+class FileExporter:
+    """
+    Appends finished spans to a local JSON lines file.
+    """
+    def __init__(self, config: dict):
+        self.path = config["FILE_PATH"]
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        with self._lock:
+            with open(self.path, "a") as trace_file:
+                trace_file.write(lines)
+
+
+class Tracer:
+    """
+    Emits spans for view handling, serialization, token fetches, outbound HTTP and DB writes.
+
+    Traces are linked across workers through the Daraja correlation ids (CheckoutRequestID,
+    ConversationID, OriginatorConversationID). The sampling decision is taken when a trace
+    finishes and is derived from those ids, so a checkout and its callback are either both
+    exported or both dropped.
+    """
+    def __init__(self):
+        self._config = None
+        self._exporters = None
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        if self._config is None:
+            self._config = {**DEFAULT_TRACING, **getattr(settings, "DARAJA_TRACING", {})}
+        return self._config
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config["ENABLED"])
+
+    @property
+    def exporters(self) -> list:
+        if self._exporters is None:
+            with self._lock:
+                if self._exporters is None:
+                    self._exporters = [import_string(path)(self.config) for path in self.config["EXPORTERS"]]
+        return self._exporters
+
+    def reset(self):
+        """
+        Drops the cached configuration and exporters, e.g. after settings change in tests.
+        """
+        self._config = None
+        self._exporters = None
+
+    def current_span(self):
+        return _current_span.get() or NOOP_SPAN
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Opens a span as a child of the current one, starting a new trace if there is none.
+        Args:
+            name (str): The name of the operation, e.g. "http.outbound".
+            **attributes: Initial attributes recorded on the span.
+        Yields:
+            Span: The open span, or a no-op span when tracing is disabled.
+        """
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        trace = _current_trace.get()
+        trace_token = None
+        if trace is None:
+            trace = Trace()
+            trace_token = _current_trace.set(trace)
+
+        parent = _current_span.get()
+        span = Span(trace, name, parent.span_id if parent else None, attributes)
+        span_token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.set_attribute("error", repr(e))
+            raise
+        finally:
+            span.end()
+            trace.spans.append(span)
+            _current_span.reset(span_token)
+            if trace_token is not None:
+                _current_trace.reset(trace_token)
+                self._finish(trace)
+
+    def correlate(self, **ids):
+        """
+        Links the current trace to Daraja correlation ids. Empty values are ignored.
+        Args:
+            **ids: e.g. checkout_request_id, conversation_id, originator_conversation_id.
+        """
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.correlation.update({key: str(value) for key, value in ids.items() if value})
+
+    def should_sample(self, trace: Trace) -> bool:
+        rate = float(self.config["SAMPLE_RATE"])
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        for key in SAMPLING_KEYS:
+            if key in trace.correlation:
+                return zlib.crc32(trace.correlation[key].encode()) % 10000 < rate * 10000
+        return random.random() < rate
+
+    def _finish(self, trace: Trace):
+        if not self.should_sample(trace):
+            return
+        spans = [span.to_dict() for span in trace.spans]
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                logging.error("Trace export failed {}".format(e))
+
+
+tracer = Tracer()
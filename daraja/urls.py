@@ -2,7 +2,11 @@ from django.urls import path
 
 from daraja.views import (
     STKCheckout, STKCallBack, B2CCheckout, B2CCallBack, C2BConfirmationCallBack, B2BCheckout, B2BCallBack, DynamicQRView,
-    B2CTopup, B2CTopUpCallback, B2BExpressCallBack, B2BExpressCheckout
+    B2CTopup, B2CTopUpCallback, B2BExpressCallBack, B2BExpressCheckout, STKTransactionList, STKTransactionDetail,
+    B2CTransactionList, B2CTransactionDetail, B2BTransactionList, B2BTransactionDetail, B2CTopupList, B2CTopupDetail,
+    B2BExpressTransactionList, B2BExpressTransactionDetail, transaction_status_wait, transaction_status_events,
+    DailyTransactionReport, AccountBalanceReport, LedgerBalanceReport, CampaignDetail, CampaignPause, WorkerMetrics,
+    TransactionExport
 )
 
 urlpatterns = [
@@ -17,5 +21,27 @@ urlpatterns = [
     path("b2c/topup/", B2CTopup.as_view(), name="b2b send money"),
     path("b2c/topup/callback/", B2CTopUpCallback.as_view(), name='b2c top upcall back'),
     path("b2b/express/", B2BExpressCheckout.as_view()),
-    path("b2b/express/callback/", B2BExpressCallBack.as_view())
+    path("b2b/express/callback/", B2BExpressCallBack.as_view()),
+    path("transactions/stk/", STKTransactionList.as_view(), name="stk transactions"),
+    path("transactions/stk/<str:checkout_request_id>/", STKTransactionDetail.as_view(), name="stk transaction"),
+    path("transactions/b2c/", B2CTransactionList.as_view(), name="b2c transactions"),
+    path("transactions/b2c/<str:conversation_id>/", B2CTransactionDetail.as_view(), name="b2c transaction"),
+    path("transactions/b2b/", B2BTransactionList.as_view(), name="b2b transactions"),
+    path("transactions/b2b/<str:conversation_id>/", B2BTransactionDetail.as_view(), name="b2b transaction"),
+    path("transactions/topup/", B2CTopupList.as_view(), name="b2c topups"),
+    path("transactions/topup/<str:conversation_id>/", B2CTopupDetail.as_view(), name="b2c topup"),
+    path("transactions/express/", B2BExpressTransactionList.as_view(), name="b2b express transactions"),
+    path(
+        "transactions/express/<str:request_ref_id>/", B2BExpressTransactionDetail.as_view(),
+        name="b2b express transaction"
+    ),
+    path("status/<str:kind>/<str:key>/wait/", transaction_status_wait, name="transaction status wait"),
+    path("status/<str:kind>/<str:key>/events/", transaction_status_events, name="transaction status events"),
+    path("reports/daily/", DailyTransactionReport.as_view(), name="daily transaction report"),
+    path("reports/balances/", AccountBalanceReport.as_view(), name="account balance report"),
+    path("reports/ledger/", LedgerBalanceReport.as_view(), name="ledger balance report"),
+    path("exports/<str:kind>/", TransactionExport.as_view(), name="transaction export"),
+    path("campaigns/<int:pk>/", CampaignDetail.as_view(), name="campaign"),
+    path("campaigns/<int:pk>/pause/", CampaignPause.as_view(), name="pause campaign"),
+    path("metrics/workers/", WorkerMetrics.as_view(), name="worker metrics"),
 ]
@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import Throttled
+
+from daraja.msisdn import InvalidMSISDN, normalize
+
+logging = logging.getLogger("default")
+
+DEFAULT_VELOCITY = {
+    "ENABLED": False,
+    # LocalCounter counts per worker process, CacheCounter across processes through the shared cache.
+    "BACKEND": "daraja.velocity.LocalCounter",
+    # Each rule: NAME, OPERATIONS ("stk", "b2c"), KEY ("msisdn" or "short_code"), WINDOW in seconds and a
+    # LIMIT on the number of requests and/or an AMOUNT_LIMIT on their total amount within the window.
+    "RULES": [],
+    # Keys a LocalCounter keeps per rule before dropping expired ones.
+    "MAX_KEYS": 100000,
+}
+
+
+class VelocityLimitExceeded(Throttled):
+    default_detail = "Too many payments, retry later."
+    default_code = "velocity_limit"
+
+
+class Rule(NamedTuple):
+    name: str
+    operations: Tuple[str, ...]
+    key: str
+    window: int
+    limit: Optional[int]
+    amount_limit: Optional[int]
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Rule":
+        return cls(
+            config["NAME"], tuple(config["OPERATIONS"]), config["KEY"], int(config["WINDOW"]),
+            config.get("LIMIT"), config.get("AMOUNT_LIMIT"),
+        )
+
+
+class Hit(NamedTuple):
+    rule: Rule
+    key: str
+    amount: int
+    at: float
+
+
+def weighted(previous: int, current: int, elapsed: float) -> float:
+    """
+    Sliding window estimate from two fixed windows: the previous window's total counts for the part of it
+    that still overlaps the sliding window.
+    """
+    return previous * (1 - elapsed) + current
+
+
+class LocalCounter:
+    """
+    Sliding window counters in process memory. Each key keeps the totals of the current and previous fixed
+    window, so a check is a dictionary lookup under a lock. Limits apply per worker process.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self._windows: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, rule: Rule, key: str, amount: int, now: float) -> bool:
+        """
+        Counts a request and its amount against the rule unless that would exceed it.
+        Returns:
+            bool: Whether the request is within the rule.
+        """
+        window = int(now // rule.window)
+        elapsed = (now % rule.window) / rule.window
+        with self._lock:
+            state = self._windows.get((rule.name, key))
+            if state is None or state[0] < window - 1:
+                state = [window, 0, 0, 0, 0]
+            elif state[0] == window - 1:
+                state = [window, 0, 0, state[1], state[2]]
+            _, count, total, previous_count, previous_total = state
+            if rule.limit is not None and weighted(previous_count, count, elapsed) + 1 > rule.limit:
+                return False
+            if rule.amount_limit is not None and weighted(previous_total, total, elapsed) + amount > rule.amount_limit:
+                return False
+            state[1], state[2] = count + 1, total + amount
+            if len(self._windows) >= self.config["MAX_KEYS"] and (rule.name, key) not in self._windows:
+                self._expire(now)
+            self._windows[(rule.name, key)] = state
+        return True
+
+    def release(self, rule: Rule, key: str, amount: int, now: float):
+        """
+        Takes back a hit counted at now.
+        """
+        with self._lock:
+            state = self._windows.get((rule.name, key))
+            if state is not None and state[0] == int(now // rule.window):
+                state[1], state[2] = state[1] - 1, state[2] - amount
+
+    def _expire(self, now: float):
+        rules = {rule["NAME"]: int(rule["WINDOW"]) for rule in self.config["RULES"]}
+        for name, key in list(self._windows):
+            window = rules.get(name)
+            if window is None or self._windows[(name, key)][0] < int(now // window) - 1:
+                del self._windows[(name, key)]
+
+
+class CacheCounter(LocalCounter):
+    """
+    Sliding window counters in the shared cache, so limits hold across worker processes. A check reads both
+    windows in one get_many and counts the hit with an atomic incr; a hit that raced past the limit is taken
+    back. Use a cache with atomic incr, such as Redis or Memcached.
+    """
+    def cache_key(self, rule: Rule, key: str, window: int, field: str) -> str:
+        return "daraja:velocity:{}:{}:{}:{}".format(rule.name, key, window, field)
+
+    def hit(self, rule: Rule, key: str, amount: int, now: float) -> bool:
+        window = int(now // rule.window)
+        elapsed = (now % rule.window) / rule.window
+        keys = {
+            (offset, field): self.cache_key(rule, key, window - offset, field)
+            for offset in (0, 1) for field in ("count", "amount")
+        }
+        values = cache.get_many(keys.values())
+        count, total, previous_count, previous_total = (
+            values.get(keys[offset, field], 0)
+            for offset, field in ((0, "count"), (0, "amount"), (1, "count"), (1, "amount"))
+        )
+        if rule.limit is not None and weighted(previous_count, count, elapsed) + 1 > rule.limit:
+            return False
+        if rule.amount_limit is not None and weighted(previous_total, total, elapsed) + amount > rule.amount_limit:
+            return False
+
+        # Counters outlive the window they count in, as the previous window of the next one.
+        timeout = rule.window * 2
+        cache.add(keys[0, "count"], 0, timeout)
+        cache.add(keys[0, "amount"], 0, timeout)
+        count = cache.incr(keys[0, "count"])
+        total = cache.incr(keys[0, "amount"], amount) if amount else total
+        if (rule.limit is not None and weighted(previous_count, count, elapsed) > rule.limit) or (
+                rule.amount_limit is not None and weighted(previous_total, total, elapsed) > rule.amount_limit):
+            self.release(rule, key, amount, now)
+            return False
+        return True
+
+    def release(self, rule: Rule, key: str, amount: int, now: float):
+        window = int(now // rule.window)
+        try:
+            cache.decr(self.cache_key(rule, key, window, "count"))
+            if amount:
+                cache.decr(self.cache_key(rule, key, window, "amount"), amount)
+        except ValueError:
+            # The counter expired in between.
+            pass
+
+
+class VelocityLimiter:
+    """
+    Per MSISDN and per shortcode velocity limits on outbound payments and pushes, e.g. at most 3 B2C payouts
+    to one number an hour. Checked before the transaction is recorded or Safaricom is called, from counters
+    kept in memory or the shared cache rather than COUNT queries on the transaction tables.
+    """
+    def __init__(self):
+        self._backend = None
+        self._rules = None
+        self._lock = threading.Lock()
+
+    @property
+    def config(self) -> dict:
+        return {**DEFAULT_VELOCITY, **getattr(settings, "DARAJA_VELOCITY", {})}
+
+    @property
+    def backend(self) -> LocalCounter:
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    config = self.config
+                    self._backend = import_string(config["BACKEND"])(config)
+        return self._backend
+
+    @property
+    def rules(self) -> List[Rule]:
+        if self._rules is None:
+            self._rules = [Rule.from_config(rule) for rule in self.config["RULES"]]
+        return self._rules
+
+    def check(self, operation: str, amount, msisdn=None, short_code=None) -> List[Hit]:
+        """
+        Counts a request against every rule for the operation.
+        Args:
+            operation (str): "stk" or "b2c".
+            amount (int): The amount of the request.
+            msisdn (str, optional): The customer's phone number, in any format.
+            short_code (str, optional): The business shortcode the request is made from.
+        Returns:
+            List[Hit]: The counted hits, to release() if the request then fails.
+        Raises:
+            VelocityLimitExceeded: When a rule would be exceeded. The request is then not counted.
+        """
+        rules = [rule for rule in self.rules if operation in rule.operations]
+        if not rules or not self.config["ENABLED"]:
+            return []
+        keys = {"short_code": str(short_code) if short_code else None, "msisdn": None}
+        if msisdn:
+            try:
+                keys["msisdn"] = normalize(msisdn)
+            except InvalidMSISDN:
+                keys["msisdn"] = str(msisdn)
+
+        now, amount, counted = time.time(), int(amount), []
+        for rule in rules:
+            key = keys.get(rule.key)
+            if key is None:
+                continue
+            if not self.backend.hit(rule, key, amount, now):
+                self.release(counted)
+                logging.warning("Velocity rule {} rejected {} of {} for {}".format(rule.name, operation, amount, key))
+                raise VelocityLimitExceeded(
+                    wait=int(rule.window - now % rule.window) + 1,
+                    detail="Velocity limit {} exceeded, retry later.".format(rule.name),
+                )
+            counted.append(Hit(rule, key, amount, now))
+        return counted
+
+    def release(self, hits: List[Hit]):
+        """
+        Takes back hits counted by check(), e.g. when Safaricom could not be called or rejected the request,
+        so failed requests do not use up a customer's limit.
+        """
+        for hit in hits:
+            self.backend.release(hit.rule, hit.key, hit.amount, hit.at)
+
+
+velocity = VelocityLimiter()
@@ -1,25 +1,62 @@
+import datetime
+import functools
 import json
-
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import status
-from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import APIException, NotAuthenticated, ValidationError
+from rest_framework.generics import ListAPIView, RetrieveAPIView
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
 from daraja.gateway.b2b import B2B
 from daraja.gateway.b2c import B2C
-from daraja.gateway.c2b import C2B
+from daraja.gateway.c2b import NAIROBI, C2B
 from daraja.gateway.dynamicqr import DynamicQR
 from daraja.serializers import (
     STKTransactionSerializer, STKCheckoutSerializer, B2CCheckoutSerializer, B2BCheckoutSerializer,
-    B2BTransactionSerializer, DynamicQRInputSerializer, B2CTopupInputSerializer, B2BExpressCheckoutSerializer
+    B2BTransactionSerializer, DynamicQRInputSerializer, B2CTopupInputSerializer, B2BExpressCheckoutSerializer,
+    STKTransactionReadSerializer, B2CTransactionReadSerializer, B2BTransactionReadSerializer, B2CTopupReadSerializer,
+    B2BExpressTransactionReadSerializer, READ_SERIALIZERS, DailyTransactionAggregateSerializer,
+    KnownBalanceSerializer, CampaignSerializer, LedgerAccountSerializer
+)
+from daraja.events import TRANSACTION_TYPE_IDS
+from daraja.models import Campaign, DailyTransactionAggregate
+from daraja.campaigns import CampaignRunner
+from daraja.balances import balance_tracker
+from daraja.ledger import ledger
+from daraja.export import export_filters, iter_csv, iter_rows
+from daraja.caching import (
+    LOOKUP_FIELDS, archived_transaction, get_cached_transaction, set_cached_transaction, transaction_etag
 )
+from daraja.notifier import get_notifier, status_message
+from daraja.idempotency import idempotent
+from daraja.admission import admission
+from daraja.lanes import CALLBACKS, OUTBOUND, lanes
+from daraja.pagination import KeysetPagination
+from daraja.routers import read_replica_alias
+from daraja.sharding import sharding
+from daraja.tracing import tracer
 
 class STKCheckout(APIView):
     permission_classes = (AllowAny,)
 
+    @idempotent
+    @admission.admit("stk_push")
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = STKCheckoutSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="STKCheckoutSerializer"):
+            serializer.is_valid(raise_exception=True)
         c2b = C2B()
         response = c2b.stk_push(request=request, **serializer.validated_data)
         return Response(response)
@@ -31,19 +68,26 @@ class STKCallBack(APIView):
     def get(self):
         return Response({"status": "OK"}, status=status.HTTP_200_OK)
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         c2b = C2B()
         response = c2b.stk_callback_handler(json.loads(data))
-        return Response(STKTransactionSerializer(response).data, status=status.HTTP_200_OK)
+        with tracer.span("serialize", serializer="STKTransactionSerializer"):
+            response_data = STKTransactionSerializer(response).data
+        return Response(response_data, status=status.HTTP_200_OK)
 
 
 class B2CCheckout(APIView):
     permission_classes = (AllowAny,)
 
+    @idempotent
+    @admission.admit("b2c")
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = B2CCheckoutSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="B2CCheckoutSerializer"):
+            serializer.is_valid(raise_exception=True)
         b2c = B2C()
         response = b2c.b2c_send(request=request, **serializer.validated_data)
         return Response(response)
@@ -55,6 +99,7 @@ class B2CCallBack(APIView):
     def get(self):
         return Response({"status": "OK"}, status=status.HTTP_200_OK)
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         b2c = B2C()
@@ -69,6 +114,7 @@ class B2CCallBack(APIView):
 class C2BConfirmationCallBack(APIView):
     permission_classes = (AllowAny,)
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         c2b = C2B()
@@ -79,9 +125,13 @@ class C2BConfirmationCallBack(APIView):
 class B2BCheckout(APIView):
     permission_classes = (AllowAny,)
 
+    @idempotent
+    @admission.admit("b2b")
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = B2BCheckoutSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="B2BCheckoutSerializer"):
+            serializer.is_valid(raise_exception=True)
         b2b = B2B()
         response = b2b.b2b_send(request=request, **serializer.validated_data)
         return Response(response)
@@ -93,6 +143,7 @@ class B2BCallBack(APIView):
     def get(self):
         return Response({"status": "OK"}, status=status.HTTP_200_OK)
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         b2b = B2B()
@@ -107,9 +158,11 @@ class B2BCallBack(APIView):
 class DynamicQRView(APIView):
     permission_classes = (AllowAny, )
 
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = DynamicQRInputSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="DynamicQRInputSerializer"):
+            serializer.is_valid(raise_exception=True)
         dynamic_qr = DynamicQR()
         response = dynamic_qr.generate_qr(**serializer.validated_data)
         return Response(response, status=status.HTTP_200_OK)
@@ -118,9 +171,13 @@ class DynamicQRView(APIView):
 class B2CTopup(APIView):
     permission_classes = (AllowAny, )
 
+    @idempotent
+    @admission.admit("b2c_topup")
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = B2CTopupInputSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="B2CTopupInputSerializer"):
+            serializer.is_valid(raise_exception=True)
         b2c = B2C()
         response = b2c.b2c_top_up(request=request, **serializer.validated_data)
         return Response(response, status=status.HTTP_200_OK)
@@ -129,6 +186,7 @@ class B2CTopup(APIView):
 class B2CTopUpCallback(APIView):
     permission_classes = (AllowAny, )
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         b2c = B2C()
@@ -144,9 +202,13 @@ class B2CTopUpCallback(APIView):
 class B2BExpressCheckout(APIView):
     permission_classes = (AllowAny,)
 
+    @idempotent
+    @admission.admit("b2b_express")
+    @lanes.run_in(OUTBOUND)
     def post(self, request):
         serializer = B2BExpressCheckoutSerializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with tracer.span("serialize", serializer="B2BExpressCheckoutSerializer"):
+            serializer.is_valid(raise_exception=True)
         b2b = B2B()
         response = b2b.b2b_express_send(request=request, **serializer.validated_data)
         return Response(response)
@@ -158,6 +220,7 @@ class B2BExpressCallBack(APIView):
     def get(self):
         return Response({"status": "OK"}, status=status.HTTP_200_OK)
 
+    @lanes.run_in(CALLBACKS)
     def post(self, request):
         data = request.body
         b2b = B2B()
@@ -166,4 +229,366 @@ class B2BExpressCallBack(APIView):
             b2b.b2b_express_callback_handler(json_data)
         except json.decoder.JSONDecodeError:
             return Response("Invalid json", status=status.HTTP_400_BAD_REQUEST)
-        return Response("Response received", status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response("Response received", status=status.HTTP_200_OK)
+
+
+class TransactionListView(ListAPIView):
+    """
+    Lists transactions newest first with keyset pagination.
+    Supports exact filters on status and the indexed ids in filter_fields, and a created_at range through
+    created_after/created_before. Only the serialized columns are loaded, from a read replica when one is
+    configured and within the lag limit.
+    """
+    permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
+    filter_fields = ()
+
+    def get_queryset(self):
+        model = self.serializer_class.Meta.model
+        queryset = model.objects.using(read_replica_alias()).only(*self.serializer_class.Meta.fields)
+        params = self.request.query_params
+
+        filters = {field: params[field] for field in ("status",) + self.filter_fields if field in params}
+        for param, lookup in (("created_after", "created_at__gte"), ("created_before", "created_at__lt")):
+            if param in params:
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: "Expected an ISO 8601 datetime"})
+                filters[lookup] = value
+        return queryset.filter(**filters)
+
+    def list(self, request, *args, **kwargs):
+        # The ETag only reads the ids and versions of the page's rows, so a 304 skips loading and serializing it.
+        etag = self.paginator.page_etag(self.filter_queryset(self.get_queryset()), request)
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response = super().list(request, *args, **kwargs)
+        response["ETag"] = etag
+        return response
+
+
+class TransactionDetailView(RetrieveAPIView):
+    """
+    Returns one transaction by the id clients poll it with, from the archive once it has been archived.
+    The serialized response is cached until the transaction is saved again, and requests carrying the
+    current ETag in If-None-Match get a 304 without touching the database.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        model = self.serializer_class.Meta.model
+        alias = sharding.locate(model, {self.lookup_field: self.kwargs[self.lookup_field]})
+        return model.objects.using(alias).only(*self.serializer_class.Meta.fields)
+
+    def retrieve(self, request, *args, **kwargs):
+        model = self.serializer_class.Meta.model
+        lookup_value = kwargs[self.lookup_field]
+        cached = get_cached_transaction(model, lookup_value)
+        if cached is None:
+            try:
+                instance = self.get_object()
+            except Http404:
+                instance = archived_transaction(model, lookup_value)
+                if instance is None:
+                    raise
+            cached = (transaction_etag(instance), dict(self.get_serializer(instance).data))
+            set_cached_transaction(model, lookup_value, *cached)
+
+        etag, data = cached
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        return Response(data, headers={"ETag": etag})
+
+
+class STKTransactionList(TransactionListView):
+    serializer_class = STKTransactionReadSerializer
+    filter_fields = ("checkout_request_id",)
+
+
+class STKTransactionDetail(TransactionDetailView):
+    serializer_class = STKTransactionReadSerializer
+    lookup_field = "checkout_request_id"
+
+
+class B2CTransactionList(TransactionListView):
+    serializer_class = B2CTransactionReadSerializer
+    filter_fields = ("conversation_id", "originator_conversation_id", "transaction_id")
+
+
+class B2CTransactionDetail(TransactionDetailView):
+    serializer_class = B2CTransactionReadSerializer
+    lookup_field = "conversation_id"
+
+
+class B2BTransactionList(TransactionListView):
+    serializer_class = B2BTransactionReadSerializer
+    filter_fields = ("conversation_id", "originator_conversation_id", "transaction_id")
+
+
+class B2BTransactionDetail(TransactionDetailView):
+    serializer_class = B2BTransactionReadSerializer
+    lookup_field = "conversation_id"
+
+
+class B2CTopupList(TransactionListView):
+    serializer_class = B2CTopupReadSerializer
+    filter_fields = ("conversation_id", "transaction_id")
+
+
+class B2CTopupDetail(TransactionDetailView):
+    """
+    conversation_id is not unique on top-ups, so the newest top-up with it is returned.
+    """
+    serializer_class = B2CTopupReadSerializer
+    lookup_field = "conversation_id"
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        instance = queryset.filter(**{self.lookup_field: self.kwargs[self.lookup_field]}).order_by(
+            "-created_at", "-id"
+        ).first()
+        if instance is None:
+            raise Http404("No B2CTopup matches the given query.")
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+
+class B2BExpressTransactionList(TransactionListView):
+    serializer_class = B2BExpressTransactionReadSerializer
+    filter_fields = ("request_ref_id", "transaction_id")
+
+
+class B2BExpressTransactionDetail(TransactionDetailView):
+    serializer_class = B2BExpressTransactionReadSerializer
+    lookup_field = "request_ref_id"
+
+
+def load_transaction_status(kind: str, key: str) -> dict:
+    serializer_class = READ_SERIALIZERS.get(kind)
+    if serializer_class is None:
+        raise Http404("Unknown transaction type")
+    model = serializer_class.Meta.model
+    alias = sharding.locate(model, {LOOKUP_FIELDS[model]: key})
+    instance = model.objects.using(alias).only(*serializer_class.Meta.fields).filter(
+        **{LOOKUP_FIELDS[model]: key}
+    ).order_by("-created_at", "-id").first()
+    if instance is None:
+        instance = archived_transaction(model, key)
+    if instance is None:
+        raise Http404("Transaction not found")
+    return status_message(kind, instance)
+
+
+def authenticated(view):
+    """
+    Authenticates a plain async view the way the IsAuthenticated API views are, with the REST framework's
+    authentication classes. Requests without valid credentials get the same 401 or 403 response.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticators = [authentication() for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        api_request = Request(request, authenticators=authenticators)
+        try:
+            user = await sync_to_async(lambda: api_request.user)()
+            if not (user and user.is_authenticated):
+                raise NotAuthenticated()
+        except APIException as e:
+            authenticate_header = authenticators[0].authenticate_header(api_request) if authenticators else None
+            response = JsonResponse(
+                {"detail": str(e.detail)},
+                status=status.HTTP_401_UNAUTHORIZED if authenticate_header else status.HTTP_403_FORBIDDEN
+            )
+            if authenticate_header:
+                response["WWW-Authenticate"] = authenticate_header
+            return response
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@authenticated
+async def transaction_status_wait(request, kind, key):
+    """
+    Long-poll for a transaction's status.
+    Returns immediately if the transaction is final, otherwise holds the request until a callback
+    updates it or the timeout (query param, capped by DARAJA_STATUS_WAIT_TIMEOUT) passes.
+    """
+    try:
+        timeout = min(float(request.GET.get("timeout", settings.DARAJA_STATUS_WAIT_TIMEOUT)),
+                      settings.DARAJA_STATUS_WAIT_TIMEOUT)
+    except ValueError:
+        timeout = settings.DARAJA_STATUS_WAIT_TIMEOUT
+
+    notifier = get_notifier()
+    subscription = notifier.subscribe(key)
+    try:
+        message = await sync_to_async(load_transaction_status)(kind, key)
+        if not message["final"]:
+            message = await notifier.wait(subscription, timeout) or message
+    finally:
+        notifier.unsubscribe(subscription)
+    return JsonResponse(message, encoder=DjangoJSONEncoder)
+
+
+@authenticated
+async def transaction_status_events(request, kind, key):
+    """
+    Server-sent events stream of a transaction's status.
+    Sends the current state, then every update pushed by the callback handlers, and closes once the
+    transaction is final or DARAJA_STATUS_STREAM_TIMEOUT passes. Comments are sent as keep-alives.
+    """
+    notifier = get_notifier()
+    subscription = notifier.subscribe(key)
+    try:
+        message = await sync_to_async(load_transaction_status)(kind, key)
+    except Http404:
+        notifier.unsubscribe(subscription)
+        raise
+
+    async def stream(subscription, message):
+        deadline = time.monotonic() + settings.DARAJA_STATUS_STREAM_TIMEOUT
+        try:
+            yield "event: status\ndata: {}\n\n".format(json.dumps(message, cls=DjangoJSONEncoder))
+            while not message["final"]:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                update = await notifier.wait(subscription, min(settings.DARAJA_STATUS_HEARTBEAT, remaining))
+                if update is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                notifier.unsubscribe(subscription)
+                subscription = notifier.subscribe(key)
+                message = update
+                yield "event: status\ndata: {}\n\n".format(json.dumps(message, cls=DjangoJSONEncoder))
+        finally:
+            notifier.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(subscription, message), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class DailyTransactionReport(APIView):
+    """
+    Daily transaction counts and totals per type and status, read from the DailyTransactionAggregate table
+    kept up to date by the refresh_daily_aggregates command, by Nairobi day. Filters: date_from, date_to
+    (default the last 30 days) and type.
+    """
+    permission_classes = (IsAuthenticated,)
+    max_days = 366
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            date_to = datetime.date.fromisoformat(params["date_to"]) if "date_to" in params else \
+                timezone.localdate(timezone=NAIROBI)
+            date_from = datetime.date.fromisoformat(params["date_from"]) if "date_from" in params else \
+                date_to - datetime.timedelta(days=29)
+        except ValueError:
+            raise ValidationError({"date": "Expected ISO 8601 dates in date_from and date_to"})
+        if date_from > date_to or (date_to - date_from).days >= self.max_days:
+            raise ValidationError({"date": "date_from must be before date_to and at most a year apart"})
+
+        rows = DailyTransactionAggregate.objects.using(read_replica_alias()).filter(
+            date__gte=date_from, date__lte=date_to
+        )
+        if "type" in params:
+            if params["type"] not in TRANSACTION_TYPE_IDS:
+                raise ValidationError({"type": "Expected one of {}".format(", ".join(TRANSACTION_TYPE_IDS))})
+            rows = rows.filter(transaction_type=TRANSACTION_TYPE_IDS[params["type"]])
+        rows = rows.order_by("date", "transaction_type", "status")
+        return Response(DailyTransactionAggregateSerializer(rows, many=True).data)
+
+
+class AccountBalanceReport(APIView):
+    """
+    The latest working, utility and other account balances reported in the result callbacks, served from
+    the balance tracker without calling the Account Balance API.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        return Response(KnownBalanceSerializer(balance_tracker.all(), many=True).data)
+
+
+class LedgerBalanceReport(APIView):
+    """
+    The balance of every ledger account, debits minus credits, read from the running balances kept as
+    postings are written. Pass at (an ISO datetime) for the balances at that time.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        at = None
+        if "at" in request.query_params:
+            at = parse_datetime(request.query_params["at"])
+            if at is None:
+                raise ValidationError({"at": "Expected an ISO 8601 datetime"})
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        return Response(LedgerAccountSerializer(ledger.balances(at), many=True).data)
+
+
+class TransactionExport(APIView):
+    """
+    Streams every transaction of a type as CSV, oldest first, including archived ones. The rows are read
+    through server-side cursors and written as they arrive, so an export of months of transactions neither
+    loads them into memory nor waits for the whole file before sending. Filters: status, created_after and
+    created_before.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, kind):
+        if kind not in READ_SERIALIZERS:
+            raise Http404("Unknown transaction type")
+        params = request.query_params
+        dates = {}
+        for param in ("created_after", "created_before"):
+            if param in params:
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: "Expected an ISO 8601 datetime"})
+                dates[param] = timezone.make_aware(value) if timezone.is_naive(value) else value
+        filters = export_filters(params.get("status"), **dates)
+
+        response = StreamingHttpResponse(iter_csv(kind, iter_rows(kind, filters)), content_type="text/csv")
+        response["Content-Disposition"] = 'attachment; filename="{}-transactions.csv"'.format(kind)
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class CampaignDetail(RetrieveAPIView):
+    """
+    Live progress counters of a bulk STK push campaign.
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = CampaignSerializer
+    queryset = Campaign.objects.all()
+
+
+class CampaignPause(APIView):
+    """
+    Pauses a running campaign. The runner stops after the pushes in flight; run_campaign resumes it.
+    """
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, pk):
+        campaign = Campaign.objects.filter(pk=pk).first()
+        if campaign is None:
+            raise Http404
+        CampaignRunner(campaign).pause()
+        campaign.refresh_from_db()
+        return Response(CampaignSerializer(campaign).data)
+
+
+class WorkerMetrics(APIView):
+    """
+    Per-lane request and latency metrics and per-endpoint admission counters of the worker process that
+    serves the request.
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({"lanes": lanes.snapshot(), "admission": admission.snapshot()})
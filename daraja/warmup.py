@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+logging = logging.getLogger("default")
+
+DEFAULT_WARMUP = {
+    "ENABLED": False,
+    "TOKEN": True,
+    "CONNECTIONS": 2,
+    "PARSERS": True,
+    "TIMEOUT": 10,
+}
+
+
+def get_config() -> dict:
+    return {**DEFAULT_WARMUP, **getattr(settings, "DARAJA_WARMUP", {})}
+
+
+def load_views():
+    """
+    Imports the URLconf and with it the views, gateways and DRF, which otherwise happens on the first request.
+    """
+    from django.urls import get_resolver
+
+    get_resolver().url_patterns
+
+
+def compile_parsers():
+    """
+    Loads what the request path would otherwise load on first use: the Kenyan libphonenumber metadata and
+    the fields of the checkout and read serializers.
+    """
+    from daraja import serializers
+    from daraja.msisdn import to_phone_number
+
+    to_phone_number("+254712345678")
+    for serializer_class in (
+        serializers.STKCheckoutSerializer, serializers.B2CCheckoutSerializer, serializers.B2BCheckoutSerializer,
+        serializers.B2CTopupInputSerializer, serializers.B2BExpressCheckoutSerializer,
+        serializers.DynamicQRInputSerializer, *serializers.READ_SERIALIZERS.values(),
+    ):
+        serializer_class().fields
+
+
+def prefetch_token():
+    from daraja.gateway.base import MpesaBase
+
+    MpesaBase().get_access_token()
+
+
+def open_connections(count: int, timeout: float):
+    """
+    Opens count keep-alive connections to the Daraja host in the shared session's pool.
+    """
+    from daraja.gateway.base import get_session
+
+    parts = urlsplit(settings.MPESA_ACCESS_TOKEN_URL)
+    origin = "{}://{}/".format(parts.scheme, parts.netloc)
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix="daraja-warmup") as executor:
+        for response in executor.map(lambda _: session.head(origin, timeout=timeout), range(count)):
+            response.close()
+
+
+def warm_up(config: dict = None) -> dict:
+    """
+    Runs the warm-up steps in order and returns how long each took. A step that fails is logged and
+    skipped; a worker must start even when Daraja cannot be reached.
+    """
+    config = config or get_config()
+    steps = [("views", load_views)]
+    if config["PARSERS"]:
+        steps.append(("parsers", compile_parsers))
+    if config["TOKEN"]:
+        steps.append(("token", prefetch_token))
+    if config["CONNECTIONS"]:
+        steps.append(("connections", lambda: open_connections(config["CONNECTIONS"], config["TIMEOUT"])))
+
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logging.warning("Warm-up step {} failed {}".format(name, e))
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def warm_up_on_boot():
+    """
+    Called from MpesaConfig.ready(). Warms the worker up before it serves traffic, giving up after TIMEOUT
+    seconds so that a slow Daraja does not hold the worker back.
+    """
+    config = get_config()
+    if not config["ENABLED"]:
+        return
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(warm_up(config)), name="daraja-warmup", daemon=True
+    )
+    started = time.perf_counter()
+    thread.start()
+    thread.join(config["TIMEOUT"])
+    if thread.is_alive():
+        logging.warning("Warm-up still running after {}s, serving traffic without it".format(config["TIMEOUT"]))
+        return
+    logging.info("Warmed up in {:.3f}s {}".format(
+        time.perf_counter() - started, ", ".join("{} {:.3f}s".format(*timing) for timing in result.items())
+    ))
@@ -0,0 +1,220 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+import requests
+from requests.adapters import HTTPAdapter
+
+from daraja.models import WebhookDelivery, WebhookSubscription
+from daraja.serializers import READ_SERIALIZERS, transaction_kind
+from daraja.signals import is_replaying, transaction_updated
+
+logging = logging.getLogger("default")
+
+DEFAULT_WEBHOOKS = {
+    "MAX_WORKERS": 8,
+    "TIMEOUT": 10,
+    "MAX_ATTEMPTS": 8,
+    "BACKOFF_BASE": 2,
+    "BACKOFF_MAX": 3600,
+}
+
+EVENT_STATUS_NAMES = {"0": "completed", "1": "pending", "2": "failed"}
+
+
+def sign_payload(secret: str, timestamp: int, body: str) -> str:
+    """
+    Signs a delivery body. Receivers recompute HMAC-SHA256 over "<timestamp>.<body>" with their secret
+    and compare it with the v1 value of the X-Daraja-Signature header.
+    """
+    message = "{}.{}".format(timestamp, body).encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+class WebhookDispatcher:
+    """
+    Delivers transaction events to the registered WebhookSubscriptions.
+
+    Events are fanned out on a shared thread pool, so the callback request that produced them does no
+    extra work. Every delivery is persisted in WebhookDelivery before it is sent; sends reuse pooled
+    connections, are limited to max_concurrency in flight per subscription and are retried with
+    exponential backoff until MAX_ATTEMPTS. Pending deliveries whose retry timer was lost with the
+    process are picked up by the deliver_webhooks management command.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.executor = ThreadPoolExecutor(max_workers=config["MAX_WORKERS"], thread_name_prefix="daraja-webhook")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=config["MAX_WORKERS"], pool_maxsize=config["MAX_WORKERS"])
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def dispatch(self, event_type: str, payload: dict):
+        """
+        Queues an event for every active subscription that accepts it.
+        """
+        self.executor.submit(self._fan_out, event_type, payload)
+
+    def submit(self, delivery_id: int, delay: float = 0):
+        if delay > 0:
+            timer = threading.Timer(delay, self.submit, args=(delivery_id,))
+            timer.daemon = True
+            timer.start()
+            return
+        self.executor.submit(self._deliver, delivery_id)
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.config["BACKOFF_BASE"] ** attempts, self.config["BACKOFF_MAX"])
+
+    def _fan_out(self, event_type: str, payload: dict):
+        close_old_connections()
+        try:
+            subscriptions = [
+                subscription for subscription in WebhookSubscription.objects.filter(is_active=True)
+                if subscription.accepts(event_type)
+            ]
+            deliveries: List[WebhookDelivery] = WebhookDelivery.objects.bulk_create([
+                WebhookDelivery(subscription=subscription, event_type=event_type, payload=payload)
+                for subscription in subscriptions
+            ])
+        except Exception as e:
+            logging.error("Webhook fan out failed for {} {}".format(event_type, e))
+            return
+        finally:
+            close_old_connections()
+        for delivery in deliveries:
+            self.submit(delivery.pk)
+
+    def _acquire(self, subscription: WebhookSubscription) -> bool:
+        with self._lock:
+            if self._in_flight[subscription.pk] >= subscription.max_concurrency:
+                return False
+            self._in_flight[subscription.pk] += 1
+            return True
+
+    def _release(self, subscription: WebhookSubscription):
+        with self._lock:
+            self._in_flight[subscription.pk] -= 1
+
+    def _deliver(self, delivery_id: int):
+        close_old_connections()
+        try:
+            delivery = WebhookDelivery.objects.select_related("subscription").get(pk=delivery_id)
+            if str(delivery.status) != "1":
+                return
+            subscription = delivery.subscription
+            if not self._acquire(subscription):
+                # The subscriber is at its concurrency limit, try again shortly without holding a worker.
+                self.submit(delivery_id, delay=0.1)
+                return
+            try:
+                self._send(delivery)
+            finally:
+                self._release(subscription)
+        except Exception as e:
+            logging.error("Webhook delivery {} failed {}".format(delivery_id, e))
+        finally:
+            close_old_connections()
+
+    def deliver_now(self, delivery_id: int) -> Optional[bool]:
+        """
+        Sends a pending delivery on the calling thread. Unlike submit(), it waits for a free slot under the
+        subscription's concurrency limit and does not schedule a retry timer when the send fails; the
+        delivery keeps its next_attempt_at for the next run of the deliver_webhooks command.
+        Returns:
+            Optional[bool]: Whether it was delivered, or None if it was no longer pending.
+        """
+        close_old_connections()
+        try:
+            delivery = WebhookDelivery.objects.select_related("subscription").get(pk=delivery_id)
+            if str(delivery.status) != "1":
+                return None
+            subscription = delivery.subscription
+            while not self._acquire(subscription):
+                time.sleep(0.1)
+            try:
+                return self._send(delivery, retry=False)
+            finally:
+                self._release(subscription)
+        except Exception as e:
+            logging.error("Webhook delivery {} failed {}".format(delivery_id, e))
+            return False
+        finally:
+            close_old_connections()
+
+    def _send(self, delivery: WebhookDelivery, retry: bool = True) -> bool:
+        subscription = delivery.subscription
+        body = json.dumps(
+            {"id": str(delivery.event_id), "type": delivery.event_type, "data": delivery.payload},
+            cls=DjangoJSONEncoder
+        )
+        timestamp = int(time.time())
+        headers = {
+            "Content-Type": "application/json",
+            "X-Daraja-Event": delivery.event_type,
+            "X-Daraja-Delivery": str(delivery.event_id),
+            "X-Daraja-Signature": "t={},v1={}".format(timestamp, sign_payload(subscription.secret, timestamp, body)),
+        }
+
+        delivery.attempts += 1
+        try:
+            response = self.session.post(subscription.url, data=body, headers=headers, timeout=self.config["TIMEOUT"])
+            delivery.response_code = response.status_code
+            delivery.last_error = None if response.ok else response.text[:1000]
+            delivered = response.ok
+        except requests.RequestException as e:
+            delivery.last_error = str(e)
+            delivered = False
+
+        if delivered:
+            delivery.status = 0
+            delivery.delivered_at = timezone.now()
+            delivery.next_attempt_at = None
+        elif delivery.attempts >= self.config["MAX_ATTEMPTS"]:
+            delivery.status = 2
+            delivery.next_attempt_at = None
+        else:
+            delay = self.backoff(delivery.attempts)
+            delivery.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            if retry:
+                self.submit(delivery.pk, delay=delay)
+        delivery.save(update_fields=[
+            "status", "attempts", "response_code", "last_error", "next_attempt_at", "delivered_at", "updated_at"
+        ])
+        return delivered
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> WebhookDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = WebhookDispatcher({**DEFAULT_WEBHOOKS, **getattr(settings, "DARAJA_WEBHOOKS", {})})
+    return _dispatcher
+
+
+@receiver(transaction_updated)
+def dispatch_transaction_webhooks(sender, instance, previous_status=None, **kwargs):
+    if is_replaying() or str(instance.status) == str(previous_status):
+        return
+    kind = transaction_kind(sender)
+    event_type = "{}.{}".format(kind, EVENT_STATUS_NAMES.get(str(instance.status), "updated"))
+    get_dispatcher().dispatch(event_type, dict(READ_SERIALIZERS[kind](instance).data))
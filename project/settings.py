@@ -54,6 +54,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'daraja.middleware.TracingMiddleware',
+    'daraja.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'project.urls'
@@ -91,6 +93,32 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DATABASE_REPLICA_HOSTS=replica1.internal,replica2.internal. They share the primary's
+# credentials and are only read through daraja.routers (admin, list endpoints, reports).
+DATABASE_REPLICA_HOSTS = config("DATABASE_REPLICA_HOSTS", "", cast=lambda value: [h for h in value.split(",") if h])
+for index, host in enumerate(DATABASE_REPLICA_HOSTS, start=1):
+    DATABASES["replica_{}".format(index)] = {
+        **DATABASES["default"], "HOST": host, "TEST": {"MIRROR": "default"},
+    }
+
+# Transaction shards by shortcode, e.g. DATABASE_SHARDS=shard_1=db1.internal:600100|600101,shard_2=db2.internal:600200.
+# Shortcodes not listed stay on the default database. Run migrate --database and prepare_shards for each new shard,
+# see daraja/sharding.py.
+DATABASE_SHARDS = config("DATABASE_SHARDS", "", cast=lambda value: [s for s in value.split(",") if s])
+DARAJA_SHARDING = {
+    "ENABLED": bool(DATABASE_SHARDS),
+    "SHARDS": {},
+    "LOCATE_TTL": config("DARAJA_SHARDING_LOCATE_TTL", 7 * 24 * 3600, cast=int),
+}
+for index, shard in enumerate(DATABASE_SHARDS, start=1):
+    alias, _, location = shard.partition("=")
+    host, _, keys = location.partition(":")
+    DATABASES[alias] = {**DATABASES["default"], "HOST": host}
+    # Ids on each shard start at their own offset, so a transaction's type and id identify it across shards.
+    DARAJA_SHARDING["SHARDS"][alias] = {"KEYS": [key for key in keys.split("|") if key], "ID_OFFSET": index * 10 ** 12}
+
+DATABASE_ROUTERS = ["daraja.sharding.ShardRouter", "daraja.routers.ReplicaRouter"]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -177,4 +205,182 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
     }
-}
\ No newline at end of file
+}
+
+# Request tracing across checkouts and callbacks, see daraja/tracing.py
+DARAJA_TRACING = {
+    "ENABLED": config("DARAJA_TRACING_ENABLED", False, cast=bool),
+    "SAMPLE_RATE": config("DARAJA_TRACING_SAMPLE_RATE", 0.01, cast=float),
+    "EXPORTERS": config(
+        "DARAJA_TRACING_EXPORTERS", "daraja.tracing.LoggingExporter", cast=lambda v: [s.strip() for s in v.split(',')]
+    ),
+    "FILE_PATH": config("DARAJA_TRACING_FILE_PATH", str(BASE_DIR / "traces.jsonl")),
+}
+
+# Opt-in per-view profiling and query budgets, see daraja/middleware.py
+DARAJA_PROFILING = {
+    "ENABLED": config("DARAJA_PROFILING_ENABLED", False, cast=bool),
+    "STRICT": config("DARAJA_PROFILING_STRICT", False, cast=bool),
+    "QUERY_BUDGETS": {
+        "STKCallBack": 2,
+        "B2CCallBack": 3,
+        "B2BCallBack": 3,
+        "B2CTopUpCallback": 3,
+        "B2BExpressCallBack": 3,
+        "STKCheckout": 1,
+        "B2CCheckout": 1,
+        "B2BCheckout": 1,
+    },
+    "SLOW_REQUEST_MS": config("DARAJA_PROFILING_SLOW_REQUEST_MS", 1000, cast=int),
+    "PROFILE_SAMPLE_RATE": config("DARAJA_PROFILING_SAMPLE_RATE", 0.0, cast=float),
+    "PROFILE_DIR": config("DARAJA_PROFILING_DIR", str(BASE_DIR / "profiles")),
+}
+
+# Completion of transaction intent rows, see daraja/outbox.py. ASYNC completes them write-behind, which
+# loses the queued completions if a worker dies.
+DARAJA_OUTBOX = {
+    "ASYNC": config("DARAJA_OUTBOX_ASYNC", False, cast=bool),
+    "BATCH_SIZE": config("DARAJA_OUTBOX_BATCH_SIZE", 100, cast=int),
+    "FLUSH_INTERVAL": config("DARAJA_OUTBOX_FLUSH_INTERVAL", 0.05, cast=float),
+}
+
+# Transaction read API, see daraja/views.py
+DARAJA_READ_CACHE_TIMEOUT = config("DARAJA_READ_CACHE_TIMEOUT", 30, cast=int)
+
+# Push channel for payment status, see daraja/notifier.py. Use daraja.notifier.CacheNotifier with a shared
+# cache when running more than one worker process.
+DARAJA_NOTIFIER = {
+    "BACKEND": config("DARAJA_NOTIFIER_BACKEND", "daraja.notifier.LocalNotifier"),
+    "POLL_INTERVAL": config("DARAJA_NOTIFIER_POLL_INTERVAL", 0.5, cast=float),
+}
+DARAJA_STATUS_WAIT_TIMEOUT = config("DARAJA_STATUS_WAIT_TIMEOUT", 25, cast=float)
+DARAJA_STATUS_STREAM_TIMEOUT = config("DARAJA_STATUS_STREAM_TIMEOUT", 300, cast=float)
+DARAJA_STATUS_HEARTBEAT = config("DARAJA_STATUS_HEARTBEAT", 15, cast=float)
+
+# Outbound webhooks to merchant systems, see daraja/webhooks.py
+DARAJA_WEBHOOKS = {
+    "MAX_WORKERS": config("DARAJA_WEBHOOKS_MAX_WORKERS", 8, cast=int),
+    "TIMEOUT": config("DARAJA_WEBHOOKS_TIMEOUT", 10, cast=float),
+    "MAX_ATTEMPTS": config("DARAJA_WEBHOOKS_MAX_ATTEMPTS", 8, cast=int),
+}
+
+# Append-only transaction event log, see daraja/events.py
+DARAJA_EVENT_LOG = {
+    "ASYNC": config("DARAJA_EVENT_LOG_ASYNC", True, cast=bool),
+    "BATCH_SIZE": config("DARAJA_EVENT_LOG_BATCH_SIZE", 500, cast=int),
+    "FLUSH_INTERVAL": config("DARAJA_EVENT_LOG_FLUSH_INTERVAL", 0.2, cast=float),
+}
+
+# Double-entry ledger of the completed transactions, see daraja/ledger.py
+DARAJA_LEDGER = {
+    "ASYNC": config("DARAJA_LEDGER_ASYNC", True, cast=bool),
+    "BATCH_SIZE": config("DARAJA_LEDGER_BATCH_SIZE", 200, cast=int),
+    "FLUSH_INTERVAL": config("DARAJA_LEDGER_FLUSH_INTERVAL", 0.5, cast=float),
+}
+
+# Archival of finalized transactions, see daraja/management/commands/archive_transactions.py
+DARAJA_ARCHIVE = {
+    "AFTER_DAYS": config("DARAJA_ARCHIVE_AFTER_DAYS", 90, cast=int),
+    "CHUNK_SIZE": config("DARAJA_ARCHIVE_CHUNK_SIZE", 1000, cast=int),
+    "DIRECTORY": config("DARAJA_ARCHIVE_DIRECTORY", str(BASE_DIR / "archive")),
+}
+
+# Streaming CSV / Parquet transaction exports, see daraja/export.py. Parquet exports need pyarrow, listed in
+# requirements-optional.txt.
+DARAJA_EXPORT = {
+    "CHUNK_SIZE": config("DARAJA_EXPORT_CHUNK_SIZE", 2000, cast=int),
+    "ROW_GROUP_SIZE": config("DARAJA_EXPORT_ROW_GROUP_SIZE", 50000, cast=int),
+    "PARQUET_COMPRESSION": config("DARAJA_EXPORT_PARQUET_COMPRESSION", "snappy"),
+}
+
+# Replica reads, see daraja/routers.py. Replicas further behind than MAX_LAG_SECONDS are skipped.
+DARAJA_REPLICAS = {
+    "ALIASES": [alias for alias in DATABASES if alias.startswith("replica_")],
+    "MAX_LAG_SECONDS": config("DARAJA_REPLICA_MAX_LAG_SECONDS", 5, cast=float),
+    "LAG_CHECK_INTERVAL": config("DARAJA_REPLICA_LAG_CHECK_INTERVAL", 5, cast=float),
+}
+
+# Latest known account balances, see daraja/balances.py. With PREFLIGHT, B2C payouts above the known
+# utility balance are rejected before calling Safaricom.
+DARAJA_BALANCES = {
+    "LOCAL_TTL": config("DARAJA_BALANCES_LOCAL_TTL", 1, cast=float),
+    "PREFLIGHT": config("DARAJA_BALANCES_PREFLIGHT", True, cast=bool),
+}
+
+# Idempotency-Key support on the checkout endpoints, see daraja/idempotency.py. CACHE must name a cache shared
+# by all workers when running more than one process.
+DARAJA_IDEMPOTENCY = {
+    "CACHE": config("DARAJA_IDEMPOTENCY_CACHE", "default"),
+    "TTL": config("DARAJA_IDEMPOTENCY_TTL", 24 * 60 * 60, cast=int),
+    "WAIT_TIMEOUT": config("DARAJA_IDEMPOTENCY_WAIT_TIMEOUT", 30, cast=float),
+}
+
+# Coalescing of identical outbound calls (token fetches, C2B url registration, QR codes), see daraja/singleflight.py
+DARAJA_SINGLE_FLIGHT = {
+    "SHARED_TTL": config("DARAJA_SINGLE_FLIGHT_SHARED_TTL", 5, cast=float),
+    "LOCK_TIMEOUT": config("DARAJA_SINGLE_FLIGHT_LOCK_TIMEOUT", 30, cast=float),
+}
+
+# Archive of raw Daraja requests, responses and callbacks, see daraja/payloads.py. The zstd CODEC needs the
+# zstandard package from requirements-optional.txt; without it blocks are zlib compressed. Off by default: the
+# payloads hold customer data, so enabling it needs a DIRECTORY outside the checkout.
+DARAJA_PAYLOAD_ARCHIVE = {
+    "ENABLED": config("DARAJA_PAYLOAD_ARCHIVE_ENABLED", False, cast=bool),
+    "DIRECTORY": config("DARAJA_PAYLOAD_ARCHIVE_DIRECTORY", None),
+    "BATCH_SIZE": config("DARAJA_PAYLOAD_ARCHIVE_BATCH_SIZE", 500, cast=int),
+    "FLUSH_INTERVAL": config("DARAJA_PAYLOAD_ARCHIVE_FLUSH_INTERVAL", 1, cast=float),
+    "SEGMENT_SIZE": config("DARAJA_PAYLOAD_ARCHIVE_SEGMENT_SIZE", 256 * 1024 * 1024, cast=int),
+    "CODEC": config("DARAJA_PAYLOAD_ARCHIVE_CODEC", "zstd"),
+}
+
+# Worker warm-up in MpesaConfig.ready(), see daraja/warmup.py. Enable it for web workers only; it prefetches the
+# access token and opens Daraja connections, which management commands do not need.
+DARAJA_WARMUP = {
+    "ENABLED": config("DARAJA_WARMUP_ENABLED", False, cast=bool),
+    "TOKEN": config("DARAJA_WARMUP_TOKEN", True, cast=bool),
+    "CONNECTIONS": config("DARAJA_WARMUP_CONNECTIONS", 2, cast=int),
+    "TIMEOUT": config("DARAJA_WARMUP_TIMEOUT", 10, cast=float),
+}
+
+# Pooled connections to Daraja, see daraja/gateway/base.py. TIMEOUT also sets how long Idempotency-Keys stay
+# locked while their checkout runs.
+DARAJA_HTTP = {
+    "POOL_SIZE": config("DARAJA_HTTP_POOL_SIZE", 10, cast=int),
+    "TIMEOUT": config("DARAJA_HTTP_TIMEOUT", 20, cast=float),
+}
+
+# Admission control on the checkout endpoints, see daraja/admission.py. On once DARAJA_ADMISSION_WORKER_THREADS
+# is set to the threads per worker process, so that RESERVED_FOR_CALLBACKS of them are always left for the
+# callback endpoints.
+DARAJA_ADMISSION_WORKER_THREADS = config("DARAJA_ADMISSION_WORKER_THREADS", 0, cast=int)
+DARAJA_ADMISSION = {
+    "ENABLED": config("DARAJA_ADMISSION_ENABLED", bool(DARAJA_ADMISSION_WORKER_THREADS), cast=bool),
+    "DEFAULT_LIMIT": config("DARAJA_ADMISSION_DEFAULT_LIMIT", 20, cast=int),
+    "WORKER_THREADS": DARAJA_ADMISSION_WORKER_THREADS,
+    "RESERVED_FOR_CALLBACKS": config("DARAJA_ADMISSION_RESERVED_FOR_CALLBACKS", 2, cast=int),
+    "MAX_LATENCY": config("DARAJA_ADMISSION_MAX_LATENCY", 15, cast=float),
+    "RETRY_AFTER": config("DARAJA_ADMISSION_RETRY_AFTER", 5, cast=int),
+}
+
+# Per lane request metrics for the callbacks and the outbound checkouts, see daraja/lanes.py and the worker
+# metrics endpoint. Threads are kept free for callbacks by DARAJA_ADMISSION, not by the lanes.
+DARAJA_LANES = {
+    "ENABLED": config("DARAJA_LANES_ENABLED", False, cast=bool),
+}
+
+# Velocity limits on B2C payouts and STK pushes, see daraja/velocity.py. Off unless DARAJA_VELOCITY_ENABLED is set.
+# Use the CacheCounter backend with a shared cache (Redis, Memcached) for the limits to hold across worker processes.
+DARAJA_VELOCITY = {
+    "ENABLED": config("DARAJA_VELOCITY_ENABLED", False, cast=bool),
+    "BACKEND": config("DARAJA_VELOCITY_BACKEND", "daraja.velocity.LocalCounter"),
+    "RULES": [
+        {
+            "NAME": "b2c_msisdn_hourly", "OPERATIONS": ["b2c"], "KEY": "msisdn", "WINDOW": 3600,
+            "LIMIT": config("DARAJA_VELOCITY_B2C_PER_MSISDN_HOURLY", 5, cast=int),
+        },
+        {
+            "NAME": "stk_msisdn_minute", "OPERATIONS": ["stk"], "KEY": "msisdn", "WINDOW": 60,
+            "LIMIT": config("DARAJA_VELOCITY_STK_PER_MSISDN_MINUTE", 3, cast=int),
+        },
+    ],
+}